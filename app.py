@@ -1,4 +1,12 @@
+from rao.config import SHARDS, TENANTS_FILE
 from rao.bot_app import RaoBot
 
 if __name__ == "__main__":
-    RaoBot().run()
+    if TENANTS_FILE:
+        from rao.tenants import run_tenants
+        run_tenants(TENANTS_FILE)
+    elif SHARDS > 0:
+        from rao.shards import ShardPoller
+        ShardPoller(SHARDS).run()
+    else:
+        RaoBot().run()
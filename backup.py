@@ -0,0 +1,46 @@
+"""
+Stream bot state (users, cooldown / quota counters, bans, username cache) to / from NDJSON.
+
+    python backup.py export rao-backup.ndjson     # "-" = stdout
+    python backup.py import rao-backup.ndjson     # "-" = stdin
+
+Uses the same DATA_DIR / STATE_BACKEND env as app.py. With the JSON backend
+stop the bot first, two processes would overwrite each other's files; for a
+running bot use the owner panel (💾 Backup / 📥 Restore) instead.
+"""
+import sys
+
+from rao.backup import export_ndjson, import_ndjson
+from rao.counters import CounterTable
+from rao.storage import open_store
+
+
+def main(argv: list) -> int:
+    if len(argv) != 3 or argv[1] not in ("export", "import"):
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    cmd, path = argv[1], argv[2]
+    store = open_store()
+    counters = CounterTable(store.paths.counters)
+    try:
+        if cmd == "export":
+            if path == "-":
+                counts = export_ndjson(store, sys.stdout, counters)
+            else:
+                with open(path, "w", encoding="utf-8") as f:
+                    counts = export_ndjson(store, f, counters)
+        else:
+            if path == "-":
+                counts = import_ndjson(store, sys.stdin, counters)
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    counts = import_ndjson(store, f, counters)
+    finally:
+        counters.close()
+        store.close()
+    print(f"✅ {cmd}: {counts}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,152 @@
+"""
+Engine benchmark: ENGINE=threads vs ENGINE=async against a local stub server.
+
+    python bench_engine.py                  # 300 /gen jobs, 1s upstream latency, 100 in flight
+    python bench_engine.py 500 2.0 200      # jobs, latency (s), in-flight limit (GEN_WORKERS)
+
+One stub HTTP server in this process plays both IMAGE_API (answers after
+`latency` seconds) and the Telegram Bot API. Each engine runs RaoBot in its
+own child process with a throw-away DATA_DIR: N users each /gen once, and the
+run ends when the stub has received N photos. Reported per engine: wall
+time, photos/s, peak thread count and peak RSS of the bot process.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 2048
+
+_photos = 0
+_lock = threading.Lock()
+
+
+class Stub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive for aiohttp / requests
+    disable_nagle_algorithm = True
+    latency = 1.0
+
+    def log_message(self, *args):
+        pass
+
+    def _body(self) -> bytes:
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            out = b""
+            while True:
+                size = int(self.rfile.readline().strip() or b"0", 16)
+                if not size:
+                    self.rfile.readline()
+                    return out
+                out += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _send(self, body: bytes, ctype: str = "application/json"):
+        self.send_response(200)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._route()
+
+    def do_POST(self):
+        self._route()
+
+    def _route(self):
+        global _photos
+        self._body()
+        path = self.path.split("?", 1)[0]
+        if path == "/image":
+            time.sleep(self.latency)
+            return self._send(PNG, "image/png")
+        if path == "/photos":
+            return self._send(json.dumps(_photos).encode())
+        method = path.rsplit("/", 1)[-1]
+        if method == "sendPhoto":
+            with _lock:
+                _photos += 1
+        if method in ("sendMessage", "sendPhoto", "sendAudio", "editMessageText"):
+            result = {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}}
+        elif method == "getChatMember":
+            result = {"status": "member", "user": {"id": 1, "is_bot": False, "first_name": "x"}}
+        else:
+            result = True
+        self._send(json.dumps({"ok": True, "result": result}).encode())
+
+
+def child(base: str, jobs: int) -> None:
+    # runs inside the bot process (ENGINE etc. already in the environment)
+    import resource
+    from telebot import apihelper, asyncio_helper
+    from rao.bot_app import RaoBot
+
+    apihelper.API_URL = asyncio_helper.API_URL = base + "/bot{0}/{1}"
+
+    peak_threads = [threading.active_count()]
+
+    def sample():
+        while True:
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            time.sleep(0.01)
+
+    threading.Thread(target=sample, daemon=True).start()
+
+    import requests
+    r = RaoBot()
+    r.S().update({"cooldown_seconds": 0, "daily_limit": 0, "join_gate_enabled": False})
+    t0 = time.perf_counter()
+    for uid in range(1, jobs + 1):
+        r.do_generate(uid, 10 ** 6 + uid, f"a cat number {uid}")
+    while requests.get(base + "/photos").json() < jobs:
+        time.sleep(0.05)
+    wall = time.perf_counter() - t0
+    print(json.dumps({
+        "wall": wall,
+        "rate": jobs / wall,
+        "threads": peak_threads[0],
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }))
+    os._exit(0)  # skip atexit shutdown; the DATA_DIR is thrown away
+
+
+def main():
+    global _photos
+    jobs = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    Stub.latency = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    inflight = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    srv.daemon_threads = True
+    srv.request_queue_size = 1024
+    srv.handle_error = lambda *args: None  # pooled keep-alive connections reset when a child exits
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{srv.server_address[1]}"
+
+    print(f"{jobs} jobs • upstream latency {Stub.latency:.1f}s • {inflight} in flight")
+    for engine in ("threads", "async"):
+        _photos = 0
+        with tempfile.TemporaryDirectory() as data_dir:
+            env = dict(os.environ, BOT_TOKEN="123:bench", DATA_DIR=data_dir, ENGINE=engine, IMAGE_API=base + "/image",
+                       GEN_WORKERS=str(inflight), GEN_QUEUE=str(jobs), DISPATCH_WORKERS="0")
+            out = subprocess.run([sys.executable, __file__, "--child", base, str(jobs)],
+                                 env=env, capture_output=True, text=True)
+        if out.returncode != 0:
+            print(out.stdout + out.stderr)
+            continue
+        res = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"  {engine:7s}: {res['wall']:6.2f}s • {res['rate']:6.1f} photos/s • "
+              f"{res['threads']:4d} threads • {res['rss_mb']:6.1f} MB RSS")
+    srv.shutdown()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child(sys.argv[2], int(sys.argv[3]))
+    else:
+        main()
@@ -0,0 +1,74 @@
+"""
+Memory benchmark: state["users"] as plain dicts vs UserProfile.
+
+    python bench_profiles.py            # 100k and 1M users
+    python bench_profiles.py 250000
+
+Profiles are built from a generated users.json document, like load_state() does.
+"""
+import gc
+import json
+import random
+import sys
+import tracemalloc
+
+from rao.profile import UserProfile
+
+STYLES = ["Pointillism", "Typography", "Line Art", "Caricature", "Adorable Kawaii",
+          "Watercolor", "Manga", "Surreal Painting", "Pixel Art", "Sticker", "Tlingit Art"]
+MODELS = ["flux", "sdxl"]
+
+
+def users_json(n: int) -> str:
+    rnd = random.Random(n)
+    users = {}
+    for i in range(n):
+        # ~30% of users ever generated something
+        hist = [f"prompt {rnd.randrange(10**6)}" for _ in range(rnd.choice((1, 3, 12)))] if rnd.random() < 0.3 else []
+        users[str(10**9 + i)] = {
+            "style": rnd.choice(STYLES),
+            "model": rnd.choice(MODELS),
+            "enhance": True,
+            "history": hist,
+            "last_gen_ts": 1_700_000_000 + i if hist else 0,
+            "daily_date": "2026-10-17" if hist else "",
+            "daily_used": len(hist),
+            "game_score": 0,
+            "tts_voice": "",
+            "created_ts": 1_700_000_000 + i,
+            "seen_ts": 1_700_000_000 + i,
+        }
+    return json.dumps(users)
+
+
+def measure(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    obj = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del obj
+    return size
+
+
+def run(n: int) -> None:
+    raw = users_json(n)
+    as_dict = measure(lambda: json.loads(raw))
+    as_prof = measure(lambda: {k: UserProfile.from_dict(v) for k, v in json.loads(raw).items()})
+
+    # lossless round trip
+    sample = json.loads(raw)
+    assert all(UserProfile.from_dict(v).to_dict() == v for v in sample.values())
+    del sample
+
+    mb = 1024 * 1024
+    print(f"{n:>9,} users | dict: {as_dict / mb:8.1f} MB ({as_dict // n} B/user) | "
+          f"UserProfile: {as_prof / mb:8.1f} MB ({as_prof // n} B/user) | "
+          f"-{100 * (1 - as_prof / as_dict):.0f}%")
+
+
+if __name__ == "__main__":
+    sizes = [int(x) for x in sys.argv[1:]] or [100_000, 1_000_000]
+    for n in sizes:
+        run(n)
@@ -0,0 +1,57 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+from .config import ADAPTIVE_WINDOW
+
+# fetch latency (seconds) treated as healthy / fully saturated
+LATENCY_OK = 5.0
+LATENCY_BAD = 60.0
+
+
+class AdaptiveCooldown:
+    """
+    Effective cooldown from a moving window of IMAGE_API fetches.
+    pressure = worst of
+      latency  : mean fetch time between LATENCY_OK (0) and LATENCY_BAD (1)
+      errors   : twice the failure rate (50% failures = fully saturated)
+      queue    : waiting jobs / queue limit
+    cooldown = min + (max - min) * pressure, with the owner's min/max.
+    """
+
+    def __init__(self, window: float = ADAPTIVE_WINDOW, maxlen: int = 200):
+        self.window = float(window)
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=maxlen)  # (when, seconds, ok)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self._samples.append((time.monotonic(), float(seconds), bool(ok)))
+
+    def health(self) -> Dict[str, float]:
+        """Window stats: samples, mean latency (s), error rate."""
+        cutoff = time.monotonic() - self.window
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            rows = list(self._samples)
+        if not rows:
+            return {"n": 0, "latency": 0.0, "errors": 0.0}
+        return {
+            "n": len(rows),
+            "latency": sum(r[1] for r in rows) / len(rows),
+            "errors": sum(1 for r in rows if not r[2]) / len(rows),
+        }
+
+    def pressure(self, depth: int, queue_limit: int) -> float:
+        h = self.health()
+        lat = (h["latency"] - LATENCY_OK) / (LATENCY_BAD - LATENCY_OK) if h["n"] else 0.0
+        err = h["errors"] * 2
+        q = depth / queue_limit if queue_limit > 0 else 0.0
+        return max(0.0, min(1.0, max(lat, err, q)))
+
+    def cooldown(self, settings: Dict[str, Any], depth: int, queue_limit: int) -> int:
+        lo = max(0, int(settings.get("cooldown_min", 3)))
+        hi = max(lo, int(settings.get("cooldown_max", 60)))
+        return int(round(lo + (hi - lo) * self.pressure(depth, queue_limit)))
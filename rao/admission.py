@@ -0,0 +1,51 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# A stage looks at the request context and returns None to pass it on,
+# or the reply for the user ("" = the stage already replied itself).
+Stage = Callable[[Dict[str, Any]], Optional[str]]
+
+
+class StageStats:
+    """Call count, total time and rejections per "action:stage", shared by all pipelines."""
+
+    def __init__(self):
+        self._rows: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, rejected: bool) -> None:
+        with self._lock:
+            row = self._rows.setdefault(name, [0, 0.0, 0])
+            row[0] += 1
+            row[1] += seconds
+            row[2] += int(rejected)
+
+    def snapshot(self) -> Dict[str, Tuple[int, float, int]]:
+        """name -> (calls, avg ms, rejections)"""
+        with self._lock:
+            return {k: (int(n), (t / n * 1000) if n else 0.0, int(r)) for k, (n, t, r) in self._rows.items()}
+
+
+class AdmissionPipeline:
+    """
+    Ordered checks for one action, cheapest first; stops at the first rejection
+    so an expensive stage (the join gate's getChatMember calls) only runs for
+    requests that would otherwise be served.
+    """
+
+    def __init__(self, action: str, stages: List[Tuple[str, Stage]], stats: StageStats):
+        self.action = action
+        self.stages = stages
+        self.stats = stats
+
+    def run(self, ctx: Dict[str, Any]) -> Optional[str]:
+        for name, stage in self.stages:
+            t = time.perf_counter()
+            reply = stage(ctx)
+            # stages share names across pipelines; keep their timings apart
+            self.stats.record(f"{self.action}:{name}", time.perf_counter() - t, reply is not None)
+            if reply is not None:
+                ctx["rejected_by"] = name
+                return reply
+        return None
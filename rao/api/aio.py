@@ -0,0 +1,133 @@
+"""
+Async twins of the upstream clients, used by ENGINE=async (rao/engine.py).
+Same URLs, timeouts, circuit breakers and response parsing as the blocking
+modules; every call takes the engine's shared aiohttp session. Only the job
+paths (image, TTS, search) have twins: the styles list and TTS voices are
+fetched by the blocking clients from menus and the warm-up.
+"""
+import asyncio
+from typing import Optional
+
+import aiohttp
+
+from ..config import MS_SEARCH_AI, TTS_API
+from ..utils import build_image_url
+from . import mirrors
+from .breaker import CircuitOpen, Deadline, breaker
+from .image_api import API_RETRIES, CHUNK, REQUEST_TIMEOUT, SpooledImage
+from .mirrors import Mirror
+from .search_api import json_answer
+from .tts_api import audio_url
+
+
+def _timeout(seconds: float) -> aiohttp.ClientTimeout:
+    return aiohttp.ClientTimeout(total=seconds)
+
+
+def _budget(deadline: Optional[Deadline], cap: float) -> aiohttp.ClientTimeout:
+    return _timeout(deadline.timeout(cap) if deadline else cap)
+
+
+async def _fetch_from(session: aiohttp.ClientSession, m: Mirror, prompt: str, model: str, style_title: str,
+                      timeout: float) -> SpooledImage:
+    pool = mirrors.MIRRORS
+    t0 = pool.started(m)
+    img: Optional[SpooledImage] = None
+    try:
+        async with session.get(build_image_url(m.url, prompt, model, style_title), timeout=_timeout(timeout)) as r:
+            r.raise_for_status()
+            img = SpooledImage(r.headers.get("Content-Length"))
+            async for chunk in r.content.iter_chunked(CHUNK):
+                img.write(chunk)
+            img.done()
+    except asyncio.CancelledError:
+        if img is not None:
+            img.close()
+        pool.dropped(m)  # lost a hedge race: the connection is closed, no verdict on the mirror
+        raise
+    except Exception:
+        if img is not None:
+            img.close()
+        pool.finished(m, t0, False)
+        raise
+    pool.finished(m, t0, True)
+    return img
+
+
+async def _hedged(session: aiohttp.ClientSession, prompt: str, model: str, style_title: str, timeout: float,
+                  deadline: Optional[Deadline]) -> SpooledImage:
+    # image_api._hedged on the loop: the losing request is cancelled, not just ignored
+    pool = mirrors.MIRRORS
+    first = pool.pick()
+    delay = pool.hedge_delay(first)
+    if delay is None or delay >= timeout:
+        return await _fetch_from(session, first, prompt, model, style_title, timeout)
+    tasks = [asyncio.ensure_future(_fetch_from(session, first, prompt, model, style_title, timeout))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return tasks[0].result()
+        second = pool.hedge(first)
+        if second is None:
+            return await tasks[0]
+        hedge_timeout = deadline.timeout(timeout) if deadline else timeout
+        tasks.append(asyncio.ensure_future(_fetch_from(session, second, prompt, model, style_title, hedge_timeout)))
+        pending = set(tasks)
+        last_err: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    if t is tasks[1]:
+                        pool.won(second)
+                    winner = t.result()
+                    for other in done - {t}:  # both answered in the same tick
+                        if other.exception() is None:
+                            other.result().close()
+                    return winner
+                last_err = t.exception()
+        raise last_err
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+
+async def fetch_image(session: aiohttp.ClientSession, prompt: str, model: str, style_title: str,
+                      deadline: Optional[Deadline] = None) -> SpooledImage:
+    last_err: Optional[Exception] = None
+    for attempt in range(API_RETRIES + 1):
+        timeout = deadline.timeout(REQUEST_TIMEOUT) if deadline else REQUEST_TIMEOUT
+        try:
+            with breaker("image").guard():
+                return await _hedged(session, prompt, model, style_title, timeout, deadline)
+        except Exception as e:
+            last_err = e
+            if isinstance(e, CircuitOpen) or breaker("image").is_open() or attempt == API_RETRIES:
+                break
+            if deadline and not deadline.allows(1 + attempt):
+                break
+            await asyncio.sleep(1 + attempt)
+    raise last_err if last_err else RuntimeError("Unknown image API error")
+
+
+async def tts_audio_bytes(session: aiohttp.ClientSession, text: str, voice: str,
+                          deadline: Optional[Deadline] = None) -> bytes:
+    with breaker("tts").guard():
+        async with session.get(TTS_API, params={"text": text, "voice": voice}, timeout=_budget(deadline, 60)) as r:
+            r.raise_for_status()
+            if "application/json" not in (r.headers.get("content-type") or "").lower():
+                return await r.read()
+            url = audio_url(await r.json(content_type=None))
+        async with session.get(url, timeout=_budget(deadline, 60)) as rr:
+            rr.raise_for_status()
+            return await rr.read()
+
+
+async def search_ai(session: aiohttp.ClientSession, query: str, deadline: Optional[Deadline] = None) -> str:
+    with breaker("search").guard():
+        async with session.get(MS_SEARCH_AI, params={"chat": query}, timeout=_budget(deadline, 60)) as r:
+            r.raise_for_status()
+            if "application/json" in (r.headers.get("content-type") or "").lower():
+                return json_answer(await r.json(content_type=None))
+            return (await r.text())[:3500]
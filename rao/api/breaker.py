@@ -0,0 +1,169 @@
+"""
+Circuit breakers and deadline budgets for the upstream APIs.
+
+One breaker per upstream (image, styles, tts, search), shared by the blocking
+and the async clients:
+  closed    : calls go through; failures in the last BREAKER_WINDOW seconds
+              are counted
+  open      : after BREAKER_MIN_CALLS calls with an error rate of at least
+              BREAKER_ERROR_RATE, calls fail at once with CircuitOpen for
+              BREAKER_OPEN_SECONDS
+  half_open : then one probe call is let through; success closes the
+              breaker, failure opens it again
+
+A Deadline is the time budget of one user action: every attempt's timeout
+and every retry's backoff come out of it, so a job gives up when its budget
+is spent instead of after retries x timeout.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+from ..config import BREAKER_WINDOW, BREAKER_MIN_CALLS, BREAKER_ERROR_RATE, BREAKER_OPEN_SECONDS
+
+
+class CircuitOpen(RuntimeError):
+    pass
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class Deadline:
+    def __init__(self, seconds: float):
+        self.seconds = float(seconds)
+        self.end = time.monotonic() + self.seconds
+
+    def left(self) -> float:
+        return max(0.0, self.end - time.monotonic())
+
+    def timeout(self, cap: float) -> float:
+        """Timeout for the next attempt: cap, or what is left of the budget if that is less."""
+        left = self.left()
+        if left <= 0:
+            raise DeadlineExceeded(f"gave up after {self.seconds:.0f}s")
+        return min(float(cap), left)
+
+    def allows(self, seconds: float) -> bool:
+        # worth waiting `seconds` (a retry backoff) and then trying again?
+        return self.left() > seconds + 1.0
+
+
+def deadline(seconds: Optional[float]) -> Optional[Deadline]:
+    return Deadline(seconds) if seconds else None
+
+
+def is_failure(e: BaseException) -> bool:
+    """Does e say the upstream is unhealthy? Not a 4xx answer (except 429), nor our own breaker / deadline."""
+    resp = getattr(e, "response", None)
+    status = getattr(resp, "status_code", None) or getattr(e, "status", None)
+    if isinstance(status, int) and 400 <= status < 500 and status != 429:
+        return False
+    return not isinstance(e, (CircuitOpen, DeadlineExceeded))
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, window: float = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 error_rate: float = BREAKER_ERROR_RATE, open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.window = float(window)
+        self.min_calls = max(1, int(min_calls))
+        self.error_rate = float(error_rate)
+        self.open_seconds = float(open_seconds)
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.trips = 0
+        self.rejected = 0
+        self._probe = False
+        self._calls: Deque[Tuple[float, bool]] = deque()  # (when, ok)
+        self._lock = threading.Lock()
+
+    def retry_in(self) -> float:
+        return max(0.0, self.opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self) -> None:
+        """Raise CircuitOpen unless a call may go out now."""
+        with self._lock:
+            if self.state == "open" and self.retry_in() <= 0:
+                self.state = "half_open"
+                self._probe = False
+            if self.state == "closed" or (self.state == "half_open" and not self._probe):
+                if self.state == "half_open":
+                    self._probe = True
+                return
+            self.rejected += 1
+            wait = self.retry_in()
+        raise CircuitOpen(f"{self.name} API is down, retry in {max(1, round(wait))}s")
+
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state == "open" and self.retry_in() > 0
+
+    def record(self, ok: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self.state == "half_open":
+                self._probe = False
+                if ok:
+                    self.state = "closed"
+                    self._calls.clear()
+                else:
+                    self._trip(now)
+                return
+            if self.state == "open":  # a call that started before the trip
+                return
+            self._calls.append((now, ok))
+            self._expire(now)
+            n = len(self._calls)
+            bad = sum(1 for _, good in self._calls if not good)
+            if n >= self.min_calls and bad / n >= self.error_rate:
+                self._trip(now)
+
+    def _trip(self, now: float) -> None:
+        self.state = "open"
+        self.opened_at = now
+        self.trips += 1
+        self._calls.clear()
+        print(f"⚠️ Circuit {self.name} open for {self.open_seconds:.0f}s")
+
+    def _expire(self, now: float) -> None:
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """allow() + record() around one upstream call (works inside coroutines too)."""
+        self.allow()
+        try:
+            yield
+        except Exception as e:
+            self.record(not is_failure(e))
+            raise
+        except BaseException:  # cancelled: no verdict on the host, but free the probe slot
+            with self._lock:
+                self._probe = False
+            raise
+        self.record(True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.monotonic())
+            n = len(self._calls)
+            bad = sum(1 for _, good in self._calls if not good)
+            state = self.state
+        return {"state": state, "calls": n, "errors": bad, "retry_in": self.retry_in() if state == "open" else 0.0,
+                "trips": self.trips, "rejected": self.rejected}
+
+
+BREAKERS: Dict[str, CircuitBreaker] = {name: CircuitBreaker(name) for name in ("image", "styles", "tts", "search")}
+
+
+def breaker(name: str) -> CircuitBreaker:
+    return BREAKERS[name]
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {name: b.stats() for name, b in BREAKERS.items()}
@@ -0,0 +1,229 @@
+"""
+Shared HTTP client for the upstream APIs (image, styles, TTS, search).
+
+One requests.Session per host, so connections (and their TLS handshakes) are
+kept alive and reused across calls and threads; HTTP_POOL_SIZE connections
+per host stay open. JSON endpoints ask for gzip. Host names are resolved
+once per HTTP_DNS_TTL seconds instead of on every new connection.
+
+stats() gives per host: requests, new connections, reused = requests that
+found an open connection (= handshakes saved), DNS lookups and cache hits.
+
+A streamed get() made inside `with cancel_scope(c):` can be aborted from another
+thread with c.cancel(): the socket is shut down, so the request fails right
+away, whether it is still connecting, waiting for headers or reading the body.
+"""
+import socket
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from ..config import HTTP_POOL_SIZE, HTTP_DNS_TTL
+
+JSON_HEADERS = {"Accept-Encoding": "gzip, deflate"}
+# images / audio are compressed already; gzip on top only costs CPU on both ends
+BINARY_HEADERS = {"Accept-Encoding": "identity"}
+
+_lock = threading.Lock()
+_sessions: Dict[str, requests.Session] = {}
+_stats: Dict[str, Dict[str, int]] = {}
+_dns: Dict[Tuple[str, int], Tuple[str, float]] = {}
+_local = threading.local()
+
+
+def _count(host: str, key: str, n: int = 1) -> None:
+    with _lock:
+        row = _stats.setdefault(host, {"requests": 0, "connects": 0, "errors": 0, "dns_lookups": 0, "dns_hits": 0})
+        row[key] += n
+
+
+def resolve(host: str, port: int) -> str:
+    """Cached address for host:port (first getaddrinfo result, kept HTTP_DNS_TTL seconds)."""
+    now = time.monotonic()
+    with _lock:
+        hit = _dns.get((host, port))
+    if hit and hit[1] > now:
+        _count(host, "dns_hits")
+        return hit[0]
+    addr = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0][4][0]
+    with _lock:
+        _dns[(host, port)] = (addr, now + HTTP_DNS_TTL)
+    _count(host, "dns_lookups")
+    return addr
+
+
+def forget(host: str, port: int) -> None:
+    with _lock:
+        _dns.pop((host, port), None)
+
+
+class Cancel:
+    """Abort handle for the requests made in one cancel_scope()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn: Any = None
+        self.cancelled = False
+        self.finished = False
+        self.reason = ""  # what cancel() was given, set together with `cancelled`
+
+    def cancel(self, reason: str = "cancelled") -> bool:
+        """Shut the live connection down; False if finish() or another cancel() came first."""
+        with self._lock:
+            if self.cancelled or self.finished:
+                return False
+            self.cancelled = True
+            self.reason = reason
+            # under the lock: _put_conn cannot hand the connection to another request meanwhile
+            sock = getattr(self._conn, "sock", None)
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+        return True
+
+    def finish(self) -> bool:
+        """The request is done; False if cancel() came first."""
+        with self._lock:
+            self.finished = True
+            self._conn = None
+            return not self.cancelled
+
+    def _attach(self, conn: Any) -> None:
+        with self._lock:
+            self._conn = conn
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise ConnectionAbortedError("request cancelled")
+
+
+class cancel_scope:
+    def __init__(self, cancel: Cancel):
+        self.cancel = cancel
+
+    def __enter__(self) -> Cancel:
+        _local.cancel = self.cancel
+        return self.cancel
+
+    def __exit__(self, *exc: Any) -> None:
+        _local.cancel = None
+
+
+def _scope() -> Optional[Cancel]:
+    return getattr(_local, "cancel", None)
+
+
+class _CountingConnection:
+    # mixed into urllib3's connections: connect to the cached address, count handshakes.
+    # Only the TCP connect uses the IP; TLS SNI / cert checks still see the host name.
+    def _new_conn(self):
+        host = self._dns_host
+        try:
+            self._dns_host = resolve(host, self.port)
+        except OSError:
+            self._dns_host = host  # let urllib3 raise its usual NameResolutionError
+        try:
+            sock = super()._new_conn()
+        except Exception:
+            forget(host, self.port)
+            raise
+        finally:
+            self._dns_host = host
+        _count(host, "connects")
+        c = _scope()
+        if c is not None and c.cancelled:  # cancelled while connecting: sock was not there to shut down
+            sock.close()
+            c.check()
+        return sock
+
+
+class _HTTPConnection(_CountingConnection, HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_CountingConnection, HTTPSConnection):
+    pass
+
+
+class _CancelPool:
+    # mixed into urllib3's pools: the connection a cancel_scope() request holds is the one cancel() shuts down
+    def _get_conn(self, timeout: Optional[float] = None):
+        c = _scope()
+        if c is not None:
+            c.check()
+        conn = super()._get_conn(timeout)
+        if c is not None:
+            c._attach(conn)
+        return conn
+
+    def _put_conn(self, conn) -> None:
+        # back in the pool (or dropped): another request may use it now, never shut it down from here on
+        c = _scope()
+        if c is not None:
+            c._attach(None)
+        super()._put_conn(conn)
+
+
+class _HTTPPool(_CancelPool, HTTPConnectionPool):
+    ConnectionCls = _HTTPConnection
+
+
+class _HTTPSPool(_CancelPool, HTTPSConnectionPool):
+    ConnectionCls = _HTTPSConnection
+
+
+class _Adapter(HTTPAdapter):
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": _HTTPPool, "https": _HTTPSPool}
+
+
+def _session(url: str) -> Tuple[str, requests.Session]:
+    parts = urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}"
+    with _lock:
+        s = _sessions.get(key)
+        if s is None:
+            s = requests.Session()
+            adapter = _Adapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            _sessions[key] = s
+    return parts.hostname or key, s
+
+
+def get(url: str, params: Optional[dict] = None, timeout: float = 60, json: bool = False,
+        stream: bool = False) -> requests.Response:
+    """requests.get through the pooled session of url's host; json=True for JSON endpoints."""
+    host, s = _session(url)
+    _count(host, "requests")
+    try:
+        return s.get(url, params=params, timeout=timeout, stream=stream,
+                     headers=JSON_HEADERS if json else BINARY_HEADERS)
+    except requests.RequestException:
+        _count(host, "errors")
+        raise
+
+
+def stats() -> Dict[str, Dict[str, int]]:
+    with _lock:
+        out = {h: dict(row) for h, row in _stats.items()}
+    for row in out.values():
+        row["reused"] = max(0, row["requests"] - row["errors"] - row["connects"])
+    return out
+
+
+def close() -> None:
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for s in sessions:
+        s.close()
@@ -1,21 +1,204 @@
+import heapq
+import tempfile
+import threading
 import time
-from typing import Optional
-import requests
-from ..config import IMAGE_API
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from typing import List, Optional, Tuple, Union
+from . import http, mirrors
+from .breaker import CircuitOpen, Deadline, DeadlineExceeded, breaker
+from .mirrors import Mirror
+from ..config import HTTP_POOL_SIZE, IMAGE_MAX_BYTES, IMAGE_SPOOL_BYTES
 from ..utils import build_image_url
 
 REQUEST_TIMEOUT = 120
 API_RETRIES = 2
+CHUNK = 64 * 1024
 
-def fetch_image_bytes(prompt: str, model: str, style_title: str) -> bytes:
-    url = build_image_url(IMAGE_API, prompt, model, style_title)
+# first bytes of the formats Telegram takes as a photo; anything else (HTML / JSON error page) is rejected
+IMAGE_MAGIC = ((b"\x89PNG\r\n\x1a\n", "png"), (b"\xff\xd8\xff", "jpg"), (b"GIF87a", "gif"), (b"GIF89a", "gif"))
+SNIFF_BYTES = 12
+
+# hedged fetches run both requests here; the calling worker only waits
+_hedge_pool = ThreadPoolExecutor(max_workers=2 * HTTP_POOL_SIZE, thread_name_prefix="rao-hedge")
+
+class BadImage(ValueError):
+    pass
+
+class _Expiry:
+    """One thread cancels every fetch whose deadline passed (a threading.Timer per fetch would double the threads)."""
+
+    def __init__(self):
+        self._heap: List[Tuple[float, int, http.Cancel]] = []
+        self._seq = 0
+        self._cv = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def add(self, deadline: Deadline, cancel: http.Cancel) -> None:
+        with self._cv:
+            self._seq += 1
+            heapq.heappush(self._heap, (deadline.end, self._seq, cancel))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="rao-fetch-expiry", daemon=True)
+                self._thread.start()
+            self._cv.notify()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cv:
+                while not self._heap:
+                    self._cv.wait()
+                end, _, cancel = self._heap[0]
+                wait = end - time.monotonic()
+                if wait > 0:
+                    self._cv.wait(wait)
+                    continue
+                heapq.heappop(self._heap)
+            cancel.cancel("deadline")  # a no-op when the fetch already finished
+
+_expiry = _Expiry()
+
+class _Lost(Exception):
+    # the other side of a hedge answered first and cancelled this one
+    pass
+
+def image_kind(head: bytes) -> str:
+    for magic, ext in IMAGE_MAGIC:
+        if head.startswith(magic):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    raise BadImage(f"not an image: {head[:32]!r}")
+
+class SpooledImage:
+    """
+    Downloaded image: kept in memory up to IMAGE_SPOOL_BYTES, then in a temp
+    file. write() refuses more than IMAGE_MAX_BYTES and checks the magic
+    bytes as soon as the first SNIFF_BYTES arrive, so an error page or an
+    oversize body is dropped without reading it to the end.
+    """
+
+    def __init__(self, content_length: Union[str, int, None] = None):
+        if content_length and int(content_length) > IMAGE_MAX_BYTES:
+            raise BadImage(f"image too large: {int(content_length)} bytes")
+        self.file = tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_BYTES)
+        self.size = 0
+        self.kind = ""
+        self._head = b""
+
+    @property
+    def name(self) -> str:
+        return f"rao.{self.kind or 'png'}"
+
+    def write(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self.size > IMAGE_MAX_BYTES:
+            raise BadImage(f"image too large: over {IMAGE_MAX_BYTES} bytes")
+        if not self.kind:
+            self._head = (self._head + chunk)[:SNIFF_BYTES]
+            if len(self._head) >= SNIFF_BYTES:
+                self.kind = image_kind(self._head)
+        self.file.write(chunk)
+
+    def done(self) -> "SpooledImage":
+        if not self.kind:  # body shorter than SNIFF_BYTES
+            self.kind = image_kind(self._head)
+        self.file.seek(0)
+        return self
+
+    def close(self) -> None:
+        self.file.close()
+
+def _fetch_from(m: Mirror, prompt: str, model: str, style_title: str, timeout: float,
+                cancel: Optional[http.Cancel] = None, deadline: Optional[Deadline] = None) -> SpooledImage:
+    # cancel is the hedge's handle on this side: the winner cancels the loser and settles its inflight itself.
+    # The deadline cancels it too: `timeout` only bounds each socket read, so a mirror trickling bytes
+    # would otherwise keep the download (and the user's action) going past its budget
+    pool = mirrors.MIRRORS
+    cancel = cancel or http.Cancel()
+    if deadline is not None:
+        _expiry.add(deadline, cancel)
+    t0 = pool.started(m)
+    img: Optional[SpooledImage] = None
+    try:
+        with http.cancel_scope(cancel), \
+                http.get(build_image_url(m.url, prompt, model, style_title), timeout=timeout, stream=True) as r:
+            r.raise_for_status()
+            img = SpooledImage(r.headers.get("Content-Length"))
+            for chunk in r.iter_content(CHUNK):
+                cancel.check()
+                img.write(chunk)
+            img.done()
+            if not cancel.finish():
+                raise _Lost(m.host)
+    except Exception as e:
+        if img is not None:
+            img.close()
+        if cancel.finish():
+            pool.finished(m, t0, False)
+        elif cancel.reason == "deadline":
+            pool.finished(m, t0, False)
+            raise DeadlineExceeded(f"gave up after {deadline.seconds:.0f}s") from e
+        elif not isinstance(e, _Lost):
+            raise _Lost(m.host) from e
+        raise
+    pool.finished(m, t0, True)
+    return img
+
+def _discard(f: Future) -> None:
+    # done-callback for the losing side of a hedge
+    if not f.cancelled() and f.exception() is None:
+        f.result().close()
+
+def _hedged(prompt: str, model: str, style_title: str, timeout: float, deadline: Optional[Deadline]) -> SpooledImage:
+    # one attempt: best mirror, plus a second one if the first is slower than its usual p95
+    pool = mirrors.MIRRORS
+    first = pool.pick()
+    delay = pool.hedge_delay(first)
+    if delay is None or delay >= timeout:
+        return _fetch_from(first, prompt, model, style_title, timeout, deadline=deadline)
+    cancels = (http.Cancel(), http.Cancel())
+    f1 = _hedge_pool.submit(_fetch_from, first, prompt, model, style_title, timeout, cancels[0], deadline)
+    try:
+        return f1.result(timeout=delay)
+    except FutureTimeout:
+        pass
+    second = pool.hedge(first)
+    if second is None:
+        return f1.result()
+    hedge_timeout = deadline.timeout(timeout) if deadline else timeout
+    f2 = _hedge_pool.submit(_fetch_from, second, prompt, model, style_title, hedge_timeout, cancels[1], deadline)
+    pending = {f1, f2}
+    last_err: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for f in done:
+            if f.exception() is None:
+                if f is f2:
+                    pool.won(second)
+                # shut the loser's socket now (even mid-headers), so it frees its worker and connection
+                # at once, and take it out of inflight here rather than when its thread gets round to it
+                loser, lost = (f2, second) if f is f1 else (f1, first)
+                if cancels[0 if loser is f1 else 1].cancel():
+                    pool.dropped(lost)
+                loser.add_done_callback(_discard)
+                return f.result()
+            last_err = f.exception()
+    raise last_err
+
+def fetch_image(prompt: str, model: str, style_title: str, deadline: Optional[Deadline] = None) -> SpooledImage:
+    """Streamed IMAGE_API download; the caller sends img.file and then calls img.close()."""
     last_err: Optional[Exception] = None
     for attempt in range(API_RETRIES + 1):
+        timeout = deadline.timeout(REQUEST_TIMEOUT) if deadline else REQUEST_TIMEOUT
         try:
-            r = requests.get(url, timeout=REQUEST_TIMEOUT)
-            r.raise_for_status()
-            return r.content
+            # an open breaker raises CircuitOpen here, and stops the retries
+            with breaker("image").guard():
+                return _hedged(prompt, model, style_title, timeout, deadline)
         except Exception as e:
             last_err = e
+            if isinstance(e, CircuitOpen) or breaker("image").is_open() or attempt == API_RETRIES:
+                break
+            if deadline and not deadline.allows(1 + attempt):
+                break
             time.sleep(1 + attempt)
     raise last_err if last_err else RuntimeError("Unknown image API error")
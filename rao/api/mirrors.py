@@ -0,0 +1,172 @@
+"""
+IMAGE_API mirror pool: IMAGE_API may list several equivalent endpoints
+(comma-separated). Every fetch goes to the mirror with the lowest
+EWMA latency x (1 + calls in flight); mirrors never measured go first so
+each one gets a latency estimate, and mirrors whose last call failed go last.
+
+Health: MIRROR_EJECT_AFTER failures in a row take a mirror out of rotation
+for BREAKER_OPEN_SECONDS (it is still used when every mirror is out).
+
+Hedging: if the chosen mirror has not answered within its own
+HEDGE_PERCENTILE latency, the same request goes to the next-best mirror and
+the first good answer wins; the other one's socket is shut down at once
+(even while it still waits for headers) and it leaves inflight. Hedges are
+capped at HEDGE_MAX_RATIO of all requests, so at p95 the extra load stays
+around 5%.
+"""
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from ..config import IMAGE_APIS, HEDGE_PERCENTILE, HEDGE_MAX_RATIO, MIRROR_EJECT_AFTER, BREAKER_OPEN_SECONDS
+
+EWMA_ALPHA = 0.2  # weight of the newest sample
+MIN_SAMPLES = 10  # latencies needed before a mirror's percentile is trusted for hedging
+MIN_HEDGE_DELAY = 0.5  # seconds
+KEEP = 200  # latencies kept per mirror
+IDLE_DECAY = 30.0  # seconds: an unused mirror's EWMA fades with this time constant, so it gets retried
+
+
+def _pct(sorted_s: List[float], p: float) -> float:
+    if not sorted_s:
+        return 0.0
+    return sorted_s[min(len(sorted_s) - 1, int(p * len(sorted_s)))]
+
+
+class Mirror:
+    __slots__ = ("url", "host", "ewma", "last", "latencies", "inflight", "requests", "errors", "fails_in_row",
+                 "ejected_until", "hedges", "hedge_wins", "cancelled")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.host = urlsplit(url).netloc or url
+        self.ewma = 0.0  # seconds; 0 = not measured yet
+        self.last = 0.0  # monotonic time of the last answer
+        self.latencies: Deque[float] = deque(maxlen=KEEP)
+        self.inflight = 0
+        self.requests = 0
+        self.errors = 0
+        self.fails_in_row = 0
+        self.ejected_until = 0.0
+        self.hedges = 0  # requests this mirror got as the hedge
+        self.hedge_wins = 0  # ... that answered first
+        self.cancelled = 0
+
+    def ejected(self, now: float) -> bool:
+        return self.ejected_until > now
+
+    def score(self, now: float) -> Tuple[bool, float]:
+        # a mirror whose last call failed goes behind every healthy one, however fast it failed
+        ewma = self.ewma * math.exp(-(now - self.last) / IDLE_DECAY)
+        return self.fails_in_row > 0, ewma * (1 + self.inflight)
+
+
+class MirrorPool:
+    def __init__(self, urls: Iterable[str] = IMAGE_APIS, percentile: float = HEDGE_PERCENTILE,
+                 max_ratio: float = HEDGE_MAX_RATIO, eject_after: int = MIRROR_EJECT_AFTER,
+                 eject_seconds: float = BREAKER_OPEN_SECONDS):
+        self.mirrors: List[Mirror] = [Mirror(u) for u in urls]
+        if not self.mirrors:
+            raise ValueError("IMAGE_API lists no URL")
+        self.percentile = float(percentile)
+        self.max_ratio = float(max_ratio)
+        self.eject_after = max(1, int(eject_after))
+        self.eject_seconds = float(eject_seconds)
+        self.fetches = 0
+        self.hedged = 0
+        self._lock = threading.Lock()
+
+    # ---- routing ----
+    def ranked(self) -> List[Mirror]:
+        now = time.monotonic()
+        with self._lock:
+            live = sorted((m for m in self.mirrors if not m.ejected(now)), key=lambda m: m.score(now))
+            out = sorted((m for m in self.mirrors if m.ejected(now)), key=lambda m: m.ejected_until)
+        return live + out
+
+    def pick(self, exclude: Iterable[Mirror] = ()) -> Optional[Mirror]:
+        """Best mirror not in exclude; an ejected one only as primary when nothing else is left."""
+        skip = set(id(m) for m in exclude)
+        now = time.monotonic()
+        for m in self.ranked():
+            if id(m) in skip or (skip and m.ejected(now)):
+                continue
+            return m
+        return None
+
+    def hedge_delay(self, m: Mirror) -> Optional[float]:
+        """Seconds to wait for m before hedging; None = no hedge for this fetch."""
+        with self._lock:
+            self.fetches += 1
+            if len(self.mirrors) < 2 or self.percentile <= 0 or len(m.latencies) < MIN_SAMPLES:
+                return None
+            if self.hedged + 1 > self.max_ratio * self.fetches:
+                return None
+            lat = sorted(m.latencies)
+        return max(MIN_HEDGE_DELAY, _pct(lat, self.percentile / 100))
+
+    def hedge(self, primary: Mirror) -> Optional[Mirror]:
+        """Second mirror for a hedged request, counted against the hedge budget."""
+        m = self.pick(exclude=(primary,))
+        if m is not None:
+            with self._lock:
+                self.hedged += 1
+                m.hedges += 1
+        return m
+
+    # ---- bookkeeping ----
+    def started(self, m: Mirror) -> float:
+        with self._lock:
+            m.inflight += 1
+            m.requests += 1
+        return time.perf_counter()
+
+    def finished(self, m: Mirror, t0: float, ok: bool) -> None:
+        seconds = time.perf_counter() - t0
+        with self._lock:
+            m.inflight -= 1
+            m.last = time.monotonic()
+            if ok:
+                m.fails_in_row = 0
+                m.latencies.append(seconds)
+                m.ewma = seconds if not m.ewma else EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * m.ewma
+                return
+            m.errors += 1
+            m.fails_in_row += 1
+            m.ewma = max(m.ewma * 2, seconds)
+            if m.fails_in_row >= self.eject_after:
+                m.fails_in_row = 0
+                m.ejected_until = time.monotonic() + self.eject_seconds
+                print(f"⚠️ Image mirror {m.host} ejected for {self.eject_seconds:.0f}s")
+
+    def dropped(self, m: Mirror) -> None:
+        # the losing side of a hedge: no verdict on the mirror
+        with self._lock:
+            m.inflight -= 1
+            m.cancelled += 1
+
+    def won(self, m: Mirror) -> None:
+        with self._lock:
+            m.hedge_wins += 1
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        out = []
+        with self._lock:
+            for m in self.mirrors:
+                lat = sorted(m.latencies)
+                out.append({"host": m.host, "ewma_ms": m.ewma * 1000, "p50_ms": _pct(lat, 0.50) * 1000,
+                            "p95_ms": _pct(lat, 0.95) * 1000, "inflight": m.inflight, "requests": m.requests,
+                            "errors": m.errors, "hedges": m.hedges, "hedge_wins": m.hedge_wins,
+                            "cancelled": m.cancelled, "ejected": m.ejected(now)})
+        return out
+
+    def totals(self) -> Dict[str, int]:
+        with self._lock:
+            return {"fetches": self.fetches, "hedged": self.hedged}
+
+
+MIRRORS = MirrorPool()
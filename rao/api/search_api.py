@@ -1,14 +1,20 @@
-import requests
+from typing import Optional
+from . import http
+from .breaker import Deadline, breaker
 from ..config import MS_SEARCH_AI
 
-def search_ai(query: str) -> str:
-    r = requests.get(MS_SEARCH_AI, params={"chat": query}, timeout=60)
-    r.raise_for_status()
+def json_answer(data) -> str:
+    # shared with api/aio.py
+    for k in ("answer", "result", "message", "text", "data"):
+        if k in data and isinstance(data[k], str):
+            return data[k][:3500]
+    return str(data)[:3500]
+
+def search_ai(query: str, deadline: Optional[Deadline] = None) -> str:
+    with breaker("search").guard():
+        r = http.get(MS_SEARCH_AI, params={"chat": query}, timeout=deadline.timeout(60) if deadline else 60, json=True)
+        r.raise_for_status()
     ctype = (r.headers.get("content-type") or "").lower()
     if "application/json" in ctype:
-        data = r.json()
-        for k in ("answer", "result", "message", "text", "data"):
-            if k in data and isinstance(data[k], str):
-                return data[k][:3500]
-        return str(data)[:3500]
+        return json_answer(r.json())
     return r.text[:3500]
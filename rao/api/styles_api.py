@@ -1,27 +1,43 @@
-import requests
-from typing import List
+from typing import List, Optional
 from ..config import STYLES_API
 from ..utils import style_display, now_ts
+from . import http
+from .breaker import breaker
 
-def load_styles(cache: dict) -> List[str]:
+FALLBACK_STYLES = [
+    "Pointillism", "Typography", "Line Art", "Caricature", "Adorable Kawaii",
+    "Watercolor", "Manga", "Surreal Painting", "Pixel Art", "Sticker", "Tlingit Art"
+]
+
+def cached_styles(cache: dict) -> Optional[List[str]]:
     styles = cache.get("styles", [])
     ts = int(cache.get("ts", 0))
     if isinstance(styles, list) and styles and (now_ts() - ts) < 86400:
         return [style_display(str(s)) for s in styles]
+    return None
+
+def store_styles(cache: dict, data: dict) -> Optional[List[str]]:
+    raw = data.get("styles", [])
+    if isinstance(raw, list) and raw:
+        cache["styles"] = raw
+        cache["ts"] = int(data.get("ts", now_ts()))
+        return [style_display(str(s)) for s in raw]
+    return None
+
+def load_styles(cache: dict) -> List[str]:
+    styles = cached_styles(cache)
+    if styles:
+        return styles
 
     try:
-        r = requests.get(STYLES_API, timeout=25)
-        r.raise_for_status()
-        data = r.json()
-        raw = data.get("styles", [])
-        if isinstance(raw, list) and raw:
-            cache["styles"] = raw
-            cache["ts"] = int(data.get("ts", now_ts()))
-            return [style_display(str(s)) for s in raw]
+        # open breaker: straight to the fallback list instead of a 25s wait
+        with breaker("styles").guard():
+            r = http.get(STYLES_API, timeout=25, json=True)
+            r.raise_for_status()
+        styles = store_styles(cache, r.json())
+        if styles:
+            return styles
     except Exception:
         pass
 
-    return [
-        "Pointillism", "Typography", "Line Art", "Caricature", "Adorable Kawaii",
-        "Watercolor", "Manga", "Surreal Painting", "Pixel Art", "Sticker", "Tlingit Art"
-    ]
+    return list(FALLBACK_STYLES)
@@ -1,14 +1,9 @@
-import requests
+from typing import Optional
+from . import http
+from .breaker import Deadline, breaker
 from ..config import TTS_API
 
-def get_voices() -> list:
-    # if API returns list when text missing
-    r = requests.get(TTS_API, timeout=30)
-    r.raise_for_status()
-    try:
-        data = r.json()
-    except Exception:
-        return []
+def voices_from(data) -> list:
     if isinstance(data, list):
         return data
     for k in ("voices", "voice_names", "data"):
@@ -16,19 +11,34 @@ def get_voices() -> list:
             return data[k]
     return []
 
-def tts_audio_bytes(text: str, voice: str) -> bytes:
-    # GET with params
-    r = requests.get(TTS_API, params={"text": text, "voice": voice}, timeout=60)
-    r.raise_for_status()
+def audio_url(j: dict) -> str:
+    url = j.get("url") or j.get("audio") or j.get("result") or ""
+    if not url:
+        raise RuntimeError("TTS API returned JSON but no audio url.")
+    return url
+
+def get_voices() -> list:
+    # if API returns list when text missing
+    with breaker("tts").guard():
+        r = http.get(TTS_API, timeout=30, json=True)
+        r.raise_for_status()
+    try:
+        data = r.json()
+    except Exception:
+        return []
+    return voices_from(data)
+
+def tts_audio_bytes(text: str, voice: str, deadline: Optional[Deadline] = None) -> bytes:
+    # GET with params; both requests share the deadline
+    with breaker("tts").guard():
+        r = http.get(TTS_API, params={"text": text, "voice": voice},
+                     timeout=deadline.timeout(60) if deadline else 60, json=True)
+        r.raise_for_status()
 
-    ctype = (r.headers.get("content-type") or "").lower()
-    if "application/json" in ctype:
-        j = r.json()
-        url = j.get("url") or j.get("audio") or j.get("result") or ""
-        if not url:
-            raise RuntimeError("TTS API returned JSON but no audio url.")
-        rr = requests.get(url, timeout=60)
-        rr.raise_for_status()
-        return rr.content
+        ctype = (r.headers.get("content-type") or "").lower()
+        if "application/json" in ctype:
+            rr = http.get(audio_url(r.json()), timeout=deadline.timeout(60) if deadline else 60)
+            rr.raise_for_status()
+            return rr.content
 
     return r.content
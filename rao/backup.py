@@ -0,0 +1,95 @@
+import json
+from typing import IO, Dict, Iterable, Iterator, Optional
+
+from .counters import CounterTable
+from .storage import StateStore
+from .utils import now_ts
+
+FORMAT_VERSION = 2  # v2: counter records
+
+
+def _line(rec: dict) -> str:
+    return json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def export_records(store: StateStore, counters: Optional[CounterTable] = None) -> Iterator[dict]:
+    """
+    Backup records, streamed straight from the store (one NDJSON line each):
+      {"t": "meta", "v": 2, "ts": ...}
+      {"t": "user", "id": "123", "v": {...profile...}}
+      {"t": "counter", "id": "123", "v": [last_gen_ts, day ordinal, daily_used]}
+      {"t": "ban", "id": "123"}
+      {"t": "uname", "k": "alice", "v": {"id": ..., "name": ..., "ts": ...}}
+    Counter rows come after the users: they are the live cooldown / quota,
+    the profile's last_gen_ts / daily_* only seed a missing row.
+    """
+    yield {"t": "meta", "v": FORMAT_VERSION, "ts": now_ts()}
+    for uid, profile in store.iter_users():
+        yield {"t": "user", "id": uid, "v": profile}
+    if counters is not None:
+        for uid, last, day, used in counters.items():
+            yield {"t": "counter", "id": str(uid), "v": [last, day, used]}
+    for uid in store.banned_ids():
+        yield {"t": "ban", "id": uid}
+    for uname, row in store.iter_unames():
+        yield {"t": "uname", "k": uname, "v": row}
+
+
+def export_ndjson(store: StateStore, fp: IO[str], counters: Optional[CounterTable] = None) -> Dict[str, int]:
+    counts = {"user": 0, "counter": 0, "ban": 0, "uname": 0}
+    for rec in export_records(store, counters):
+        fp.write(_line(rec))
+        if rec["t"] in counts:
+            counts[rec["t"]] += 1
+    return counts
+
+
+def _apply(store: StateStore, counters: Optional[CounterTable], rec: dict, counts: Dict[str, int]) -> None:
+    t = rec.get("t")
+    if t == "user" and isinstance(rec.get("v"), dict):
+        uid = str(rec["id"])
+        with store.user_lock(uid):
+            store.put_user(uid, rec["v"])
+            if counters is not None:
+                # reseeded from the restored profile unless a counter record follows
+                counters.delete(int(uid))
+    elif t == "counter" and counters is not None and isinstance(rec.get("v"), list):
+        counters.write(int(rec["id"]), *[int(x) for x in rec["v"][:3]])
+    elif t == "ban":
+        store.set_banned(str(rec["id"]), True)
+    elif t == "uname" and isinstance(rec.get("v"), dict):
+        store.put_uname(str(rec["k"]), rec["v"])
+    else:
+        counts["skipped"] += 1
+        return
+    counts[t] += 1
+
+
+def import_ndjson(store: StateStore, lines: Iterable, counters: Optional[CounterTable] = None) -> Dict[str, int]:
+    """
+    Stream records back into a live store. Restored users replace existing
+    profiles (and their counter rows). The write-behind persister saves as
+    usual while the restore runs; one flush at the end makes it durable.
+    """
+    counts = {"user": 0, "counter": 0, "ban": 0, "uname": 0, "skipped": 0}
+    for raw in lines:
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            rec = json.loads(raw)
+        except Exception:
+            counts["skipped"] += 1
+            continue
+        if rec.get("t") == "meta":
+            if int(rec.get("v", 0)) > FORMAT_VERSION:
+                raise RuntimeError(f"Backup format v{rec.get('v')} is newer than supported v{FORMAT_VERSION}")
+            continue
+        try:
+            _apply(store, counters, rec, counts)
+        except Exception:
+            counts["skipped"] += 1
+    store.flush()
+    return counts
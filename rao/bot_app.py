@@ -1,88 +1,229 @@
 
+import asyncio
+import atexit
+import os
 import random
 import io
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any, Tuple, List, Optional
 
+import requests
 import telebot
 from telebot import types
 
-from .config import BOT_TOKEN, OWNER_ID, BOT_NAME, BOT_USERNAME
-from .storage import load_state, persist_state
+from .config import (
+    GEN_WORKERS, GEN_QUEUE, QUEUE_STATUS_SECONDS, DISPATCH_WORKERS,
+    CALLBACK_WORKERS, CALLBACK_DEDUP_SECONDS, ENGINE, WEBHOOK_URL, GEN_DEADLINE, TTS_DEADLINE, SEARCH_DEADLINE,
+)
+from .storage import open_store
+from .tenants import Tenant, SharedCaches
+from .counters import CounterTable, day_num, today_num
+from .profile import UserProfile
 from .utils import now_ts, today_str, human_time, trim_prompt, enhance_prompt, clean_username
-from .api.image_api import fetch_image_bytes
-from .api.styles_api import load_styles
+from .backup import export_ndjson, import_ndjson
+from .retention import RetentionSweeper
+from .imagecache import ImageCache
+from .jobs import WorkerPool, AsyncPool, QueueFull, QueueClosed
+from .adaptive import AdaptiveCooldown
+from .admission import AdmissionPipeline, StageStats
+from .dispatcher import UpdateDispatcher, SerialWorkers
+from .router import Router, RouteStats
+from .engine import AsyncEngine
+from .webhook import WebhookServer
+from .api import aio, breaker, http, mirrors
+from .api.breaker import CircuitOpen, deadline
+from .api.image_api import fetch_image
+from .api.styles_api import cached_styles, load_styles
 from .api.tts_api import get_voices, tts_audio_bytes
 from .api.search_api import search_ai
 from .ui.panel import panel_text
 from .ui.texts import help_text, join_required_text
-from .ui.keyboards import main_kb, back_kb, gate_kb, owner_kb
+from .ui.keyboards import main_kb, back_kb, gate_kb, owner_kb, image_cache_kb
+
+
+SEEN_EVERY = 3600  # seconds between seen_ts bumps
 
 
 class RaoBot:
-    def __init__(self):
-        if not BOT_TOKEN:
+    def __init__(self, tenant: Optional[Tenant] = None, shared: Optional[SharedCaches] = None):
+        # ✅ tenant = token / branding / owner / DATA_DIR (env config by default, rao/tenants.py for several)
+        self.tenant = tenant or Tenant()
+        self.shared = shared or SharedCaches()
+        if not self.tenant.bot_token:
             raise RuntimeError("BOT_TOKEN missing. Set Railway ENV BOT_TOKEN.")
 
-        self.bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
-        self.state = load_state()
+        self._t0 = time.perf_counter()
+        # ✅ the dispatcher runs handlers itself (ordered per chat); telebot's own thread pool is only
+        # for DISPATCH_WORKERS=0 long polling. Webhook / async / shard workers always dispatch (see run)
+        threaded = DISPATCH_WORKERS <= 0 and not WEBHOOK_URL and ENGINE != "async"
+        self.bot = telebot.TeleBot(self.tenant.bot_token, parse_mode="HTML", threaded=threaded)
+        self.dispatcher: Optional[UpdateDispatcher] = None
+        self.cluster = None  # SHARDS mode: rao.shards.ShardLink to the poller, set by the worker
+        self.webhook: Optional[WebhookServer] = None
+        # ✅ json or sqlite (STATE_BACKEND); writes are write-behind, handlers never block on disk
+        self.store = open_store(data_dir=self.tenant.data_dir)
+        # ✅ cooldown / daily quota live in a mmap'ed table, updated in place (no save)
+        self.counters = CounterTable(self.store.paths.counters)
+        # ✅ drops inactive default profiles / stale usernames in small background batches
+        self.retention = RetentionSweeper(self.store, self.counters, self.S)
+        # ✅ finished images on disk, keyed by prompt / model / style; hits skip IMAGE_API.
+        # One cache for all tenants (SharedCaches); switching it off per model stays per tenant
+        self.image_cache = self.shared.image_cache(self.store.paths.image_cache)
+        self._holds_image_cache = True
+        # ✅ image fetches run on a worker pool, round-robin per user; handlers only enqueue.
+        # Admission: pool size = max in-flight IMAGE_API calls, bounded wait queue behind it.
+        # ✅ ENGINE=async: fetch + upload run as coroutines on one event loop, not a thread each
+        self.engine: Optional[AsyncEngine] = AsyncEngine(self.tenant.bot_token) if ENGINE == "async" else None
+        if self.engine is not None:
+            self.gen_pool = AsyncPool(self.engine.loop, self.gen_limits()[0])
+        else:
+            self.gen_pool = WorkerPool(self.gen_limits()[0])
+        self.adaptive = AdaptiveCooldown()  # fetch latency / errors feeding cooldown_mode=adaptive
+        self.queue_shown: Dict[Tuple[int, int], int] = {}  # (chat_id, status mid) -> position shown
+        # ✅ admission checks, cheapest first; the join gate (network) runs last
+        self.admission_stats = StageStats()
+        self.pipelines = self._build_pipelines()
+        # ✅ inline buttons: acked on receipt, executed here (in order per user), repeat taps dropped
+        self.cb_workers = SerialWorkers(CALLBACK_WORKERS, "rao-cb")
+        self._taps: Dict[Tuple[int, int, str], float] = {}
+        self._taps_lock = threading.Lock()
+        threading.Thread(target=self.queue_status_loop, name="rao-queue-status", daemon=True).start()
+        atexit.register(self.close)
         self.temp: Dict[str, Any] = {}
         self.owner_flow: Dict[str, Any] = {"await": None}
 
-        # ensure required containers exist
-        self.state.setdefault("users", {})
-        self.state.setdefault("bans", {"banned": []})
-        self.state.setdefault("styles_cache", {"styles": [], "ts": 0})
-        self.state.setdefault("uname_cache", {})
-        self.state.setdefault("settings", {})
-
+        # ✅ table-driven routing (commands / buttons / owner steps) with per-route latency
+        self.route_stats = RouteStats()
+        self.commands = Router(self.route_stats, "/")
+        self.callbacks = Router(self.route_stats)
+        self.owner_steps = Router(self.route_stats, "step:")
         self._register_handlers()
-        self._setup_commands()
+        self._register_callbacks()
+        self._register_owner_routes()
+        # ✅ commands / styles / voices / join targets are done by warmup() after polling starts
 
     # ----------------- state helpers -----------------
     def S(self) -> dict:
-        return self.state["settings"]
-
-    def save(self):
-        persist_state(self.state)
+        return self.store.settings
+
+    def close(self):
+        if self.webhook is not None:
+            self.webhook.close()
+        if self.dispatcher is not None:
+            self.dispatcher.stop()
+        self.cb_workers.close()
+        self.gen_pool.close()
+        if self.engine is not None:
+            self.engine.close()
+        self.retention.close()
+        if self._holds_image_cache:  # close() may run twice (run() and run_tenants)
+            self._holds_image_cache = False
+            self.shared.release_image_cache()
+        self.store.close()
+        self.counters.close()
+
+    def save(self, coll: Optional[str] = None, key: Any = None):
+        # mark what changed; no args = everything
+        self.store.mark_dirty(coll, None if key is None else str(key))
+        if coll in (None, "settings"):
+            self.replicate("settings", dict(self.S()))
+
+    def replicate(self, kind: str, *args: Any):
+        # SHARDS mode: global changes go to every other worker (rao/shards.py REPLICATED)
+        if self.cluster is not None:
+            self.cluster.publish(kind, *args)
+
+    def apply_replicated(self, kind: str, *args: Any):
+        # another worker's replicate(); applied locally, not published again
+        if kind == "settings":
+            self.S().clear()
+            self.S().update(args[0])
+            self.store.mark_dirty("settings")
+            self.gen_pool.resize(self.gen_limits()[0])
+        elif kind == "ban":
+            self.store.set_banned(args[0], args[1])
+        elif kind == "broadcast":
+            self.broadcast(args[0])
+        elif kind == "reset_all":
+            self.reset_all()
+        elif kind == "reset_user":
+            self.reset_user(args[0])
+        elif kind == "uname":
+            self.store.put_uname(args[0], args[1])
+
+    def reset_user(self, uid: int):
+        # profile and the hot counters: a reset user starts with no cooldown and a full quota
+        with self.store.user_lock(uid):
+            self.store.delete_user(uid)
+            self.counters.delete(uid)
+
+    def reset_all(self):
+        self.store.clear_users()
+        self.counters.clear()
 
     def is_owner(self, uid: int) -> bool:
-        return int(uid) == int(OWNER_ID)
+        return int(uid) == self.tenant.owner_id
 
     def banned(self, uid: int) -> bool:
-        return str(uid) in set(map(str, self.state["bans"].get("banned", [])))
+        return self.store.is_banned(uid)
 
     def ban(self, uid: int):
-        s = set(map(str, self.state["bans"].get("banned", [])))
-        s.add(str(uid))
-        self.state["bans"]["banned"] = list(s)
-        self.save()
+        self.store.set_banned(uid, True)
+        self.replicate("ban", uid, True)
 
     def unban(self, uid: int):
-        s = set(map(str, self.state["bans"].get("banned", [])))
-        s.discard(str(uid))
-        self.state["bans"]["banned"] = list(s)
-        self.save()
+        self.store.set_banned(uid, False)
+        self.replicate("ban", uid, False)
+
+    def broadcast(self, text: str) -> int:
+        sent = 0
+        for uid_str in self.store.user_ids():
+            try:
+                self.bot.send_message(int(uid_str), f"📢 <b>Broadcast</b>\n━━━━━━━━━━━━━━━━━━━━━━\n{text}")
+                sent += 1
+            except Exception:
+                pass
+        return sent
+
+    def shard_note(self) -> str:
+        if self.cluster is None:
+            return ""
+        return f" (shard {self.cluster.index + 1}/{self.cluster.shards}; the others run it too)"
 
     def cache_username(self, user):
         # Cache only if username exists
         try:
             if user and getattr(user, "username", None):
                 uname = clean_username(user.username)
-                self.state["uname_cache"][uname] = {
+                row = {
                     "id": int(user.id),
                     "name": (user.first_name or "") + ((" " + user.last_name) if user.last_name else ""),
                     "ts": now_ts()
                 }
-                self.save()
+                old = self.store.get_uname(uname)
+                self.store.put_uname(uname, row)
+                # SHARDS: /uid may run on any shard; send new / changed rows (and a refresh now and then)
+                if not old or old.get("id") != row["id"] or old.get("name") != row["name"] \
+                        or row["ts"] - int(old.get("ts", 0) or 0) >= SEEN_EVERY:
+                    self.replicate("uname", uname, row)
         except Exception:
             pass
 
     # ----------------- user profile -----------------
-    def get_user(self, uid: int) -> dict:
-        users = self.state["users"]
-        k = str(uid)
-        if k not in users:
-            users[k] = {
+    def get_user(self, uid: int) -> UserProfile:
+        u = self.store.get_user(uid)
+        if u is not None:
+            if now_ts() - int(u.seen_ts or 0) >= SEEN_EVERY:
+                self.touch_user(uid)
+            return u
+        with self.store.user_lock(uid):
+            u = self.store.get_user(uid)
+            if u is not None:
+                return u
+            return self.store.put_user(uid, {
                 "style": str(self.S().get("default_style", "Pointillism")),
                 "model": str(self.S().get("default_model", "flux")),
                 "enhance": bool(self.S().get("enhance_default", True)),
@@ -93,49 +234,189 @@ class RaoBot:
                 "game_score": 0,
                 "tts_voice": "",
                 "created_ts": now_ts(),
-            }
-            self.save()
-        return users[k]
+                "seen_ts": now_ts(),
+            })
+
+    def touch_user(self, uid: int):
+        # last-activity for the retention sweep; hourly resolution keeps it off the save path
+        with self.store.user_lock(uid):
+            u = self.store.get_user(uid)
+            if u is not None and now_ts() - int(u.seen_ts or 0) >= SEEN_EVERY:
+                u.seen_ts = now_ts()
+                self.save("users", uid)
+
+    def update_user(self, uid: int, **fields):
+        with self.store.user_lock(uid):
+            self.get_user(uid).update(fields)
+            self.save("users", uid)
+
+    def toggle_enhance(self, uid: int):
+        with self.store.user_lock(uid):
+            u = self.get_user(uid)
+            u["enhance"] = not bool(u.get("enhance", True))
+            self.save("users", uid)
 
     def add_history(self, uid: int, prompt: str):
-        u = self.get_user(uid)
-        h = u.get("history", [])
-        if not isinstance(h, list):
-            h = []
-        h.append(prompt)
-        u["history"] = h[-12:]
-        self.save()
+        with self.store.user_lock(uid):
+            self.get_user(uid).add_history(prompt)
+            self.save("users", uid)
 
     # ----------------- limits -----------------
-    def check_daily(self, uid: int) -> Tuple[bool, str]:
+    def hot_counters(self, uid: int) -> Tuple[int, int, int]:
+        # (last_gen_ts, day, daily_used); first sight seeds the row from the JSON profile
+        row = self.counters.read(uid)
+        if row is None:
+            u = self.get_user(uid)
+            row = (int(u.get("last_gen_ts", 0)), day_num(u.get("daily_date", "")), int(u.get("daily_used", 0)))
+            self.counters.write(uid, *row)
+        return row
+
+    def check_daily(self, uid: int, take: bool = True) -> Tuple[bool, str]:
+        # take=False only looks; take=True also uses one generation of today's quota
         limit = int(self.S().get("daily_limit", 0))
         if limit <= 0:
             return True, ""
-        u = self.get_user(uid)
-        today = today_str()
-        if u.get("daily_date") != today:
-            u["daily_date"] = today
-            u["daily_used"] = 0
-            self.save()
-        used = int(u.get("daily_used", 0))
-        if used >= limit:
-            return False, f"Daily limit reached: {used}/{limit}"
-        u["daily_used"] = used + 1
-        self.save()
+        with self.store.user_lock(uid):
+            last, day, used = self.hot_counters(uid)
+            today = today_num()
+            if day != today:
+                day, used = today, 0
+            if used >= limit:
+                return False, f"Daily limit reached: {used}/{limit}"
+            if take:
+                self.counters.write(uid, last, day, used + 1)
         return True, ""
 
-    def check_cooldown(self, uid: int) -> Tuple[bool, int]:
-        cd = int(self.S().get("cooldown_seconds", 8))
-        u = self.get_user(uid)
-        now = now_ts()
-        last = int(u.get("last_gen_ts", 0))
-        wait = (last + cd) - now
-        if wait > 0:
-            return False, wait
-        u["last_gen_ts"] = now
-        self.save()
+    def cooldown_seconds(self) -> int:
+        # live value: fixed setting, or derived from upstream health + queue depth
+        if self.S().get("cooldown_mode", "fixed") != "adaptive":
+            return int(self.S().get("cooldown_seconds", 8))
+        return self.adaptive.cooldown(self.S(), len(self.gen_pool.queue), self.gen_limits()[1])
+
+    def check_cooldown(self, uid: int, take: bool = True) -> Tuple[bool, int]:
+        cd = self.cooldown_seconds()
+        with self.store.user_lock(uid):
+            last, day, used = self.hot_counters(uid)
+            now = now_ts()
+            wait = (last + cd) - now
+            if wait > 0:
+                return False, wait
+            if take:
+                self.counters.write(uid, now, day, used)
         return True, 0
 
+    def take_slot(self, uid: int) -> Optional[str]:
+        # cooldown + quota are only spent once every admission stage passed: both or neither
+        with self.store.user_lock(uid):
+            ok, wait = self.check_cooldown(uid, take=False)
+            if not ok:
+                return f"⏳ Cooldown: wait <b>{human_time(wait)}</b>"
+            ok, msg = self.check_daily(uid, take=False)
+            if not ok:
+                return f"⛔️ {msg}"
+            self.check_cooldown(uid)
+            self.check_daily(uid)
+        return None
+
+    def refund_daily(self, uid: int):
+        # give back the quota taken by check_daily() for a job that never ran
+        with self.store.user_lock(uid):
+            last, day, used = self.hot_counters(uid)
+            if day == today_num() and used > 0:
+                self.counters.write(uid, last, day, used - 1)
+
+    # ----------------- admission -----------------
+    PROMPT_HELP = {
+        "generate": "❌ Prompt missing.\nExample: <code>/gen a realistic lion in jungle</code>",
+        "tts": "❌ Text missing.\nExample: <code>/tts hello Rao Sahab</code>",
+        "search": "❌ Query missing.\nExample: <code>/search Gaza</code>",
+    }
+
+    def _build_pipelines(self) -> Dict[str, AdmissionPipeline]:
+        stages = {
+            "ban": lambda c: "🚫 You are banned." if self.banned(c["uid"]) else None,
+            "maintenance": self._stage_maintenance,
+            "prompt": self._stage_prompt,
+            "upstream": self._stage_upstream,
+            "queue": lambda c: "🚦 Bot is busy right now (queue full).\n⏳ Try again in a minute." if self.queue_full() else None,
+            "cooldown": self._stage_cooldown,
+            "quota": self._stage_quota,
+            "gate": lambda c: None if self.ensure_access(c["chat_id"], c["uid"]) else "",
+        }
+        order = {
+            "generate": ("ban", "maintenance", "prompt", "upstream", "queue", "cooldown", "quota", "gate"),
+            "tts": ("ban", "maintenance", "prompt", "upstream", "gate"),
+            "search": ("ban", "maintenance", "prompt", "upstream", "gate"),
+        }
+        return {
+            action: AdmissionPipeline(action, [(name, stages[name]) for name in names], self.admission_stats)
+            for action, names in order.items()
+        }
+
+    def _stage_maintenance(self, ctx: dict) -> Optional[str]:
+        if self.S().get("bot_enabled", True) or self.is_owner(ctx["uid"]):
+            return None
+        return self.S().get("maintenance_text", "🚧 Bot OFF")
+
+    def _stage_prompt(self, ctx: dict) -> Optional[str]:
+        text = trim_prompt(ctx["text"]) if ctx["action"] == "generate" else (ctx["text"] or "").strip()
+        ctx["text"] = text
+        return None if text else self.PROMPT_HELP[ctx["action"]]
+
+    UPSTREAM = {"generate": "image", "tts": "tts", "search": "search"}
+
+    def _stage_upstream(self, ctx: dict) -> Optional[str]:
+        # breaker open: say so now instead of queueing a job that would fail anyway
+        b = breaker.breaker(self.UPSTREAM[ctx["action"]])
+        if not b.is_open():
+            return None
+        return f"🛠 {b.name.upper()} API is down right now.\n⏳ Try again in {max(1, round(b.retry_in()))}s."
+
+    def _stage_cooldown(self, ctx: dict) -> Optional[str]:
+        ok, wait = self.check_cooldown(ctx["uid"], take=False)
+        return None if ok else f"⏳ Cooldown: wait <b>{human_time(wait)}</b>"
+
+    def _stage_quota(self, ctx: dict) -> Optional[str]:
+        ok, msg = self.check_daily(ctx["uid"], take=False)
+        return None if ok else f"⛔️ {msg}"
+
+    def admit(self, action: str, chat_id: int, uid: int, text: str) -> Optional[str]:
+        """Run the action's pipeline; the cleaned text if admitted, else None (user already told why)."""
+        ctx = {"action": action, "chat_id": chat_id, "uid": uid, "text": text}
+        reply = self.pipelines[action].run(ctx)
+        if reply is None:
+            return ctx["text"]
+        if reply:
+            self.bot.send_message(chat_id, reply)
+        return None
+
+    # ----------------- generation queue -----------------
+    def gen_limits(self) -> Tuple[int, int]:
+        # (max in-flight IMAGE_API calls, max waiting jobs); owner settings override env
+        inflight = int(self.S().get("gen_max_inflight", 0) or GEN_WORKERS)
+        queue = int(self.S().get("gen_max_queue", 0) or GEN_QUEUE)
+        return max(1, inflight), max(1, queue)
+
+    def queue_full(self) -> bool:
+        return len(self.gen_pool.queue) >= self.gen_limits()[1]
+
+    def queue_text(self, pos: int, style: str, model: str) -> str:
+        return f"⏳ You are <b>#{pos}</b> in queue…\n🎨 <b>{style}</b> | 🧠 <b>{model}</b>"
+
+    def queue_status_loop(self):
+        # edit "#N in queue" into waiting status messages when positions move
+        while not self.gen_pool.queue.closed:
+            time.sleep(QUEUE_STATUS_SECONDS)
+            for tag, pos in self.gen_pool.queue.positions():
+                chat_id, mid, style, model = tag
+                if self.queue_shown.get((chat_id, mid)) == pos:
+                    continue
+                self.queue_shown[(chat_id, mid)] = pos
+                try:
+                    self.bot.edit_message_text(self.queue_text(pos, style, model), chat_id, mid)
+                except Exception:
+                    pass
+
     # ----------------- join gate -----------------
     def join_targets(self) -> List[dict]:
         lst = self.S().get("join_targets", [])
@@ -194,7 +475,7 @@ class RaoBot:
     # ----------------- UI -----------------
     def send_panel(self, chat_id: int, uid: int, edit_mid: Optional[int] = None):
         u = self.get_user(uid)
-        txt = panel_text(self.S(), u)
+        txt = panel_text(self.S(), u, self.tenant.bot_name)
         kb = main_kb(is_owner=self.is_owner(uid), enhance_on=bool(u.get("enhance", True)))
         if edit_mid:
             self.bot.edit_message_text(txt, chat_id, edit_mid, reply_markup=kb, disable_web_page_preview=True)
@@ -215,9 +496,38 @@ class RaoBot:
             self.bot.send_message(chat_id, txt, reply_markup=kb, disable_web_page_preview=True)
 
     # ----------------- styles/models menus -----------------
+    def _sync_styles(self) -> bool:
+        # the newer of the shared copy (fetched by any tenant) and the store's (kept for restarts) wins
+        cache, shared = self.store.styles_cache, self.shared.styles_cache
+        with self.shared.lock:
+            mine, theirs = int(cache.get("ts", 0) or 0), int(shared.get("ts", 0) or 0)
+            if theirs > mine:
+                cache.update(shared)
+            elif mine > theirs:
+                shared.update(cache)
+        return theirs > mine
+
+    def _fetch_styles(self) -> List[str]:
+        # runs once for all tenants (SharedCaches.once), without the lock
+        fresh = {"styles": [], "ts": 0}
+        styles = load_styles(fresh)
+        if fresh["ts"]:
+            with self.shared.lock:
+                self.shared.styles_cache.update(fresh)
+        return styles
+
+    def styles(self) -> List[str]:
+        changed = self._sync_styles()
+        styles = cached_styles(self.store.styles_cache)
+        if styles is None:
+            styles = self.shared.once("styles", self._fetch_styles)
+            changed = self._sync_styles() or changed
+        if changed:
+            self.save("styles_cache")
+        return styles
+
     def style_menu(self, page: int = 0) -> types.InlineKeyboardMarkup:
-        styles = load_styles(self.state["styles_cache"])
-        self.save()
+        styles = self.styles()
         per = 10
         total = len(styles)
         pages = max(1, (total + per - 1) // per)
@@ -260,30 +570,14 @@ class RaoBot:
         - BytesIO filename fix
         - proper try/except/finally
         """
-        if self.banned(uid):
-            self.bot.send_message(chat_id, "🚫 You are banned.")
-            return
-
-        if not self.S().get("bot_enabled", True) and not self.is_owner(uid):
-            self.bot.send_message(chat_id, self.S().get("maintenance_text", "🚧 Bot OFF"))
-            return
-
-        if not self.ensure_access(chat_id, uid):
-            return
-
-        prompt = trim_prompt(prompt)
-        if not prompt:
-            self.bot.send_message(chat_id, "❌ Prompt missing.\nExample: <code>/gen a realistic lion in jungle</code>")
-            return
-
-        ok, msg = self.check_daily(uid)
-        if not ok:
-            self.bot.send_message(chat_id, f"⛔️ {msg}")
+        prompt = self.admit("generate", chat_id, uid, prompt)
+        if prompt is None:
             return
 
-        ok2, wait = self.check_cooldown(uid)
-        if not ok2:
-            self.bot.send_message(chat_id, f"⏳ Cooldown: wait <b>{human_time(wait)}</b>")
+        # ✅ every stage passed: now spend cooldown + quota (rechecked under the user lock)
+        err = self.take_slot(uid)
+        if err:
+            self.bot.send_message(chat_id, err)
             return
 
         u = self.get_user(uid)
@@ -293,7 +587,7 @@ class RaoBot:
         final_prompt = enhance_prompt(prompt) if enh else prompt
 
         caption = (
-            f"🟦 <b>{BOT_NAME}</b>\n"
+            f"🟦 <b>{self.tenant.bot_name}</b>\n"
             f"━━━━━━━━━━━━━━━━━━━━━━\n"
             f"🎨 Style: <b>{style}</b>\n"
             f"🧠 Model: <b>{model}</b>\n"
@@ -301,21 +595,95 @@ class RaoBot:
             f"━━━━━━━━━━━━━━━━━━━━━━\n"
             f"📝 <b>Prompt:</b> {prompt}\n"
             f"━━━━━━━━━━━━━━━━━━━━━━\n"
-            f"🤖 {BOT_USERNAME}"
+            f"🤖 {self.tenant.bot_username}"
         )
 
-        status_msg = self.bot.send_message(chat_id, f"⚡️ Generating…\n🎨 <b>{style}</b> | 🧠 <b>{model}</b>")
+        # ✅ same prompt / model / style already fetched: send it from disk, no IMAGE_API call
+        if self.cache_on(model):
+            path = self.image_cache.get(ImageCache.key(final_prompt, model, style))
+            try:
+                f = open(path, "rb") if path else None
+            except OSError:
+                f = None  # evicted in between: fetch it
+            if f is not None:
+                # only the open() above means "not cached": a failed upload is not retried upstream
+                with f:
+                    try:
+                        self.bot.send_photo(chat_id, types.InputFile(f, "rao" + os.path.splitext(path)[1]),
+                                            caption=caption)
+                    except Exception as e:
+                        self.bot.send_message(chat_id, f"❌ Photo send failed.\n\nDebug: <code>{e}</code>")
+                        return
+                self.add_history(uid, prompt)
+                return
+
+        # estimate only; queue_status_loop corrects it as the queue moves
+        ahead = len(self.gen_pool.queue) + self.gen_pool.busy - self.gen_pool.size
+        if ahead >= 0:
+            status_msg = self.bot.send_message(chat_id, self.queue_text(ahead + 1, style, model))
+        else:
+            status_msg = self.bot.send_message(chat_id, f"⚡️ Generating…\n🎨 <b>{style}</b> | 🧠 <b>{model}</b>")
+        mid = status_msg.message_id
+        if ahead >= 0:
+            self.queue_shown[(chat_id, mid)] = ahead + 1
+
+        # ✅ handler returns now; a pool worker (or a coroutine) fetches and delivers the photo
+        job = self.agenerate_job if self.engine is not None else self.generate_job
+        try:
+            self.gen_pool.submit(uid, job, chat_id, uid, prompt, final_prompt, model, style,
+                                 caption, mid, tag=(chat_id, mid, style, model), limit=self.gen_limits()[1])
+        except (QueueFull, QueueClosed) as e:
+            # lost the race for the last slot, or shutting down: undo the quota and say so
+            self.refund_daily(uid)
+            self.queue_shown.pop((chat_id, mid), None)
+            if isinstance(e, QueueClosed):
+                text = "🔄 Bot is restarting.\n⏳ Try again in a minute."
+            else:
+                text = "🚦 Bot is busy right now (queue full).\n⏳ Try again in a minute."
+            try:
+                self.bot.edit_message_text(text, chat_id, mid)
+            except Exception:
+                pass
+
+    def cache_on(self, model: str) -> bool:
+        return self.image_cache.enabled and model not in self.S().get("image_cache_off", [])
 
+    def cache_image(self, img, final_prompt: str, model: str, style: str):
+        if not self.cache_on(model):
+            return
+        try:
+            self.image_cache.put(ImageCache.key(final_prompt, model, style), img.file, img.kind)
+        except OSError as e:
+            print(f"⚠️ Image cache write failed: {e}")
+
+    def generate_job(self, chat_id: int, uid: int, prompt: str, final_prompt: str, model: str, style: str,
+                     caption: str, status_mid: int):
+        if self.queue_shown.pop((chat_id, status_mid), None) is not None:
+            try:
+                self.bot.edit_message_text(f"⚡️ Generating…\n🎨 <b>{style}</b> | 🧠 <b>{model}</b>", chat_id, status_mid)
+            except Exception:
+                pass
+        t = time.perf_counter()
         try:
-            img = fetch_image_bytes(final_prompt, model=model, style_title=style)
+            try:
+                img = fetch_image(final_prompt, model=model, style_title=style, deadline=deadline(GEN_DEADLINE))
+            except CircuitOpen:
+                self.refund_daily(uid)  # nothing was fetched
+                raise
+            except Exception:
+                self.adaptive.record(time.perf_counter() - t, False)
+                raise
+            self.adaptive.record(time.perf_counter() - t, True)
+            self.cache_image(img, final_prompt, model, style)
 
             # ✅ history save after successful fetch
             self.add_history(uid, prompt)
 
-            photo = io.BytesIO(img)
-            photo.name = "rao.png"  # ✅ IMPORTANT for Telegram API stability
-
-            self.bot.send_photo(chat_id, photo, caption=caption)
+            # ✅ the spooled download goes up as is; the file name keeps Telegram API stable
+            try:
+                self.bot.send_photo(chat_id, types.InputFile(img.file, img.name), caption=caption)
+            finally:
+                img.close()
         except Exception as e:
             try:
                 self.bot.send_message(
@@ -327,27 +695,71 @@ class RaoBot:
                 pass
         finally:
             try:
-                self.bot.delete_message(chat_id, status_msg.message_id)
+                self.bot.delete_message(chat_id, status_mid)
+            except Exception:
+                pass
+
+    async def agenerate_job(self, chat_id: int, uid: int, prompt: str, final_prompt: str, model: str, style: str,
+                            caption: str, status_mid: int):
+        # generate_job for ENGINE=async: same steps through aiohttp and AsyncTeleBot
+        bot = self.engine.bot
+        if self.queue_shown.pop((chat_id, status_mid), None) is not None:
+            try:
+                await bot.edit_message_text(f"⚡️ Generating…\n🎨 <b>{style}</b> | 🧠 <b>{model}</b>", chat_id, status_mid)
+            except Exception:
+                pass
+        t = time.perf_counter()
+        try:
+            try:
+                img = await aio.fetch_image(await self.engine.http(), final_prompt, model=model, style_title=style,
+                                            deadline=deadline(GEN_DEADLINE))
+            except CircuitOpen:
+                self.refund_daily(uid)
+                raise
+            except Exception:
+                self.adaptive.record(time.perf_counter() - t, False)
+                raise
+            self.adaptive.record(time.perf_counter() - t, True)
+            await asyncio.to_thread(self.cache_image, img, final_prompt, model, style)
+
+            self.add_history(uid, prompt)
+
+            try:
+                await bot.send_photo(chat_id, types.InputFile(img.file, img.name), caption=caption)
+            finally:
+                img.close()
+        except Exception as e:
+            try:
+                await bot.send_message(
+                    chat_id,
+                    "❌ Image API busy / slow hai.\n⏳ 1-2 minute baad try karo.\n\n"
+                    f"Debug: <code>{e}</code>"
+                )
+            except Exception:
+                pass
+        finally:
+            try:
+                await bot.delete_message(chat_id, status_mid)
             except Exception:
                 pass
 
     def do_tts(self, chat_id: int, uid: int, text: str):
-        if not self.ensure_access(chat_id, uid):
-            return
-        text = (text or "").strip()
-        if not text:
-            self.bot.send_message(chat_id, "❌ Text missing.\nExample: <code>/tts hello Rao Sahab</code>")
+        text = self.admit("tts", chat_id, uid, text)
+        if text is None:
             return
 
         u = self.get_user(uid)
         voice = (u.get("tts_voice") or "").strip() or (self.S().get("tts_default_voice", "").strip())
         if not voice:
-            voices = get_voices()
+            voices = self.voice_list()
             voice = voices[0] if voices else "default"
 
         msg = self.bot.send_message(chat_id, f"🎙 Generating audio…\n<b>Voice:</b> <code>{voice}</code>")
+        if self.engine is not None:
+            self.engine.submit(self.atts_job(chat_id, text, voice, msg.message_id))
+            return
         try:
-            audio = tts_audio_bytes(text, voice)
+            audio = tts_audio_bytes(text, voice, deadline=deadline(TTS_DEADLINE))
             file = io.BytesIO(audio)
             file.name = "tts.mp3"
             self.bot.send_audio(chat_id, file, title="TTS", caption=f"🎙 <b>{voice}</b>")
@@ -358,24 +770,146 @@ class RaoBot:
         except Exception as e:
             self.bot.edit_message_text(f"❌ TTS error: <code>{e}</code>", chat_id, msg.message_id)
 
+    async def atts_job(self, chat_id: int, text: str, voice: str, status_mid: int):
+        bot = self.engine.bot
+        try:
+            file = io.BytesIO(await aio.tts_audio_bytes(await self.engine.http(), text, voice,
+                                                        deadline=deadline(TTS_DEADLINE)))
+            file.name = "tts.mp3"
+            await bot.send_audio(chat_id, file, title="TTS", caption=f"🎙 <b>{voice}</b>")
+            try:
+                await bot.delete_message(chat_id, status_mid)
+            except Exception:
+                pass
+        except Exception as e:
+            await bot.edit_message_text(f"❌ TTS error: <code>{e}</code>", chat_id, status_mid)
+
     def do_search(self, chat_id: int, uid: int, query: str):
-        if not self.ensure_access(chat_id, uid):
-            return
-        q = (query or "").strip()
-        if not q:
-            self.bot.send_message(chat_id, "❌ Query missing.\nExample: <code>/search Gaza</code>")
+        q = self.admit("search", chat_id, uid, query)
+        if q is None:
             return
 
         m = self.bot.send_message(chat_id, "🔎 Searching…")
+        if self.engine is not None:
+            self.engine.submit(self.asearch_job(chat_id, q, m.message_id))
+            return
         try:
-            ans = search_ai(q)
-            self.bot.edit_message_text(
-                f"🔎 <b>Microsoft Search AI</b>\n━━━━━━━━━━━━━━━━━━━━━━\n<b>Q:</b> {q}\n\n{ans}",
-                chat_id, m.message_id, disable_web_page_preview=True
-            )
+            ans = search_ai(q, deadline=deadline(SEARCH_DEADLINE))
+            self.bot.edit_message_text(self.search_text(q, ans), chat_id, m.message_id, disable_web_page_preview=True)
         except Exception as e:
             self.bot.edit_message_text(f"❌ Search error: <code>{e}</code>", chat_id, m.message_id)
 
+    async def asearch_job(self, chat_id: int, q: str, status_mid: int):
+        bot = self.engine.bot
+        try:
+            ans = await aio.search_ai(await self.engine.http(), q, deadline=deadline(SEARCH_DEADLINE))
+            await bot.edit_message_text(self.search_text(q, ans), chat_id, status_mid, disable_web_page_preview=True)
+        except Exception as e:
+            await bot.edit_message_text(f"❌ Search error: <code>{e}</code>", chat_id, status_mid)
+
+    @staticmethod
+    def search_text(q: str, ans: str) -> str:
+        return f"🔎 <b>Microsoft Search AI</b>\n━━━━━━━━━━━━━━━━━━━━━━\n<b>Q:</b> {q}\n\n{ans}"
+
+    def voice_list(self, refresh: bool = False) -> list:
+        # one fetch for every tenant in the process, outside the shared lock
+        with self.shared.lock:
+            voices = self.shared.voices
+        if refresh or not voices:
+            voices = self.shared.once("voices", self._fetch_voices)
+        return voices
+
+    def _fetch_voices(self) -> list:
+        voices = get_voices()
+        with self.shared.lock:
+            self.shared.voices = voices
+        return voices
+
+    def help_text(self) -> str:
+        t = self.tenant
+        return help_text(t.owner_name, t.owner_username, t.owner_link, t.owner_bio)
+
+    # ----------------- backup / restore -----------------
+    def send_backup(self, chat_id: int):
+        # streamed to a temp file, never held in memory
+        path = ""
+        try:
+            with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".ndjson", delete=False) as f:
+                path = f.name
+                counts = export_ndjson(self.store, f, self.counters)
+            with open(path, "rb") as f:
+                self.bot.send_document(
+                    chat_id, f, visible_file_name=f"rao-backup-{today_str()}.ndjson",
+                    caption=f"💾 <b>Backup</b>: {counts['user']} users • {counts['ban']} bans • {counts['uname']} usernames"
+                )
+        except Exception as e:
+            self.bot.send_message(chat_id, f"❌ Backup error: <code>{e}</code>")
+        finally:
+            if path:
+                try:
+                    os.remove(path)
+                except Exception:
+                    pass
+
+    def restore_document(self, chat_id: int, doc):
+        # streamed line by line from Telegram straight into the live store
+        try:
+            info = self.bot.get_file(doc.file_id)
+            url = f"https://api.telegram.org/file/bot{self.tenant.bot_token}/{info.file_path}"
+            with requests.get(url, stream=True, timeout=60) as r:
+                r.raise_for_status()
+                counts = import_ndjson(self.store, r.iter_lines(), self.counters)
+            self.bot.send_message(
+                chat_id,
+                f"✅ Restored: <b>{counts['user']}</b> users • <b>{counts['ban']}</b> bans • "
+                f"<b>{counts['uname']}</b> usernames (skipped {counts['skipped']})"
+            )
+        except Exception as e:
+            self.bot.send_message(chat_id, f"❌ Restore error: <code>{e}</code>")
+
+    def in_background(self, fn, *args):
+        threading.Thread(target=fn, args=args, daemon=True).start()
+
+    # ----------------- startup warm-up -----------------
+    def validate_join_targets(self):
+        for t in self.join_targets():
+            try:
+                self.bot.get_chat(t["chat"])
+            except Exception as e:
+                print(f"⚠️ Join target not reachable: {t['chat']} ({e})")
+
+    def warmup(self):
+        # everything that used to block startup, run concurrently
+        tasks = {
+            "store": self.store.warm,
+            "commands": self._setup_commands,
+            "styles": self.styles,
+            "voices": self.voice_list,
+            "join_targets": self.validate_join_targets,
+            "webhook": self.drop_webhook,
+        }
+        took: Dict[str, float] = {}
+
+        def timed(name, fn):
+            t = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                print(f"⚠️ Warm-up {name} failed: {e}")
+            took[name] = (time.perf_counter() - t) * 1000
+
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(tasks), thread_name_prefix="rao-warmup") as ex:
+            for name, fn in tasks.items():
+                ex.submit(timed, name, fn)
+        detail = ", ".join(f"{k} {v:.0f}ms" for k, v in took.items())
+        print(f"✅ Warm-up done in {(time.perf_counter() - t0) * 1000:.0f} ms ({detail})")
+
+    def drop_webhook(self):
+        # a webhook left over from WEBHOOK_URL mode makes getUpdates fail with 409
+        if not WEBHOOK_URL and self.cluster is None:
+            self.bot.remove_webhook()
+
     # ----------------- command menu -----------------
     def _setup_commands(self):
         try:
@@ -422,36 +956,66 @@ class RaoBot:
             return None
         return {"chat": left, "invite": right}
 
-    # ----------------- handlers -----------------
-    def _register_handlers(self):
-        b = self.bot
+    # ----------------- routing -----------------
+    def on_text(self, m):
+        try:
+            self.cache_username(m.from_user)
+        except Exception:
+            pass
 
-        @b.message_handler(func=lambda m: True, content_types=["text"])
-        def _catch_all(m):
-            # Cache username if possible
-            try:
-                self.cache_username(m.from_user)
-            except Exception:
-                pass
+        text = m.text or ""
+        if text.startswith("/"):
+            name, _, target = text.split(maxsplit=1)[0][1:].partition("@")
+            if target and target.lower() != self.tenant.bot_username.lstrip("@").lower():
+                return  # /cmd@OtherBot in a group
+            if self.commands.dispatch(name.lower(), m):
+                return
 
-            uid = m.from_user.id
+        # owner flow awaiting text
+        uid = m.from_user.id
+        if self.is_owner(uid) and self.owner_flow.get("await"):
+            step = self.owner_flow["await"]
+            self.owner_flow["await"] = None
+            self.owner_steps.dispatch(step, m)
+
+    @staticmethod
+    def _chat_of(x) -> int:
+        # Message or CallbackQuery
+        chat = getattr(x, "chat", None)
+        return chat.id if chat is not None else x.message.chat.id
+
+    def _mw_owner(self, x) -> bool:
+        if self.is_owner(x.from_user.id):
+            return True
+        self.bot.send_message(self._chat_of(x), "⛔️ Root only.")
+        return False
 
-            # owner flow awaiting text
-            if self.is_owner(uid) and self.owner_flow.get("await"):
-                step = self.owner_flow["await"]
-                self.owner_flow["await"] = None
-                self.handle_owner_text(m, step)
-                return
+    def _mw_ban(self, x) -> bool:
+        if not self.banned(x.from_user.id):
+            return True
+        self.bot.send_message(self._chat_of(x), "🚫 You are banned.")
+        return False
 
-            return
+    def _mw_access(self, x) -> bool:
+        return self.ensure_access(self._chat_of(x), x.from_user.id)
 
-        @b.message_handler(commands=["start"])
+    # ----------------- handlers -----------------
+    def _register_handlers(self):
+        b = self.bot
+        cmd = self.commands
+        for r in (self.commands, self.callbacks):
+            r.use("owner", self._mw_owner)
+            r.use("ban", self._mw_ban)
+            r.use("access", self._mw_access)
+
+        # ✅ one text entrypoint: commands via the route table, then owner text steps
+        @b.message_handler(content_types=["text"])
+        def _text(m):
+            self.on_text(m)
+
+        @cmd.route("start", "ban")
         def _start(m):
             uid = m.from_user.id
-            if self.banned(uid):
-                b.reply_to(m, "🚫 You are banned.")
-                return
-
             ok, missing, unknown = self.join_check(uid)
             if not ok:
                 b.send_message(
@@ -463,19 +1027,19 @@ class RaoBot:
                 return
             self.send_panel(m.chat.id, uid)
 
-        @b.message_handler(commands=["help"])
+        @cmd.route("help")
         def _help(m):
-            b.send_message(m.chat.id, help_text(), reply_markup=back_kb(), disable_web_page_preview=True)
+            b.send_message(m.chat.id, self.help_text(), reply_markup=back_kb(), disable_web_page_preview=True)
 
-        @b.message_handler(commands=["ping"])
+        @cmd.route("ping")
         def _ping(m):
             b.send_message(m.chat.id, "✅ Bot is online.")
 
-        @b.message_handler(commands=["id"])
+        @cmd.route("id")
         def _id(m):
             b.send_message(m.chat.id, f"🆔 <b>chat_id</b>: <code>{m.chat.id}</code>")
 
-        @b.message_handler(commands=["uid"])
+        @cmd.route("uid")
         def _uid(m):
             parts = m.text.split()
             if len(parts) < 2:
@@ -485,7 +1049,7 @@ class RaoBot:
                 )
                 return
             uname = clean_username(parts[1])
-            row = self.state["uname_cache"].get(uname)
+            row = self.store.get_uname(uname)
             if not row:
                 b.send_message(
                     m.chat.id,
@@ -497,7 +1061,7 @@ class RaoBot:
                 f"✅ <b>@{uname}</b>\n🆔 <code>{row.get('id')}</code>\n👤 {row.get('name','')}".strip()
             )
 
-        @b.message_handler(commands=["gen"])
+        @cmd.route("gen")
         def _gen(m):
             uid = m.from_user.id
             prompt = m.text.split(" ", 1)[1] if " " in m.text else ""
@@ -511,55 +1075,39 @@ class RaoBot:
 
             self.do_generate(m.chat.id, uid, prompt)
 
-        @b.message_handler(commands=["style"])
+        @cmd.route("style", "access")
         def _style(m):
-            uid = m.from_user.id
-            if not self.ensure_access(m.chat.id, uid):
-                return
             b.send_message(m.chat.id, "🎨 <b>Select Style</b>", reply_markup=self.style_menu(0))
 
-        @b.message_handler(commands=["model"])
+        @cmd.route("model", "access")
         def _model(m):
-            uid = m.from_user.id
-            if not self.ensure_access(m.chat.id, uid):
-                return
             b.send_message(m.chat.id, "🧠 <b>Select Model</b>", reply_markup=self.model_menu())
 
-        @b.message_handler(commands=["randomstyle"])
+        @cmd.route("randomstyle", "access")
         def _rs(m):
             uid = m.from_user.id
-            if not self.ensure_access(m.chat.id, uid):
-                return
-            styles = load_styles(self.state["styles_cache"])
-            self.save()
-            u = self.get_user(uid)
-            u["style"] = random.choice(styles)
-            self.save()
+            styles = self.styles()
+            self.update_user(uid, style=random.choice(styles))
             self.send_panel(m.chat.id, uid)
 
-        @b.message_handler(commands=["random"])
+        @cmd.route("random")
         def _random(m):
             uid = m.from_user.id
             prompt = m.text.split(" ", 1)[1] if " " in m.text else ""
             if not prompt:
                 b.send_message(m.chat.id, "Usage: <code>/random your prompt</code>")
                 return
-            styles = load_styles(self.state["styles_cache"])
-            self.save()
-            u = self.get_user(uid)
-            u["style"] = random.choice(styles)
-            self.save()
+            styles = self.styles()
+            self.update_user(uid, style=random.choice(styles))
             self.do_generate(m.chat.id, uid, prompt)
 
-        @b.message_handler(commands=["enhance"])
+        @cmd.route("enhance")
         def _enh(m):
             uid = m.from_user.id
-            u = self.get_user(uid)
-            u["enhance"] = not bool(u.get("enhance", True))
-            self.save()
+            self.toggle_enhance(uid)
             self.send_panel(m.chat.id, uid)
 
-        @b.message_handler(commands=["history"])
+        @cmd.route("history")
         def _hist(m):
             uid = m.from_user.id
             u = self.get_user(uid)
@@ -570,7 +1118,7 @@ class RaoBot:
             out = "📜 <b>Your last prompts</b>\n━━━━━━━━━━━━━━━━━━━━━━\n" + "\n".join([f"• {x}" for x in h[::-1]])
             b.send_message(m.chat.id, out)
 
-        @b.message_handler(commands=["current"])
+        @cmd.route("current")
         def _cur(m):
             uid = m.from_user.id
             u = self.get_user(uid)
@@ -580,21 +1128,21 @@ class RaoBot:
                 "━━━━━━━━━━━━━━━━━━━━━━\n"
                 f"🎨 <b>{u.get('style')}</b>\n"
                 f"🧠 <b>{u.get('model')}</b>\n"
-                f"✨ <b>{'ON ✅' if u.get('enhance') else 'OFF ❌'}</b>"
+                f"✨ <b>{'ON ✅' if u.get('enhance') else 'OFF ❌'}</b>\n"
+                f"⏱ Cooldown: <b>{self.cooldown_seconds()}s</b>"
+                f"{' (auto)' if self.S().get('cooldown_mode') == 'adaptive' else ''}"
             )
 
-        @b.message_handler(commands=["tts"])
+        @cmd.route("tts")
         def _tts(m):
             uid = m.from_user.id
             t = m.text.split(" ", 1)[1] if " " in m.text else ""
             self.do_tts(m.chat.id, uid, t)
 
-        @b.message_handler(commands=["voices"])
+        @cmd.route("voices", "access")
         def _voices(m):
-            if not self.ensure_access(m.chat.id, m.from_user.id):
-                return
             try:
-                voices = get_voices()
+                voices = self.voice_list()
                 if not voices:
                     b.send_message(m.chat.id, "❌ No voices returned by API.")
                     return
@@ -607,195 +1155,212 @@ class RaoBot:
             except Exception as e:
                 b.send_message(m.chat.id, f"❌ Error: <code>{e}</code>")
 
-        @b.message_handler(commands=["voice"])
+        @cmd.route("voice", "access")
         def _voice(m):
             uid = m.from_user.id
-            if not self.ensure_access(m.chat.id, uid):
-                return
             name = m.text.split(" ", 1)[1].strip() if " " in m.text else ""
             if not name:
                 b.send_message(m.chat.id, "Usage: <code>/voice VoiceName</code>\nUse /voices to list.")
                 return
-            u = self.get_user(uid)
-            u["tts_voice"] = name
-            self.save()
+            self.update_user(uid, tts_voice=name)
             b.send_message(m.chat.id, f"✅ Your voice set to: <code>{name}</code>")
 
-        @b.message_handler(commands=["search"])
+        @cmd.route("search")
         def _search(m):
             uid = m.from_user.id
             q = m.text.split(" ", 1)[1] if " " in m.text else ""
             self.do_search(m.chat.id, uid, q)
 
-        @b.message_handler(commands=["wordgame"])
+        @cmd.route("wordgame")
         def _wg(m):
             uid = m.from_user.id
             self.start_game(m.chat.id, uid)
 
+        @cmd.route("backup", "owner")
+        def _backup(m):
+            b.send_message(m.chat.id, "💾 Preparing backup…")
+            self.in_background(self.send_backup, m.chat.id)
+
+        @cmd.route("restore", "owner")
+        def _restore(m):
+            self.owner_flow["await"] = "restore"
+            b.send_message(m.chat.id, "📥 Send the backup <code>.ndjson</code> file.")
+
+        @b.message_handler(content_types=["document"])
+        def _doc(m):
+            if not (self.is_owner(m.from_user.id) and self.owner_flow.get("await") == "restore"):
+                return
+            self.owner_flow["await"] = None
+            b.send_message(m.chat.id, "📥 Restoring… (bot keeps running)")
+            self.in_background(self.restore_document, m.chat.id, m.document)
+
         # ---------------- Callback buttons ----------------
         @b.callback_query_handler(func=lambda c: True)
         def _cb(c):
-            uid = c.from_user.id
+            # ✅ ack first so the spinner stops at once; the work runs on the callback workers
             data = c.data or ""
-
+            dup = self.seen_tap(c.from_user.id, c.message.message_id if c.message else 0, data)
             try:
-                if data == "noop":
-                    b.answer_callback_query(c.id)
-                    return
+                b.answer_callback_query(c.id, None if dup else self.callback_toast(data))
+            except Exception:
+                pass
+            if dup or data == "noop" or c.message is None:
+                return
+            self.cb_workers.submit(c.from_user.id, self.handle_callback, c, data)
+
+    # ----------------- callbacks -----------------
+    CALLBACK_TOASTS = {
+        "toggle:enhance": "Updated",
+        "setstyle:": "Style updated",
+        "rand:style": "Random style set",
+        "setmodel:": "Model updated",
+        "gate:recheck": "⏳ Checking…",
+    }
+
+    def callback_toast(self, data: str) -> Optional[str]:
+        # keys ending in ":" match as prefixes
+        for k, v in self.CALLBACK_TOASTS.items():
+            if data == k or (k.endswith(":") and data.startswith(k)):
+                return v
+        return None
+
+    def seen_tap(self, uid: int, mid: int, data: str) -> bool:
+        """True if the same button on the same message was tapped within CALLBACK_DEDUP_SECONDS."""
+        now = time.monotonic()
+        key = (uid, mid, data)
+        with self._taps_lock:
+            if len(self._taps) > 4096:
+                self._taps = {k: t for k, t in self._taps.items() if now - t < CALLBACK_DEDUP_SECONDS}
+            last = self._taps.get(key)
+            if last is not None and now - last < CALLBACK_DEDUP_SECONDS:
+                return True
+            self._taps[key] = now
+        return False
 
-                if data == "back:main":
-                    self.send_panel(c.message.chat.id, uid, edit_mid=c.message.message_id)
-                    b.answer_callback_query(c.id)
-                    return
+    def handle_callback(self, c, data: str):
+        self.callbacks.dispatch(data, c)
 
-                if data == "menu:help":
-                    b.edit_message_text(
-                        help_text(), c.message.chat.id, c.message.message_id,
-                        reply_markup=back_kb(), disable_web_page_preview=True
-                    )
-                    b.answer_callback_query(c.id)
-                    return
+    def _register_callbacks(self):
+        cb = self.callbacks
 
-                if data == "menu:history":
-                    u = self.get_user(uid)
-                    h = u.get("history", [])
-                    txt = "📜 <b>Your last prompts</b>\n━━━━━━━━━━━━━━━━━━━━━━\n"
-                    txt += "\n".join([f"• {x}" for x in h[::-1]]) if h else "No history yet."
-                    b.edit_message_text(txt, c.message.chat.id, c.message.message_id,
-                                        reply_markup=back_kb(), disable_web_page_preview=True)
-                    b.answer_callback_query(c.id)
-                    return
+        @cb.route("back:main")
+        def _cb_back_main(c):
+            uid = c.from_user.id
+            self.send_panel(c.message.chat.id, uid, edit_mid=c.message.message_id)
 
-                if data == "menu:current":
-                    u = self.get_user(uid)
-                    txt = (
-                        "📌 <b>Current</b>\n━━━━━━━━━━━━━━━━━━━━━━\n"
-                        f"🎨 <b>{u.get('style')}</b>\n"
-                        f"🧠 <b>{u.get('model')}</b>\n"
-                        f"✨ <b>{'ON ✅' if u.get('enhance') else 'OFF ❌'}</b>"
-                    )
-                    b.edit_message_text(txt, c.message.chat.id, c.message.message_id,
-                                        reply_markup=back_kb(), disable_web_page_preview=True)
-                    b.answer_callback_query(c.id)
-                    return
+        @cb.route("menu:help")
+        def _cb_menu_help(c):
+            self.bot.edit_message_text(
+                self.help_text(), c.message.chat.id, c.message.message_id,
+                reply_markup=back_kb(), disable_web_page_preview=True
+            )
 
-                if data == "toggle:enhance":
-                    u = self.get_user(uid)
-                    u["enhance"] = not bool(u.get("enhance", True))
-                    self.save()
-                    self.send_panel(c.message.chat.id, uid, edit_mid=c.message.message_id)
-                    b.answer_callback_query(c.id, "Updated")
-                    return
+        @cb.route("menu:history")
+        def _cb_menu_history(c):
+            uid = c.from_user.id
+            u = self.get_user(uid)
+            h = u.get("history", [])
+            txt = "📜 <b>Your last prompts</b>\n━━━━━━━━━━━━━━━━━━━━━━\n"
+            txt += "\n".join([f"• {x}" for x in h[::-1]]) if h else "No history yet."
+            self.bot.edit_message_text(txt, c.message.chat.id, c.message.message_id,
+                                       reply_markup=back_kb(), disable_web_page_preview=True)
 
-                if data == "menu:style":
-                    if not self.ensure_access(c.message.chat.id, uid):
-                        b.answer_callback_query(c.id)
-                        return
-                    b.edit_message_text(
-                        "🎨 <b>Select Style</b>", c.message.chat.id, c.message.message_id,
-                        reply_markup=self.style_menu(0), disable_web_page_preview=True
-                    )
-                    b.answer_callback_query(c.id)
-                    return
+        @cb.route("menu:current")
+        def _cb_menu_current(c):
+            uid = c.from_user.id
+            u = self.get_user(uid)
+            txt = (
+                "📌 <b>Current</b>\n━━━━━━━━━━━━━━━━━━━━━━\n"
+                f"🎨 <b>{u.get('style')}</b>\n"
+                f"🧠 <b>{u.get('model')}</b>\n"
+                f"✨ <b>{'ON ✅' if u.get('enhance') else 'OFF ❌'}</b>"
+            )
+            self.bot.edit_message_text(txt, c.message.chat.id, c.message.message_id,
+                                       reply_markup=back_kb(), disable_web_page_preview=True)
 
-                if data.startswith("stylepage:"):
-                    page = int(data.split(":", 1)[1])
-                    b.edit_message_reply_markup(c.message.chat.id, c.message.message_id, reply_markup=self.style_menu(page))
-                    b.answer_callback_query(c.id)
-                    return
+        @cb.route("toggle:enhance")
+        def _cb_toggle_enhance(c):
+            uid = c.from_user.id
+            self.toggle_enhance(uid)
+            self.send_panel(c.message.chat.id, uid, edit_mid=c.message.message_id)
 
-                if data.startswith("setstyle:"):
-                    idx = int(data.split(":", 1)[1])
-                    styles = load_styles(self.state["styles_cache"])
-                    self.save()
-                    if 0 <= idx < len(styles):
-                        u = self.get_user(uid)
-                        u["style"] = styles[idx]
-                        self.save()
-                    self.send_panel(c.message.chat.id, uid, edit_mid=c.message.message_id)
-                    b.answer_callback_query(c.id, "Style updated")
-                    return
+        @cb.route("menu:style", "access")
+        def _cb_menu_style(c):
+            self.bot.edit_message_text(
+                "🎨 <b>Select Style</b>", c.message.chat.id, c.message.message_id,
+                reply_markup=self.style_menu(0), disable_web_page_preview=True
+            )
 
-                if data == "rand:style":
-                    styles = load_styles(self.state["styles_cache"])
-                    self.save()
-                    u = self.get_user(uid)
-                    u["style"] = random.choice(styles)
-                    self.save()
-                    self.send_panel(c.message.chat.id, uid, edit_mid=c.message.message_id)
-                    b.answer_callback_query(c.id, "Random style set")
-                    return
+        @cb.route("stylepage:")
+        def _cb_stylepage(c):
+            data = c.data or ""
+            page = int(data.split(":", 1)[1])
+            self.bot.edit_message_reply_markup(c.message.chat.id, c.message.message_id, reply_markup=self.style_menu(page))
 
-                if data == "menu:model":
-                    if not self.ensure_access(c.message.chat.id, uid):
-                        b.answer_callback_query(c.id)
-                        return
-                    b.edit_message_text(
-                        "🧠 <b>Select Model</b>", c.message.chat.id, c.message.message_id,
-                        reply_markup=self.model_menu(), disable_web_page_preview=True
-                    )
-                    b.answer_callback_query(c.id)
-                    return
+        @cb.route("setstyle:")
+        def _cb_setstyle(c):
+            uid = c.from_user.id
+            data = c.data or ""
+            idx = int(data.split(":", 1)[1])
+            styles = self.styles()
+            if 0 <= idx < len(styles):
+                self.update_user(uid, style=styles[idx])
+            self.send_panel(c.message.chat.id, uid, edit_mid=c.message.message_id)
+
+        @cb.route("rand:style")
+        def _cb_rand_style(c):
+            uid = c.from_user.id
+            styles = self.styles()
+            self.update_user(uid, style=random.choice(styles))
+            self.send_panel(c.message.chat.id, uid, edit_mid=c.message.message_id)
 
-                if data.startswith("setmodel:"):
-                    model = data.split(":", 1)[1]
-                    u = self.get_user(uid)
-                    u["model"] = model
-                    self.save()
-                    self.send_panel(c.message.chat.id, uid, edit_mid=c.message.message_id)
-                    b.answer_callback_query(c.id, "Model updated")
-                    return
+        @cb.route("menu:model", "access")
+        def _cb_menu_model(c):
+            self.bot.edit_message_text(
+                "🧠 <b>Select Model</b>", c.message.chat.id, c.message.message_id,
+                reply_markup=self.model_menu(), disable_web_page_preview=True
+            )
 
-                if data == "gen:ask":
-                    b.answer_callback_query(c.id)
-                    b.send_message(c.message.chat.id, "✍️ Send: <code>/gen your prompt</code>")
-                    return
+        @cb.route("setmodel:")
+        def _cb_setmodel(c):
+            uid = c.from_user.id
+            data = c.data or ""
+            model = data.split(":", 1)[1]
+            self.update_user(uid, model=model)
+            self.send_panel(c.message.chat.id, uid, edit_mid=c.message.message_id)
 
-                if data == "gate:recheck":
-                    ok, missing, unknown = self.join_check(uid)
-                    if ok:
-                        b.answer_callback_query(c.id, "✅ Verified! Now /start again")
-                        b.edit_message_text(
-                            "✅ Verified! Ab <b>/start</b> dubara bhejo.",
-                            c.message.chat.id, c.message.message_id,
-                            disable_web_page_preview=True
-                        )
-                    else:
-                        b.answer_callback_query(c.id, "❌ Not joined yet")
-                        b.edit_message_text(
-                            join_required_text(missing, unknown),
-                            c.message.chat.id, c.message.message_id,
-                            reply_markup=gate_kb(self.join_targets()),
-                            disable_web_page_preview=True
-                        )
-                    return
+        @cb.route("gen:ask")
+        def _cb_gen_ask(c):
+            self.bot.send_message(c.message.chat.id, "✍️ Send: <code>/gen your prompt</code>")
 
-                # Game callbacks
-                if data == "game:start":
-                    b.answer_callback_query(c.id)
-                    self.start_game(c.message.chat.id, uid)
-                    return
-                if data == "game:show":
-                    b.answer_callback_query(c.id)
-                    st = self.temp.get(str(uid), {})
-                    b.send_message(c.message.chat.id, f"😂 Meaning: <b>{st.get('meaning', 'No game')}</b>")
-                    return
+        @cb.route("gate:recheck")
+        def _cb_gate_recheck(c):
+            uid = c.from_user.id
+            ok, missing, unknown = self.join_check(uid)
+            if ok:
+                self.bot.edit_message_text(
+                    "✅ Verified! Ab <b>/start</b> dubara bhejo.",
+                    c.message.chat.id, c.message.message_id,
+                    disable_web_page_preview=True
+                )
+            else:
+                self.bot.edit_message_text(
+                    join_required_text(missing, unknown),
+                    c.message.chat.id, c.message.message_id,
+                    reply_markup=gate_kb(self.join_targets()),
+                    disable_web_page_preview=True
+                )
 
-                # Owner panel
-                if data.startswith("owner:"):
-                    b.answer_callback_query(c.id)
-                    if not self.is_owner(uid):
-                        b.send_message(c.message.chat.id, "⛔️ Root only.")
-                        return
-                    self.handle_owner_callback(c, data)
-                    return
+        @cb.route("game:start")
+        def _cb_game_start(c):
+            uid = c.from_user.id
+            self.start_game(c.message.chat.id, uid)
 
-                b.answer_callback_query(c.id)
-            except Exception:
-                try:
-                    b.answer_callback_query(c.id)
-                except Exception:
-                    pass
+        @cb.route("game:show")
+        def _cb_game_show(c):
+            uid = c.from_user.id
+            st = self.temp.get(str(uid), {})
+            self.bot.send_message(c.message.chat.id, f"😂 Meaning: <b>{st.get('meaning', 'No game')}</b>")
 
     # ----------------- word game -----------------
     def start_game(self, chat_id: int, uid: int):
@@ -818,43 +1383,62 @@ class RaoBot:
         )
 
     # ----------------- owner handlers -----------------
-    def handle_owner_callback(self, c, data: str):
-        chat_id = c.message.chat.id
-        mid = c.message.message_id
-
-        if data == "owner:panel":
+    def _register_owner_routes(self):
+        cb = self.callbacks
+        steps = self.owner_steps
+
+        @cb.route("owner:panel", "owner")
+        def _owner_panel(c):
+            chat_id = c.message.chat.id
+            mid = c.message.message_id
             self.send_owner_panel(chat_id, edit_mid=mid)
-            return
 
-        if data == "owner:toggle_bot":
+        @cb.route("owner:toggle_bot", "owner")
+        def _owner_toggle_bot(c):
+            chat_id = c.message.chat.id
+            mid = c.message.message_id
             self.S()["bot_enabled"] = not bool(self.S().get("bot_enabled", True))
-            self.save()
+            self.save("settings")
             self.send_owner_panel(chat_id, edit_mid=mid)
-            return
 
-        if data == "owner:set_cooldown":
+        @cb.route("owner:set_cooldown", "owner")
+        def _owner_set_cooldown(c):
+            chat_id = c.message.chat.id
             self.owner_flow["await"] = "cooldown"
-            self.bot.send_message(chat_id, "⏱️ Send cooldown seconds (example: <code>8</code>)")
-            return
+            h = self.adaptive.health()
+            self.bot.send_message(
+                chat_id,
+                f"⏱️ Now: <b>{self.cooldown_seconds()}s</b> ({self.S().get('cooldown_mode', 'fixed')})\n"
+                f"📈 Last {h['n']} fetches: {h['latency']:.1f}s avg • {h['errors'] * 100:.0f}% errors\n\n"
+                "Send cooldown seconds (example: <code>8</code>)\n"
+                "or adaptive bounds: <code>auto 3 60</code>"
+            )
 
-        if data == "owner:set_daily":
+        @cb.route("owner:set_daily", "owner")
+        def _owner_set_daily(c):
+            chat_id = c.message.chat.id
             self.owner_flow["await"] = "daily"
             self.bot.send_message(chat_id, "📅 Send daily limit (0=unlimited). Example: <code>40</code>")
-            return
 
-        if data == "owner:toggle_gate":
+        @cb.route("owner:toggle_gate", "owner")
+        def _owner_toggle_gate(c):
+            chat_id = c.message.chat.id
+            mid = c.message.message_id
             self.S()["join_gate_enabled"] = not bool(self.S().get("join_gate_enabled", True))
-            self.save()
+            self.save("settings")
             self.send_owner_panel(chat_id, edit_mid=mid)
-            return
 
-        if data == "owner:toggle_strict":
+        @cb.route("owner:toggle_strict", "owner")
+        def _owner_toggle_strict(c):
+            chat_id = c.message.chat.id
+            mid = c.message.message_id
             self.S()["join_gate_strict"] = not bool(self.S().get("join_gate_strict", True))
-            self.save()
+            self.save("settings")
             self.send_owner_panel(chat_id, edit_mid=mid)
-            return
 
-        if data == "owner:add_join":
+        @cb.route("owner:add_join", "owner")
+        def _owner_add_join(c):
+            chat_id = c.message.chat.id
             self.owner_flow["await"] = "add_join"
             self.bot.send_message(
                 chat_id,
@@ -865,14 +1449,16 @@ class RaoBot:
                 "<code>-1001234567890 | https://t.me/+InviteLink</code>",
                 disable_web_page_preview=True
             )
-            return
 
-        if data == "owner:remove_join":
+        @cb.route("owner:remove_join", "owner")
+        def _owner_remove_join(c):
+            chat_id = c.message.chat.id
             self.owner_flow["await"] = "remove_join"
             self.bot.send_message(chat_id, "➖ Send chat to remove (example: <code>@channel</code> OR <code>-100...</code>)")
-            return
 
-        if data == "owner:list_join":
+        @cb.route("owner:list_join", "owner")
+        def _owner_list_join(c):
+            chat_id = c.message.chat.id
             targets = self.join_targets()
             if not targets:
                 self.bot.send_message(chat_id, "📋 No join targets set.")
@@ -881,82 +1467,243 @@ class RaoBot:
             for i, t in enumerate(targets, 1):
                 txt += f"{i}) <code>{t['chat']}</code>\n   🔗 {t.get('invite','')}\n"
             self.bot.send_message(chat_id, txt, disable_web_page_preview=True)
-            return
 
-        if data == "owner:models":
+        @cb.route("owner:models", "owner")
+        def _owner_models(c):
+            chat_id = c.message.chat.id
             self.owner_flow["await"] = "models"
             self.bot.send_message(chat_id, "🧠 Send models list comma-separated.\nExample: <code>flux, sdxl</code>")
-            return
 
-        if data == "owner:ui_text":
+        @cb.route("owner:ui_text", "owner")
+        def _owner_ui_text(c):
+            chat_id = c.message.chat.id
             self.owner_flow["await"] = "ui_text"
             self.bot.send_message(chat_id, "📝 Send UI text like:\n<code>Title | Subtitle | Footer</code>")
-            return
 
-        if data == "owner:refresh_styles":
-            self.state["styles_cache"]["styles"] = []
-            self.state["styles_cache"]["ts"] = 0
-            self.save()
+        @cb.route("owner:refresh_styles", "owner")
+        def _owner_refresh_styles(c):
+            chat_id = c.message.chat.id
+            with self.shared.lock:
+                for cache in (self.store.styles_cache, self.shared.styles_cache):
+                    cache["styles"] = []
+                    cache["ts"] = 0
+            self.save("styles_cache")
             self.bot.send_message(chat_id, "✅ Styles cache cleared. Next style menu will refetch.")
-            return
 
-        if data == "owner:stats":
-            users = self.state["users"]
-            bans = self.state["bans"].get("banned", [])
+        @cb.route("owner:stats", "owner")
+        def _owner_stats(c):
+            chat_id = c.message.chat.id
             txt = (
                 "📊 <b>Stats</b>\n━━━━━━━━━━━━━━━━━━━━━━\n"
-                f"👥 Users: <b>{len(users)}</b>\n"
-                f"🚫 Banned: <b>{len(bans)}</b>\n"
+                f"👥 Users: <b>{self.store.user_count()}</b>"
+                f"{f' in shard {self.cluster.index + 1}/{self.cluster.shards}' if self.cluster else ''}\n"
+                f"🚫 Banned: <b>{self.store.ban_count()}</b>\n"
                 f"🤖 Bot: <b>{'ON' if self.S().get('bot_enabled', True) else 'OFF'}</b>\n"
                 f"🔒 Gate: <b>{'ON' if self.S().get('join_gate_enabled', True) else 'OFF'}</b>\n"
+                f"🧹 Retention: <b>{self.S().get('retention_days', 0) or '∞'}</b>d users • "
+                f"<b>{self.S().get('uname_ttl_days', 0) or '∞'}</b>d usernames • "
+                f"dropped <b>{self.retention.stats['users_dropped']}</b> / "
+                f"<b>{self.retention.stats['unames_expired']}</b>\n"
+                f"🚦 Gen: <b>{self.gen_pool.busy}</b>/{self.gen_pool.size} running • "
+                f"<b>{len(self.gen_pool.queue)}</b>/{self.gen_limits()[1]} queued\n"
             )
+            if self.engine is not None:
+                e = self.engine.stats()
+                txt += (
+                    f"⚙️ Engine: <b>async</b> • TTS/search {e['inflight']} in flight "
+                    f"(peak {e['peak']}) • {e['done']} done, {e['failed']} failed\n"
+                )
+            if self.dispatcher is not None:
+                d = self.dispatcher.stats()
+                busiest = ", ".join(f"<code>{k}</code> {n}" for k, n in d["busiest"]) or "-"
+                txt += (
+                    f"📨 Updates: <b>{d['pending']}</b> pending in {d['keys']} chats • "
+                    f"{d['running']}/{d['workers']} workers busy • {d['processed']} done\n"
+                    f"   busiest: {busiest}\n"
+                )
+            if self.cluster is not None and self.cluster.poller:
+                txt += "🧩 Shards (pending • sent • polling stalls • restarts):\n" + "\n".join(
+                    f"  {r['shard'] + 1}{' ⛔' if not r['up'] else ''}: {r['pending']} • {r['sent']} • "
+                    f"{r['stalls']} • {r['restarts']}"
+                    for r in self.cluster.poller
+                ) + "\n"
+            if self.webhook is not None:
+                w = self.webhook.stats
+                txt += (
+                    f"🪝 Webhook: {w['accepted']} accepted • {w['busy']} busy (503) • "
+                    f"{w['duplicate']} duplicate • {w['forbidden']} bad secret • {w['bad']} malformed\n"
+                )
+            txt += "🧯 Circuits: " + " • ".join(
+                f"{name} <b>{b['state'].upper()}</b>"
+                + (f" {b['retry_in']:.0f}s" if b["state"] == "open" else f" {b['errors']}/{b['calls']} err")
+                + (f" ({b['trips']} trips, {b['rejected']} rejected)" if b["trips"] else "")
+                for name, b in breaker.stats().items()
+            ) + "\n"
+            m = mirrors.MIRRORS.totals()
+            txt += f"🪞 Image mirrors (ewma • p50/p95 • requests/errors • hedges won) • {m['hedged']}/{m['fetches']} hedged:\n"
+            txt += "\n".join(
+                f"  {r['host']}{' ⛔' if r['ejected'] else ''}: {r['ewma_ms']:.0f}ms • "
+                f"{r['p50_ms']:.0f}/{r['p95_ms']:.0f}ms • {r['requests']}/{r['errors']} • "
+                f"{r['hedge_wins']}/{r['hedges']}"
+                for r in mirrors.MIRRORS.stats()
+            ) + "\n"
+            if self.image_cache.enabled:
+                s = self.image_cache.stats()
+                txt += (
+                    f"🗄 Image cache: {s['files']} images • {s['bytes'] / 1048576:.1f}/{s['max_bytes'] / 1048576:.0f} MB • "
+                    f"{s['hits']} hits / {s['misses']} misses • {s['evicted']} evicted\n"
+                )
+            hosts = http.stats()
+            if hosts:
+                txt += "🔌 Upstream HTTP (requests • reused • new conns • DNS cached):\n" + "\n".join(
+                    f"  {h}: {r['requests']} • {r['reused']} • {r['connects']} • {r['dns_hits']}/"
+                    f"{r['dns_hits'] + r['dns_lookups']}" for h, r in sorted(hosts.items())
+                ) + "\n"
+            stages = self.admission_stats.snapshot()
+            if stages:
+                txt += "🧮 Admission (avg • rejected):\n" + "\n".join(
+                    f"  {name}: {ms:.1f}ms • {rej}/{n}" for name, (n, ms, rej) in stages.items()
+                ) + "\n"
             self.bot.send_message(chat_id, txt)
-            return
 
-        if data == "owner:broadcast":
+        @cb.route("owner:broadcast", "owner")
+        def _owner_broadcast(c):
+            chat_id = c.message.chat.id
             self.owner_flow["await"] = "broadcast"
             self.bot.send_message(chat_id, "📢 Send broadcast message text (it will go to all users).")
-            return
 
-        if data == "owner:ban_unban":
+        @cb.route("owner:ban_unban", "owner")
+        def _owner_ban_unban(c):
+            chat_id = c.message.chat.id
             self.owner_flow["await"] = "ban_unban"
             self.bot.send_message(chat_id, "🚫 Send: <code>ban 123</code> or <code>unban 123</code>")
-            return
 
-        if data == "owner:reset_user":
+        @cb.route("owner:reset_user", "owner")
+        def _owner_reset_user(c):
+            chat_id = c.message.chat.id
             self.owner_flow["await"] = "reset_user"
             self.bot.send_message(chat_id, "♻️ Send user id to reset.\nExample: <code>7702984107</code>")
-            return
 
-        if data == "owner:reset_all":
-            self.state["users"] = {}
-            self.save()
-            self.bot.send_message(chat_id, "🧨 Reset ALL users done.")
-            return
+        @cb.route("owner:backup", "owner")
+        def _owner_backup(c):
+            chat_id = c.message.chat.id
+            self.bot.send_message(chat_id, "💾 Preparing backup…")
+            self.in_background(self.send_backup, chat_id)
+
+        @cb.route("owner:restore", "owner")
+        def _owner_restore(c):
+            chat_id = c.message.chat.id
+            self.owner_flow["await"] = "restore"
+            self.bot.send_message(chat_id, "📥 Send the backup <code>.ndjson</code> file.")
+
+        @cb.route("owner:retention", "owner")
+        def _owner_retention(c):
+            chat_id = c.message.chat.id
+            self.owner_flow["await"] = "retention"
+            self.bot.send_message(
+                chat_id,
+                "🧹 Send <code>user_days | username_days</code> (0 = keep forever).\n"
+                "Example: <code>90 | 30</code>\n"
+                "Only profiles still on default settings are dropped."
+            )
+
+        @cb.route("owner:gen_limits", "owner")
+        def _owner_gen_limits(c):
+            chat_id = c.message.chat.id
+            inflight, queue = self.gen_limits()
+            self.owner_flow["await"] = "gen_limits"
+            self.bot.send_message(
+                chat_id,
+                f"🚦 Now: <b>{inflight}</b> in flight • <b>{queue}</b> queue "
+                f"(running {self.gen_pool.busy}, waiting {len(self.gen_pool.queue)})\n"
+                "Send <code>in_flight | queue</code>. Example: <code>4 | 50</code>"
+            )
+
+        @cb.route("owner:image_cache", "owner")
+        def _owner_image_cache(c):
+            if not self.image_cache.enabled:
+                self.bot.send_message(c.message.chat.id, "🗄 Image cache is off (<code>IMAGE_CACHE_MAX_MB=0</code>).")
+                return
+            s = self.image_cache.stats()
+            self.bot.send_message(
+                c.message.chat.id,
+                f"🗄 <b>Image Cache</b>\n"
+                f"{s['files']} images • {s['bytes'] / 1048576:.1f}/{s['max_bytes'] / 1048576:.0f} MB • "
+                f"{s['hits']} hits / {s['misses']} misses\n"
+                "Tap a model to switch its cache on / off.",
+                reply_markup=image_cache_kb(self.S().get("models", []), self.S().get("image_cache_off", []))
+            )
 
-    def handle_owner_text(self, m, step: str):
-        chat_id = m.chat.id
-        text = (m.text or "").strip()
+        @cb.route("imgcache:", "owner")
+        def _owner_image_cache_model(c):
+            model = (c.data or "").split(":", 1)[1]
+            off = self.S().setdefault("image_cache_off", [])
+            if model in off:
+                off.remove(model)
+            else:
+                off.append(model)
+            self.save("settings")
+            self.bot.edit_message_reply_markup(
+                c.message.chat.id, c.message.message_id,
+                reply_markup=image_cache_kb(self.S().get("models", []), off)
+            )
 
-        if step == "cooldown":
+        @cb.route("owner:cache_clear", "owner")
+        def _owner_cache_clear(c):
+            n = self.image_cache.clear()
+            self.bot.send_message(c.message.chat.id, f"🗑 Image cache cleared ({n} images).")
+
+        @cb.route("owner:reset_all", "owner")
+        def _owner_reset_all(c):
+            chat_id = c.message.chat.id
+            self.reset_all()
+            self.replicate("reset_all")
+            self.bot.send_message(chat_id, "🧨 Reset ALL users done." + self.shard_note())
+
+        @cb.route("owner:routes", "owner")
+        def _owner_routes(c):
+            rows = self.route_stats.snapshot()[:25]
+            if not rows:
+                self.bot.send_message(c.message.chat.id, "📈 No routes served yet.")
+                return
+            txt = "📈 <b>Routes</b> (calls • p50 • p99)\n━━━━━━━━━━━━━━━━━━━━━━\n"
+            txt += "\n".join(f"<code>{name}</code> {n} • {p50:.1f}ms • {p99:.1f}ms" for name, n, p50, p99 in rows)
+            self.bot.send_message(c.message.chat.id, txt)
+
+        # ---------- owner text steps (owner_flow["await"]) ----------
+        @steps.route("cooldown")
+        def _step_cooldown(m):
+            chat_id = m.chat.id
+            text = (m.text or "").strip()
             try:
-                self.S()["cooldown_seconds"] = max(0, int(text))
-                self.save()
+                parts = text.lower().split()
+                if parts and parts[0] == "auto":
+                    lo, hi = max(0, int(parts[1])), max(0, int(parts[2]))
+                    self.S()["cooldown_mode"] = "adaptive"
+                    self.S()["cooldown_min"], self.S()["cooldown_max"] = min(lo, hi), max(lo, hi)
+                else:
+                    self.S()["cooldown_seconds"] = max(0, int(text))
+                    self.S()["cooldown_mode"] = "fixed"
+                self.save("settings")
                 self.bot.send_message(chat_id, "✅ Cooldown updated.")
             except Exception:
                 self.bot.send_message(chat_id, "❌ Invalid number.")
-            return
 
-        if step == "daily":
+        @steps.route("daily")
+        def _step_daily(m):
+            chat_id = m.chat.id
+            text = (m.text or "").strip()
             try:
                 self.S()["daily_limit"] = max(0, int(text))
-                self.save()
+                self.save("settings")
                 self.bot.send_message(chat_id, "✅ Daily limit updated.")
             except Exception:
                 self.bot.send_message(chat_id, "❌ Invalid number.")
-            return
 
-        if step == "add_join":
+        @steps.route("add_join")
+        def _step_add_join(m):
+            chat_id = m.chat.id
+            text = (m.text or "").strip()
             obj = self.parse_join_line(text)
             if not obj:
                 self.bot.send_message(
@@ -971,33 +1718,39 @@ class RaoBot:
                 return
             targets.append(obj)
             self.S()["join_targets"] = targets
-            self.save()
+            self.save("settings")
             self.bot.send_message(chat_id, f"✅ Added join target: <code>{obj['chat']}</code>")
-            return
 
-        if step == "remove_join":
+        @steps.route("remove_join")
+        def _step_remove_join(m):
+            chat_id = m.chat.id
+            text = (m.text or "").strip()
             targets = self.join_targets()
             before = len(targets)
             targets = [t for t in targets if t.get("chat") != text]
             self.S()["join_targets"] = targets
-            self.save()
+            self.save("settings")
             if len(targets) == before:
                 self.bot.send_message(chat_id, "❌ Not found.")
             else:
                 self.bot.send_message(chat_id, "✅ Removed.")
-            return
 
-        if step == "models":
+        @steps.route("models")
+        def _step_models(m):
+            chat_id = m.chat.id
+            text = (m.text or "").strip()
             parts = [p.strip() for p in text.split(",") if p.strip()]
             if not parts:
                 self.bot.send_message(chat_id, "❌ Empty.")
                 return
             self.S()["models"] = parts
-            self.save()
+            self.save("settings")
             self.bot.send_message(chat_id, "✅ Models updated.")
-            return
 
-        if step == "ui_text":
+        @steps.route("ui_text")
+        def _step_ui_text(m):
+            chat_id = m.chat.id
+            text = (m.text or "").strip()
             if text.count("|") < 2:
                 self.bot.send_message(chat_id, "❌ Use: <code>Title | Subtitle | Footer</code>")
                 return
@@ -1005,22 +1758,21 @@ class RaoBot:
             self.S()["ui_title"] = a
             self.S()["ui_subtitle"] = b
             self.S()["footer"] = c
-            self.save()
+            self.save("settings")
             self.bot.send_message(chat_id, "✅ UI text updated.")
-            return
 
-        if step == "broadcast":
-            sent = 0
-            for uid_str in list(self.state["users"].keys()):
-                try:
-                    self.bot.send_message(int(uid_str), f"📢 <b>Broadcast</b>\n━━━━━━━━━━━━━━━━━━━━━━\n{text}")
-                    sent += 1
-                except Exception:
-                    pass
-            self.bot.send_message(chat_id, f"✅ Broadcast sent to: <b>{sent}</b> users.")
-            return
-
-        if step == "ban_unban":
+        @steps.route("broadcast")
+        def _step_broadcast(m):
+            chat_id = m.chat.id
+            text = (m.text or "").strip()
+            self.replicate("broadcast", text)
+            sent = self.broadcast(text)
+            self.bot.send_message(chat_id, f"✅ Broadcast sent to: <b>{sent}</b> users." + self.shard_note())
+
+        @steps.route("ban_unban")
+        def _step_ban_unban(m):
+            chat_id = m.chat.id
+            text = (m.text or "").strip()
             parts = text.split()
             if len(parts) != 2:
                 self.bot.send_message(chat_id, "❌ Use: <code>ban 123</code> or <code>unban 123</code>")
@@ -1039,20 +1791,77 @@ class RaoBot:
                 self.bot.send_message(chat_id, f"✅ Unbanned: <code>{uid}</code>")
             else:
                 self.bot.send_message(chat_id, "❌ Use ban/unban.")
-            return
 
-        if step == "reset_user":
+        @steps.route("retention")
+        def _step_retention(m):
+            chat_id = m.chat.id
+            text = (m.text or "").strip()
+            try:
+                a, b = [max(0, int(x.strip())) for x in text.split("|", 1)]
+            except Exception:
+                self.bot.send_message(chat_id, "❌ Use: <code>90 | 30</code>")
+                return
+            self.S()["retention_days"] = a
+            self.S()["uname_ttl_days"] = b
+            self.save("settings")
+            self.bot.send_message(chat_id, "✅ Retention updated.")
+
+        @steps.route("gen_limits")
+        def _step_gen_limits(m):
+            chat_id = m.chat.id
+            text = (m.text or "").strip()
+            try:
+                a, b = [max(1, int(x.strip())) for x in text.split("|", 1)]
+            except Exception:
+                self.bot.send_message(chat_id, "❌ Use: <code>4 | 50</code>")
+                return
+            self.S()["gen_max_inflight"] = a
+            self.S()["gen_max_queue"] = b
+            self.save("settings")
+            self.gen_pool.resize(a)
+            self.bot.send_message(chat_id, "✅ Generation limits updated.")
+
+        @steps.route("reset_user")
+        def _step_reset_user(m):
+            chat_id = m.chat.id
+            text = (m.text or "").strip()
             try:
                 uid = int(text)
             except Exception:
                 self.bot.send_message(chat_id, "❌ Invalid user id.")
                 return
-            self.state["users"].pop(str(uid), None)
-            self.save()
+            self.reset_user(uid)
+            self.replicate("reset_user", uid)
             self.bot.send_message(chat_id, f"✅ Reset done for: <code>{uid}</code>")
-            return
 
     # ----------------- run -----------------
+    def _use_dispatcher(self) -> UpdateDispatcher:
+        # process_new_updates must run the handlers inline on the dispatcher's worker: handing them
+        # to telebot's pool would lose the per-chat order (a shard worker only learns its mode here)
+        if self.bot.threaded:
+            self.bot.threaded = False
+            self.bot.worker_pool.close()
+        self.dispatcher = UpdateDispatcher(self.bot)
+        return self.dispatcher
+
     def run(self):
-        print("✅ RaoBot polling started")
-        self.bot.infinity_polling(timeout=60, long_polling_timeout=60)
+        threading.Thread(target=self.warmup, name="rao-warmup", daemon=True).start()
+        self.retention.start()
+        print(f"✅ RaoBot started ({ENGINE} engine, startup {(time.perf_counter() - self._t0) * 1000:.0f} ms)")
+        try:
+            if self.cluster is not None:
+                # SHARDS worker: the poller process sends this shard's updates
+                self.cluster.serve(self, self._use_dispatcher())
+            elif WEBHOOK_URL:
+                # Telegram POSTs updates; acked at once, run on the dispatcher's threads
+                self.webhook = WebhookServer(self.bot, self._use_dispatcher())
+                self.webhook.serve_forever()
+            elif self.engine is not None:
+                # AsyncTeleBot long-polls on the loop; handlers still run on the dispatcher's threads
+                self.engine.poll_forever(self._use_dispatcher())
+            elif DISPATCH_WORKERS > 0:
+                self._use_dispatcher().poll_forever(timeout=60, long_polling_timeout=60)
+            else:
+                self.bot.infinity_polling(timeout=60, long_polling_timeout=60)
+        finally:
+            self.close()
@@ -14,11 +14,88 @@ OWNER_USERNAME = os.getenv("OWNER_USERNAME", "@RaoSahab_Ji01").strip()
 OWNER_LINK = os.getenv("OWNER_LINK", "https://t.me/RaoSahab_Ji01").strip()
 OWNER_BIO = os.getenv("OWNER_BIO", "हरि हराये नमः कृष्ण यादवाय नमः , यादवाय माधवाय केशवाय नमः।।").strip()
 
-# APIs
-IMAGE_API = "https://text2img.hideme.eu.org/image"
+# APIs (IMAGE_API may be a comma-separated list of equivalent mirrors, see rao/api/mirrors.py)
+IMAGE_APIS = [u.strip() for u in os.getenv("IMAGE_API", "https://text2img.hideme.eu.org/image").split(",") if u.strip()]
+IMAGE_API = IMAGE_APIS[0]
 STYLES_API = "https://text2img.hideme.eu.org/image?style=all"
 
 TTS_API = "https://yabes-api.pages.dev/api/tools/tts"
 MS_SEARCH_AI = "https://bj-microsoft-search-ai.vercel.app/"
 
 DATA_DIR = os.getenv("DATA_DIR", ".data").strip()
+
+# Persistence (write-behind)
+SAVE_DELAY = float(os.getenv("SAVE_DELAY", "2").strip() or "2")  # seconds to coalesce saves
+SAVE_FSYNC = os.getenv("SAVE_FSYNC", "0").strip() == "1"
+STORAGE_MODE = os.getenv("STORAGE_MODE", "snapshot").strip().lower()  # snapshot | journal
+JOURNAL_COMPACT_BYTES = int(os.getenv("JOURNAL_COMPACT_BYTES", str(4 * 1024 * 1024)).strip() or "0")
+STATE_BACKEND = os.getenv("STATE_BACKEND", "json").strip().lower()  # json | sqlite
+SQLITE_USER_CACHE = int(os.getenv("SQLITE_USER_CACHE", "5000").strip() or "5000")  # profiles kept in memory
+LOCK_STRIPES = int(os.getenv("LOCK_STRIPES", "64").strip() or "64")  # per-user lock stripes
+SNAPSHOT_FORMAT = os.getenv("SNAPSHOT_FORMAT", "json").strip().lower()  # json | binary (fast start)
+
+# Retention sweep (policy itself is in settings: retention_days / uname_ttl_days)
+RETENTION_SWEEP_SECONDS = float(os.getenv("RETENTION_SWEEP_SECONDS", "60").strip() or "60")
+RETENTION_BATCH = int(os.getenv("RETENTION_BATCH", "500").strip() or "500")  # candidates per tick
+
+# Runtime: threads = blocking requests on worker threads; async = upstream calls and their
+# Telegram replies as coroutines on one event loop (AsyncTeleBot + aiohttp, see rao/engine.py)
+ENGINE = os.getenv("ENGINE", "threads").strip().lower()  # threads | async
+ASYNC_MAX_INFLIGHT = int(os.getenv("ASYNC_MAX_INFLIGHT", "256").strip() or "256")  # concurrent TTS / search calls
+
+# Upstream HTTP client (rao/api/http.py): kept-alive connections per API host, DNS cache lifetime
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32").strip() or "32")
+HTTP_DNS_TTL = float(os.getenv("HTTP_DNS_TTL", "300").strip() or "300")
+
+# Upstream circuit breakers (rao/api/breaker.py) and per-action deadline budgets (seconds)
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "60").strip() or "60")  # error-rate window
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5").strip() or "5")  # calls in the window before it can trip
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5").strip() or "0.5")
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30").strip() or "30")  # fail fast this long, then probe
+GEN_DEADLINE = float(os.getenv("GEN_DEADLINE", "150").strip() or "150")  # /gen: all IMAGE_API attempts + backoff
+TTS_DEADLINE = float(os.getenv("TTS_DEADLINE", "60").strip() or "60")
+SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", "60").strip() or "60")
+
+# Image download: hard size cap (Telegram's photo limit is 10 MB) and how much stays in RAM before spilling to a temp file
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)).strip() or "0") or 10 * 1024 * 1024
+IMAGE_SPOOL_BYTES = int(os.getenv("IMAGE_SPOOL_BYTES", str(256 * 1024)).strip() or "0")
+
+# Disk cache of generated images (rao/imagecache.py; owner panel 🗄 Image Cache switches it per model)
+IMAGE_CACHE_MAX_MB = float(os.getenv("IMAGE_CACHE_MAX_MB", "512").strip() or "0")  # 0 = no cache
+IMAGE_CACHE_DAYS = float(os.getenv("IMAGE_CACHE_DAYS", "7").strip() or "7")
+
+# IMAGE_API mirrors: hedge a fetch after the mirror's p<HEDGE_PERCENTILE> latency (0 = never)
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95").strip() or "0")
+HEDGE_MAX_RATIO = float(os.getenv("HEDGE_MAX_RATIO", "0.1").strip() or "0.1")  # hedges / fetches cap
+MIRROR_EJECT_AFTER = int(os.getenv("MIRROR_EJECT_AFTER", "3").strip() or "3")  # failures in a row
+
+# Image generation worker pool (owner panel 🚦 Gen Limits overrides both)
+_GEN_DEFAULT = "64" if ENGINE == "async" else "4"  # a coroutine slot is far cheaper than a thread
+GEN_WORKERS = int(os.getenv("GEN_WORKERS", _GEN_DEFAULT).strip() or _GEN_DEFAULT)  # concurrent IMAGE_API fetches
+GEN_QUEUE = int(os.getenv("GEN_QUEUE", "50").strip() or "50")  # waiting jobs before /gen is rejected
+QUEUE_STATUS_SECONDS = float(os.getenv("QUEUE_STATUS_SECONDS", "3").strip() or "3")  # "#N in queue" edit interval
+
+# Adaptive cooldown (settings: cooldown_mode = fixed | adaptive, cooldown_min / cooldown_max)
+ADAPTIVE_WINDOW = float(os.getenv("ADAPTIVE_WINDOW", "300").strip() or "300")  # seconds of fetch history
+
+# Update dispatch: ordered per chat, parallel across chats (0 workers = telebot infinity_polling)
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "8").strip() or "0")
+DISPATCH_KEY = os.getenv("DISPATCH_KEY", "chat").strip().lower()  # chat | user
+DISPATCH_MAX_PENDING = int(os.getenv("DISPATCH_MAX_PENDING", "1000").strip() or "1000")  # pause polling above this
+
+# Webhook mode instead of long polling when WEBHOOK_URL is set (Telegram only calls https URLs;
+# an http:// URL serves without registering, for local testing with `python -m rao.webhook`)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").strip()  # e.g. https://rao.example.com/tg
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0").strip()
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8080")).strip() or "8080")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "").strip()  # X-Telegram-Bot-Api-Secret-Token; random if empty (none for an http:// URL)
+
+# Several bots in one process: JSON list of tenants (token, branding, owner, data_dir; see rao/tenants.py)
+TENANTS_FILE = os.getenv("TENANTS_FILE", "").strip()
+
+# Multi-process mode: a poller process + SHARDS worker processes, users split by id (see rao/shards.py)
+SHARDS = int(os.getenv("SHARDS", "0").strip() or "0")  # 0 = everything in one process
+
+# Inline buttons: ack at once, run the work on these threads; drop repeat taps within the window
+CALLBACK_WORKERS = int(os.getenv("CALLBACK_WORKERS", "4").strip() or "4")
+CALLBACK_DEDUP_SECONDS = float(os.getenv("CALLBACK_DEDUP_SECONDS", "2").strip() or "2")
@@ -0,0 +1,209 @@
+import datetime
+import mmap
+import os
+import struct
+import threading
+from typing import Iterator, Optional, Tuple
+
+from .config import SAVE_FSYNC
+
+MAGIC = b"RAOCNT1\0"
+HEADER = struct.Struct("<8sII")   # magic, capacity (rows), count
+ROW = struct.Struct("<qqii")      # uid, last_gen_ts, day number, daily_used
+EMPTY = 0                         # uid 0 marks a free row
+MAX_LOAD = 0.7
+
+
+def today_num() -> int:
+    # same local-time day as utils.today_str()
+    return datetime.date.today().toordinal()
+
+
+def day_num(date_str: str) -> int:
+    """'YYYY-MM-DD' -> proleptic ordinal; 0 if empty/unparsable."""
+    try:
+        return datetime.date.fromisoformat(date_str).toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+
+class CounterTable:
+    """
+    Hot per-user counters in a memory-mapped file of fixed-width rows.
+    The rows themselves are the index: open addressing on uid with linear
+    probing, so a lookup/update touches one or two rows and never
+    serializes anything. Writes land in the shared mapping immediately
+    (crash-safe for the process); with fsync the touched page is msync'ed.
+    """
+
+    def __init__(self, path: str, capacity: int = 4096, fsync: bool = SAVE_FSYNC):
+        self.path = path
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._f = None
+        self._mm: Optional[mmap.mmap] = None
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER.size:
+            self._open()
+        else:
+            self._create(path, capacity)
+            self._open()
+
+    # ----- file -----
+    @staticmethod
+    def _create(path: str, capacity: int) -> None:
+        capacity = max(16, int(capacity))
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(HEADER.pack(MAGIC, capacity, 0))
+            f.truncate(HEADER.size + capacity * ROW.size)
+        os.replace(tmp, path)
+
+    def _open(self) -> None:
+        self._f = open(self.path, "r+b")
+        self._mm = mmap.mmap(self._f.fileno(), 0)
+        magic, self.capacity, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or len(self._mm) < HEADER.size + self.capacity * ROW.size:
+            raise RuntimeError(f"Corrupt counter table: {self.path}")
+
+    def _close_map(self) -> None:
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm.close()
+            self._mm = None
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_map()
+
+    # ----- probing -----
+    @staticmethod
+    def _home(uid: int, cap: int) -> int:
+        return (((uid * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF) >> 16) % cap
+
+    def _find(self, uid: int, mm: Optional[mmap.mmap] = None, cap: int = 0) -> Tuple[int, bool]:
+        """Row offset for uid and whether it is already there (else: first free row)."""
+        mm = mm if mm is not None else self._mm
+        cap = cap or self.capacity
+        i = self._home(uid, cap)
+        for _ in range(cap):
+            off = HEADER.size + i * ROW.size
+            cur = struct.unpack_from("<q", mm, off)[0]
+            if cur == uid:
+                return off, True
+            if cur == EMPTY:
+                return off, False
+            i = (i + 1) % cap
+        raise RuntimeError("Counter table full")
+
+    def _grow(self) -> None:
+        rows = []
+        for i in range(self.capacity):
+            r = ROW.unpack_from(self._mm, HEADER.size + i * ROW.size)
+            if r[0] != EMPTY:
+                rows.append(r)
+        # build the bigger table next to the old one, swap only when complete
+        new_cap = self.capacity * 2
+        grow = self.path + ".grow"
+        self._create(grow, new_cap)
+        with open(grow, "r+b") as f:
+            mm = mmap.mmap(f.fileno(), 0)
+            for r in rows:
+                off, _ = self._find(r[0], mm, new_cap)
+                ROW.pack_into(mm, off, *r)
+            HEADER.pack_into(mm, 0, MAGIC, new_cap, len(rows))
+            mm.flush()
+            mm.close()
+        self._close_map()
+        os.replace(grow, self.path)
+        self._open()
+
+    def _sync(self, off: int) -> None:
+        if self.fsync:
+            page = off - off % mmap.PAGESIZE
+            self._mm.flush(page, min(mmap.PAGESIZE * 2, len(self._mm) - page))
+
+    # ----- API -----
+    def read(self, uid: int) -> Optional[Tuple[int, int, int]]:
+        """(last_gen_ts, day, daily_used) or None if uid has no row yet."""
+        uid = int(uid)
+        with self._lock:
+            off, found = self._find(uid)
+            if not found:
+                return None
+            return ROW.unpack_from(self._mm, off)[1:]
+
+    def write(self, uid: int, last_gen_ts: int, day: int, used: int) -> None:
+        uid = int(uid)
+        if uid == EMPTY:
+            return
+        with self._lock:
+            off, found = self._find(uid)
+            if not found:
+                if (self.count + 1) > self.capacity * MAX_LOAD:
+                    self._grow()
+                    off, _ = self._find(uid)
+                self.count += 1
+                HEADER.pack_into(self._mm, 0, MAGIC, self.capacity, self.count)
+            ROW.pack_into(self._mm, off, uid, int(last_gen_ts), int(day), int(used))
+            self._sync(off)
+
+    def delete(self, uid: int) -> bool:
+        """
+        Drop uid's row. Linear probing has no tombstones here: the rows after
+        the hole are shifted back so every probe chain stays unbroken.
+        """
+        uid = int(uid)
+        with self._lock:
+            off, found = self._find(uid)
+            if not found:
+                return False
+            cap = self.capacity
+            hole = (off - HEADER.size) // ROW.size
+            j = hole
+            while True:
+                j = (j + 1) % cap
+                joff = HEADER.size + j * ROW.size
+                row = ROW.unpack_from(self._mm, joff)
+                if row[0] == EMPTY:
+                    break
+                home = self._home(row[0], cap)
+                # row j may fill the hole only if its home is not in (hole, j]
+                if (hole < j and (home <= hole or home > j)) or (hole > j and home <= hole and home > j):
+                    ROW.pack_into(self._mm, HEADER.size + hole * ROW.size, *row)
+                    hole = j
+            ROW.pack_into(self._mm, HEADER.size + hole * ROW.size, EMPTY, 0, 0, 0)
+            self.count -= 1
+            HEADER.pack_into(self._mm, 0, MAGIC, cap, self.count)
+            self._sync(off)
+            if hole != (off - HEADER.size) // ROW.size:
+                self._sync(HEADER.size + hole * ROW.size)
+        return True
+
+    def items(self) -> Iterator[Tuple[int, int, int, int]]:
+        """Every (uid, last_gen_ts, day, daily_used) row, read a page of rows at a time."""
+        i = 0
+        while True:
+            with self._lock:
+                if i >= self.capacity:
+                    return
+                end = min(self.capacity, i + 256)
+                rows = [ROW.unpack_from(self._mm, HEADER.size + j * ROW.size) for j in range(i, end)]
+            for r in rows:
+                if r[0] != EMPTY:
+                    yield r
+            i = end
+
+    def clear(self) -> None:
+        """Drop every row (the file keeps its capacity)."""
+        with self._lock:
+            self._mm[HEADER.size:HEADER.size + self.capacity * ROW.size] = bytes(self.capacity * ROW.size)
+            self.count = 0
+            HEADER.pack_into(self._mm, 0, MAGIC, self.capacity, 0)
+            if self.fsync:
+                self._mm.flush()
+
+    def __len__(self) -> int:
+        return self.count
@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from telebot import TeleBot, types
+
+from .config import DISPATCH_WORKERS, DISPATCH_KEY, DISPATCH_MAX_PENDING
+
+
+def update_key(u: types.Update, by: str = DISPATCH_KEY) -> Any:
+    """Ordering key of an update: its chat (or sender with by="user"); unrelated updates get their own."""
+    msg = u.message or u.edited_message or u.channel_post or u.edited_channel_post
+    if u.callback_query is not None:
+        cq = u.callback_query
+        if by == "user" or cq.message is None:
+            return cq.from_user.id
+        return cq.message.chat.id
+    if msg is not None:
+        if by == "user" and msg.from_user is not None:
+            return msg.from_user.id
+        return msg.chat.id
+    for name in ("inline_query", "chosen_inline_result", "shipping_query", "pre_checkout_query"):
+        obj = getattr(u, name, None)
+        if obj is not None:
+            return obj.from_user.id
+    for name in ("my_chat_member", "chat_member", "chat_join_request"):
+        obj = getattr(u, name, None)
+        if obj is not None:
+            return obj.chat.id
+    return ("update", u.update_id)
+
+
+class SerialQueue:
+    """
+    One FIFO per key, and a key is handed to at most one worker at a time:
+    items of a key run strictly in order, different keys run in parallel.
+    A key sits in `_ready` exactly when it has items and nobody is running it.
+    """
+
+    def __init__(self):
+        self._items: Dict[Any, Deque[Any]] = {}
+        self._ready: Deque[Any] = deque()
+        self._running: Set[Any] = set()
+        self._size = 0
+        self._closed = False
+        self._cv = threading.Condition()
+
+    def put(self, key: Any, item: Any) -> None:
+        with self._cv:
+            q = self._items.setdefault(key, deque())
+            q.append(item)
+            self._size += 1
+            if len(q) == 1 and key not in self._running:
+                self._ready.append(key)
+                self._cv.notify()
+
+    def get(self) -> Optional[Tuple[Any, Any]]:
+        """(key, item), blocking; the caller must call done(key) afterwards. None once closed."""
+        with self._cv:
+            while not self._ready and not self._closed:
+                self._cv.wait()
+            if self._closed:
+                return None
+            key = self._ready.popleft()
+            item = self._items[key].popleft()
+            self._running.add(key)
+            self._size -= 1
+            return key, item
+
+    def done(self, key: Any) -> None:
+        with self._cv:
+            self._running.discard(key)
+            if self._items.get(key):
+                self._ready.append(key)
+                self._cv.notify()
+            else:
+                self._items.pop(key, None)
+            self._cv.notify_all()  # wake wait_below()
+
+    def wait_below(self, limit: int, timeout: float) -> bool:
+        """Block while `limit` or more items are pending; False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._cv:
+            while self._size >= limit and not self._closed:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    return False
+                self._cv.wait(left)
+            return True
+
+    def close(self) -> None:
+        with self._cv:
+            self._closed = True
+            self._cv.notify_all()
+
+    def stats(self, top: int = 3) -> Dict[str, Any]:
+        with self._cv:
+            busiest = sorted(((k, len(q)) for k, q in self._items.items() if q), key=lambda x: -x[1])[:top]
+            return {
+                "pending": self._size,
+                "keys": len(self._items),
+                "running": len(self._running),
+                "busiest": busiest,
+            }
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class SerialWorkers:
+    """Daemon threads running fn(*args) jobs from a SerialQueue: in order per key, parallel across keys."""
+
+    def __init__(self, workers: int, name: str):
+        self.queue = SerialQueue()
+        self.processed = 0
+        self._threads: List[threading.Thread] = [
+            threading.Thread(target=self._work, name=f"{name}-{i}", daemon=True)
+            for i in range(max(1, int(workers)))
+        ]
+        for t in self._threads:
+            t.start()
+
+    def submit(self, key: Any, fn: Callable[..., Any], *args: Any) -> None:
+        self.queue.put(key, (fn, args))
+
+    def _work(self) -> None:
+        while True:
+            got = self.queue.get()
+            if got is None:
+                return
+            key, (fn, args) = got
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"⚠️ {getattr(fn, '__name__', fn)} failed: {e}")
+            finally:
+                self.processed += 1
+                self.queue.done(key)
+
+    def close(self) -> None:
+        self.queue.close()
+
+    def stats(self) -> Dict[str, Any]:
+        s = self.queue.stats()
+        s["workers"] = len(self._threads)
+        s["processed"] = self.processed
+        return s
+
+
+class UpdateDispatcher:
+    """
+    Replaces infinity_polling: one thread long-polls getUpdates and feeds
+    SerialWorkers keyed by chat (DISPATCH_KEY=chat) or sender (user), which
+    run bot.process_new_updates one update at a time. Polling pauses while
+    `max_pending` updates are waiting (backpressure instead of memory).
+    """
+
+    def __init__(self, bot: TeleBot, workers: int = DISPATCH_WORKERS, key: str = DISPATCH_KEY,
+                 max_pending: int = DISPATCH_MAX_PENDING):
+        self.bot = bot
+        self.key = key
+        self.max_pending = max(1, int(max_pending))
+        self.workers = SerialWorkers(workers, "rao-dispatch")
+        self.queue = self.workers.queue
+        self._stop = threading.Event()
+
+    def submit(self, update: types.Update) -> None:
+        self.workers.submit(update_key(update, self.key), self.process, update)
+
+    def process(self, update: types.Update) -> None:
+        self.bot.process_new_updates([update])
+
+    def poll_forever(self, timeout: int = 60, long_polling_timeout: int = 60) -> None:
+        offset = None
+        backoff = 1.0
+        while not self._stop.is_set():
+            if not self.queue.wait_below(self.max_pending, timeout=5):
+                continue
+            try:
+                updates = self.bot.get_updates(offset=offset, timeout=timeout, long_polling_timeout=long_polling_timeout)
+                backoff = 1.0
+            except Exception as e:
+                print(f"⚠️ getUpdates failed: {e} (retry in {backoff:.0f}s)")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            for u in updates:
+                offset = u.update_id + 1
+                self.submit(u)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.workers.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return self.workers.stats()
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Dict, Optional
+
+import aiohttp
+from telebot.async_telebot import AsyncTeleBot
+
+from .config import ASYNC_MAX_INFLIGHT, HTTP_DNS_TTL
+
+
+class AsyncEngine:
+    """
+    ENGINE=async runtime: one event loop on a daemon thread, with an
+    AsyncTeleBot and a shared aiohttp session for the upstream clients
+    (api/aio.py). Handlers stay synchronous; the slow part of /gen, /tts and
+    /search (upstream fetch + Telegram upload) is handed over as a coroutine,
+    so in-flight calls cost a task each instead of a thread each.
+    Updates are long-polled here too and fed to the UpdateDispatcher.
+    """
+
+    def __init__(self, token: str, max_inflight: int = ASYNC_MAX_INFLIGHT):
+        self.bot = AsyncTeleBot(token, parse_mode="HTML")
+        self.max_inflight = max(1, int(max_inflight))
+        self.loop = asyncio.new_event_loop()
+        self.inflight = 0
+        self.peak = 0
+        self.done = 0
+        self.failed = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rao-async", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def http(self) -> aiohttp.ClientSession:
+        # created on the loop thread, on first use
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(
+                limit=self.max_inflight, ttl_dns_cache=int(HTTP_DNS_TTL)))
+        return self._session
+
+    def submit(self, coro: Coroutine[Any, Any, Any]) -> Future:
+        """Run coro on the loop (at most max_inflight at once); callable from any thread."""
+        return asyncio.run_coroutine_threadsafe(self._guard(coro), self.loop)
+
+    async def _guard(self, coro: Coroutine[Any, Any, Any]) -> Any:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_inflight)
+        async with self._sem:
+            self.inflight += 1
+            self.peak = max(self.peak, self.inflight)
+            try:
+                return await coro
+            except Exception as e:
+                self.failed += 1
+                print(f"⚠️ {getattr(coro, '__name__', coro)} failed: {e}")
+            finally:
+                self.inflight -= 1
+                self.done += 1
+
+    async def poll(self, dispatcher: Any, timeout: int = 60) -> None:
+        """getUpdates long poll via AsyncTeleBot; same backpressure as UpdateDispatcher.poll_forever."""
+        offset = None
+        backoff = 1.0
+        while not self._stop.is_set():
+            if not await asyncio.to_thread(dispatcher.queue.wait_below, dispatcher.max_pending, 5):
+                continue
+            try:
+                updates = await self.bot.get_updates(offset=offset, timeout=timeout, request_timeout=timeout + 10)
+                backoff = 1.0
+            except Exception as e:
+                print(f"⚠️ getUpdates failed: {e} (retry in {backoff:.0f}s)")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            for u in updates:
+                offset = u.update_id + 1
+                dispatcher.submit(u)
+
+    def poll_forever(self, dispatcher: Any, timeout: int = 60) -> None:
+        """Block the calling thread while poll() runs on the loop."""
+        asyncio.run_coroutine_threadsafe(self.poll(dispatcher, timeout), self.loop).result()
+
+    async def _aclose(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        await self.bot.close_session()
+
+    def close(self, timeout: float = 5) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        try:
+            asyncio.run_coroutine_threadsafe(self._aclose(), self.loop).result(timeout)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def stats(self) -> Dict[str, int]:
+        return {"inflight": self.inflight, "peak": self.peak, "done": self.done, "failed": self.failed}
@@ -0,0 +1,194 @@
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import IO, Any, Dict, List, Optional
+
+from .config import IMAGE_CACHE_MAX_MB, IMAGE_CACHE_DAYS
+from .storage import StatePersister, load_json, save_json
+from .utils import now_ts, style_api, trim_prompt
+
+INDEX_FILE = "index.json"
+TOUCH_SAVE_SECONDS = 60.0  # hits / misses alone (LRU order, counters) are saved at most this often
+_NAME = re.compile(r"^([0-9a-f]{64})\.(png|jpg|gif|webp)$")
+
+
+class ImageCache:
+    """
+    Content-addressed IMAGE_API results under <data dir>/image_cache:
+    <key[:2]>/<key>.<ext>, key = sha256 of exactly the prompt / model /
+    style that build_image_url sends. LRU order lives in an OrderedDict;
+    index.json keeps it (and the hit/miss counters) across restarts and is
+    written behind like the state files: at once when entries change, at
+    most every TOUCH_SAVE_SECONDS for plain hits and misses. Bounded by
+    IMAGE_CACHE_MAX_MB (least recently used go first) and IMAGE_CACHE_DAYS
+    (age since the image was fetched). IMAGE_CACHE_MAX_MB=0 turns it off.
+    """
+
+    def __init__(self, root: str, max_mb: float = IMAGE_CACHE_MAX_MB, max_days: float = IMAGE_CACHE_DAYS):
+        self.root = root
+        self.max_bytes = int(float(max_mb) * 1024 * 1024)
+        self.max_age = float(max_days) * 86400
+        self.index_path = os.path.join(root, INDEX_FILE)
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, List[Any]]" = OrderedDict()  # key -> [size, ext, fetched_ts]; LRU first
+        self.bytes = 0
+        self.counters = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+        self._persister: Optional[StatePersister] = None
+        self._marked = 0.0
+        if self.enabled:
+            os.makedirs(root, exist_ok=True)
+            self._load()
+            self._persister = StatePersister(lambda pending: self._save())
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def key(prompt: str, model: str, style_title: str) -> str:
+        # what build_image_url sends, nothing more: the upstream treats "A Cat" and "a cat" apart
+        raw = f"{model}\n{style_api(style_title)}\n{trim_prompt(prompt)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.{ext}")
+
+    # ----- index -----
+    def _load(self) -> None:
+        data = load_json(self.index_path, {})
+        for k in self.counters:
+            self.counters[k] = int(data.get(k, 0))
+        known = data.get("entries", {}) if isinstance(data.get("entries"), dict) else {}
+        # the directory is the truth: drop entries whose file is gone, adopt files the index missed
+        found: Dict[str, List[Any]] = {}
+        for sub in os.scandir(self.root):
+            if not sub.is_dir():
+                continue
+            for f in os.scandir(sub.path):
+                m = _NAME.match(f.name)
+                if not m:
+                    if f.name.endswith(".tmp"):  # a put() cut short by a crash
+                        os.remove(f.path)
+                    continue
+                st = f.stat()
+                row = known.get(m.group(1))
+                if m.group(1) in found:  # two formats of one key: keep the one the index names
+                    if not row or row[1] != m.group(2):
+                        os.remove(f.path)
+                        continue
+                    os.remove(self._path(m.group(1), found[m.group(1)][1]))
+                found[m.group(1)] = [st.st_size, m.group(2), int(row[2]) if row else int(st.st_mtime)]
+        order = [k for k in known if k in found] + [k for k in found if k not in known]
+        for k in order:
+            self._entries[k] = found[k]
+            self.bytes += found[k][0]
+        self._evict(now_ts())
+
+    def _save(self) -> None:
+        with self._lock:
+            data = dict(self.counters, entries=dict(self._entries))
+        save_json(self.index_path, data)
+
+    def _dirty(self, changed: bool = True) -> None:
+        now = time.monotonic()
+        if self._persister is None or (not changed and now - self._marked < TOUCH_SAVE_SECONDS):
+            return
+        self._marked = now
+        self._persister.mark_dirty("index")
+
+    def _drop(self, key: str) -> None:
+        # caller holds the lock
+        size, ext, _ = self._entries.pop(key)
+        self.bytes -= size
+        try:
+            os.remove(self._path(key, ext))
+        except OSError:
+            pass
+
+    def _evict(self, now: int) -> None:
+        # caller holds the lock (or is __init__): expired first, then least recently used
+        for k in [k for k, row in self._entries.items() if now - row[2] > self.max_age]:
+            self._drop(k)
+            self.counters["evicted"] += 1
+        while self.bytes > self.max_bytes and self._entries:
+            self._drop(next(iter(self._entries)))
+            self.counters["evicted"] += 1
+
+    # ----- use -----
+    def get(self, key: str) -> Optional[str]:
+        """Path of the cached image (now most recently used), or None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._entries.get(key)
+            expired = row is not None and now_ts() - row[2] > self.max_age
+            if expired:
+                self._drop(key)
+                self.counters["evicted"] += 1
+                row = None
+            if row is None:
+                self.counters["misses"] += 1
+            else:
+                self._entries.move_to_end(key)
+                self.counters["hits"] += 1
+        self._dirty(changed=expired)
+        return self._path(key, row[1]) if row else None
+
+    def put(self, key: str, src: IO[bytes], ext: str) -> None:
+        """Copy an image file in (src is read from the start and rewound afterwards)."""
+        if not self.enabled:
+            return
+        path = self._path(key, ext)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        src.seek(0)
+        try:
+            with open(tmp, "wb") as f:
+                shutil.copyfileobj(src, f)
+                size = f.tell()
+            if size > self.max_bytes:
+                os.remove(tmp)
+                return
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        finally:
+            src.seek(0)
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                self.bytes -= old[0]
+                if old[1] != ext:  # same request, other format this time: the old file goes
+                    try:
+                        os.remove(self._path(key, old[1]))
+                    except OSError:
+                        pass
+            self._entries[key] = [size, ext, now_ts()]
+            self._entries.move_to_end(key)
+            self.bytes += size
+            self.counters["stored"] += 1
+            self._evict(now_ts())
+        self._dirty()
+
+    def clear(self) -> int:
+        with self._lock:
+            n = len(self._entries)
+            for k in list(self._entries):
+                self._drop(k)
+        self._dirty()
+        return n
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.counters, files=len(self._entries), bytes=self.bytes, max_bytes=self.max_bytes)
+
+    def close(self) -> None:
+        if self._persister is not None:
+            self._persister.mark_dirty("index")  # the last LRU order / counters
+            self._persister.close()
@@ -0,0 +1,238 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, List, Optional, Set, Tuple
+
+from .config import GEN_WORKERS
+
+# (fn, args, tag): tag identifies a waiting job to positions(), e.g. its status message
+Job = Tuple[Callable[..., Any], tuple, Any]
+
+
+class QueueFull(Exception):
+    pass
+
+
+class QueueClosed(RuntimeError):
+    # put() after close(): the bot is shutting down
+    pass
+
+
+class FairQueue:
+    """
+    FIFO per key (user), round-robin across keys: get() takes the oldest job
+    of the key at the head, then moves that key to the back. A user with 20
+    queued /random jobs gets every Nth slot, not the next 20.
+    """
+
+    def __init__(self):
+        self._keys: "OrderedDict[str, Deque[Job]]" = OrderedDict()
+        self._size = 0
+        self._closed = False
+        self._cv = threading.Condition()
+
+    def put(self, key: Any, job: Job, limit: int = 0) -> int:
+        """Queue a job; returns its 1-based position. Raises QueueFull at `limit` waiting jobs, QueueClosed after close()."""
+        with self._cv:
+            if self._closed:
+                raise QueueClosed("Queue closed")
+            if limit and self._size >= limit:
+                raise QueueFull(f"{self._size} jobs waiting")
+            self._keys.setdefault(str(key), deque()).append(job)
+            self._size += 1
+            self._cv.notify()
+            return self._position(str(key), len(self._keys[str(key)]) - 1)
+
+    def get(self, stop: Callable[[], bool] = lambda: False) -> Optional[Job]:
+        """Next job, blocking; None once the queue is closed or stop() says so."""
+        with self._cv:
+            while not self._keys and not self._closed and not stop():
+                self._cv.wait()
+            if self._closed or stop():
+                return None
+            return self._take()
+
+    def get_nowait(self) -> Optional[Job]:
+        """Next job or None, without waiting."""
+        with self._cv:
+            if self._closed or not self._keys:
+                return None
+            return self._take()
+
+    def _take(self) -> Job:
+        key, jobs = next(iter(self._keys.items()))
+        job = jobs.popleft()
+        if jobs:
+            self._keys.move_to_end(key)
+        else:
+            del self._keys[key]
+        self._size -= 1
+        return job
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def wake(self) -> None:
+        with self._cv:
+            self._cv.notify_all()
+
+    def _position(self, key: str, depth: int) -> int:
+        # rounds: every key ahead of ours gets depth+1 turns first, every key behind gets depth
+        pos = depth + 1
+        ahead = True
+        for k, jobs in self._keys.items():
+            if k == key:
+                ahead = False
+                continue
+            pos += min(len(jobs), depth + 1 if ahead else depth)
+        return pos
+
+    def positions(self) -> List[Tuple[Any, int]]:
+        """(tag, 1-based position) of every waiting job."""
+        with self._cv:
+            return [
+                (job[2], self._position(k, d))
+                for k, jobs in self._keys.items()
+                for d, job in enumerate(jobs)
+            ]
+
+    def close(self) -> int:
+        """Stop handing out jobs; returns how many were still waiting."""
+        with self._cv:
+            self._closed = True
+            left, self._size = self._size, 0
+            self._keys.clear()
+            self._cv.notify_all()
+            return left
+
+    def __len__(self) -> int:
+        return self._size
+
+
+class WorkerPool:
+    """
+    Daemon threads serving a FairQueue; fn(*args) errors are logged, not raised.
+    resize(n) changes the number of concurrent jobs at runtime: extra workers
+    are started at once, surplus ones exit after their current job.
+    """
+
+    def __init__(self, workers: int = GEN_WORKERS, name: str = "rao-gen"):
+        self.queue = FairQueue()
+        self.name = name
+        self.busy = 0
+        self.target = 0
+        self._alive: Set[int] = set()
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.resize(workers)
+
+    @property
+    def size(self) -> int:
+        return self.target
+
+    def resize(self, workers: int) -> None:
+        with self._lock:
+            self.target = max(1, int(workers))
+            for i in range(self.target):
+                if i not in self._alive:
+                    self._alive.add(i)
+                    t = threading.Thread(target=self._loop, args=(i,), name=f"{self.name}-{i}", daemon=True)
+                    self._threads.append(t)
+                    t.start()
+            self._threads = [t for t in self._threads if t.is_alive() or not t.ident]
+        self.queue.wake()
+
+    def _retire(self, i: int) -> bool:
+        with self._lock:
+            if i < self.target:
+                return False
+            self._alive.discard(i)
+            return True
+
+    def submit(self, key: Any, fn: Callable[..., Any], *args: Any, tag: Any = None, limit: int = 0) -> int:
+        """Queue fn(*args) for key; returns the queue position (QueueFull past `limit`)."""
+        return self.queue.put(key, (fn, args, tag), limit)
+
+    def _loop(self, i: int) -> None:
+        while not self._retire(i):
+            job = self.queue.get(stop=lambda: i >= self.target)
+            if job is None:
+                if self.queue.closed:
+                    with self._lock:
+                        self._alive.discard(i)
+                    return
+                continue
+            fn, args, _ = job
+            with self._lock:
+                self.busy += 1
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"⚠️ Job {getattr(fn, '__name__', fn)} failed: {e}")
+            finally:
+                with self._lock:
+                    self.busy -= 1
+
+    def close(self, timeout: float = 5) -> None:
+        left = self.queue.close()
+        if left:
+            print(f"⚠️ Dropped {left} queued jobs on shutdown")
+        # workers mid-fetch finish on their own (daemon threads); wait at most `timeout` overall
+        deadline = time.monotonic() + timeout
+        for t in list(self._threads):
+            t.join(timeout=max(0.0, deadline - time.monotonic()))
+
+
+class AsyncPool:
+    """
+    WorkerPool for coroutine jobs (ENGINE=async): the same FairQueue and
+    submit()/resize() contract, but a running job is a task on `loop`, not a
+    thread, so hundreds can wait on IMAGE_API at once.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, workers: int = GEN_WORKERS, name: str = "rao-gen"):
+        self.queue = FairQueue()
+        self.loop = loop
+        self.name = name
+        self.busy = 0  # only changed on the loop thread
+        self.target = max(1, int(workers))
+
+    @property
+    def size(self) -> int:
+        return self.target
+
+    def resize(self, workers: int) -> None:
+        self.target = max(1, int(workers))
+        self.loop.call_soon_threadsafe(self._fill)
+
+    def submit(self, key: Any, fn: Callable[..., Any], *args: Any, tag: Any = None, limit: int = 0) -> int:
+        """Queue the coroutine fn(*args) for key; returns the queue position (QueueFull past `limit`)."""
+        pos = self.queue.put(key, (fn, args, tag), limit)
+        self.loop.call_soon_threadsafe(self._fill)
+        return pos
+
+    def _fill(self) -> None:
+        while self.busy < self.target:
+            job = self.queue.get_nowait()
+            if job is None:
+                return
+            self.busy += 1
+            self.loop.create_task(self._run(job))
+
+    async def _run(self, job: Job) -> None:
+        fn, args, _ = job
+        try:
+            await fn(*args)
+        except Exception as e:
+            print(f"⚠️ Job {getattr(fn, '__name__', fn)} failed: {e}")
+        finally:
+            self.busy -= 1
+            self._fill()
+
+    def close(self, timeout: float = 5) -> None:
+        # running tasks end with the engine's loop
+        left = self.queue.close()
+        if left:
+            print(f"⚠️ Dropped {left} queued jobs on shutdown")
@@ -0,0 +1,19 @@
+import threading
+import zlib
+from typing import Any, List
+
+from .config import LOCK_STRIPES
+
+
+class StripedLock:
+    """
+    Fixed pool of re-entrant locks; a key (user id) always maps to the same one.
+    Different users mostly land on different stripes, so handlers for them
+    run in parallel while two updates for the same user are serialized.
+    """
+
+    def __init__(self, stripes: int = LOCK_STRIPES):
+        self._locks: List[threading.RLock] = [threading.RLock() for _ in range(max(1, int(stripes)))]
+
+    def __call__(self, key: Any) -> threading.RLock:
+        return self._locks[zlib.crc32(str(key).encode()) % len(self._locks)]
@@ -0,0 +1,114 @@
+import sys
+from typing import Any, Dict, Iterator, List, Optional
+
+HISTORY_KEEP = 12
+
+# per-user JSON keys, in the order they are written back
+FIELDS = (
+    "style", "model", "enhance", "history", "last_gen_ts",
+    "daily_date", "daily_used", "game_score", "tts_voice", "created_ts", "seen_ts",
+)
+# values repeated across many users: share one string object
+_INTERNED = ("style", "model", "daily_date", "tts_voice")
+
+
+def _intern(v: Any) -> Any:
+    return sys.intern(v) if isinstance(v, str) else v
+
+
+class UserProfile:
+    """
+    Compact user profile (one per entry of state["users"]).
+    __slots__ instead of a per-user dict, interned style/model/voice strings,
+    history as a list created on first prompt and trimmed in place to 12
+    (a deque(maxlen=12) costs ~760 bytes per user, more than the dict we replace).
+    Behaves like the old dict for get()/[]/update() and round-trips through
+    to_dict()/from_dict() without losing unknown keys.
+    """
+    __slots__ = FIELDS + ("extra",)
+
+    def __init__(self):
+        self.style = ""
+        self.model = ""
+        self.enhance = True
+        self.history: Optional[List[str]] = None
+        self.last_gen_ts = 0
+        self.daily_date = ""
+        self.daily_used = 0
+        self.game_score = 0
+        self.tts_voice = ""
+        self.created_ts = 0
+        self.seen_ts = 0
+        self.extra: Optional[Dict[str, Any]] = None
+
+    # ----- dict compatibility -----
+    def __getitem__(self, key: str) -> Any:
+        if key == "history":
+            return list(self.history or ())
+        if key in FIELDS:
+            return getattr(self, key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key == "history":
+            self.history = list(value)[-HISTORY_KEEP:] if value else None
+        elif key in FIELDS:
+            setattr(self, key, _intern(value) if key in _INTERNED else value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key: str) -> bool:
+        return key in FIELDS or bool(self.extra and key in self.extra)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self) -> Iterator[str]:
+        yield from FIELDS
+        if self.extra:
+            yield from self.extra
+
+    def update(self, fields: Optional[Dict[str, Any]] = None, **kw: Any) -> None:
+        for k, v in dict(fields or {}, **kw).items():
+            self[k] = v
+
+    def add_history(self, prompt: str) -> None:
+        if self.history is None:
+            self.history = []
+        self.history.append(prompt)
+        if len(self.history) > HISTORY_KEEP:
+            del self.history[:-HISTORY_KEEP]
+
+    def last_active(self) -> int:
+        # newest of created / generated / seen (seen_ts is bumped at most hourly)
+        return max(int(self.created_ts or 0), int(self.last_gen_ts or 0), int(self.seen_ts or 0))
+
+    # ----- JSON shape -----
+    def to_dict(self) -> Dict[str, Any]:
+        d = {k: getattr(self, k) for k in FIELDS}
+        d["history"] = list(self.history or ())
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    @classmethod
+    def from_dict(cls, data: Any) -> "UserProfile":
+        if isinstance(data, UserProfile):
+            return data
+        p = cls()
+        if isinstance(data, dict):
+            for k, v in data.items():
+                if k == "history" and not isinstance(v, list):
+                    continue
+                p[k] = v
+        return p
+
+    def __repr__(self) -> str:
+        return f"UserProfile({self.to_dict()!r})"
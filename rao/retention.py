@@ -0,0 +1,110 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .config import RETENTION_SWEEP_SECONDS, RETENTION_BATCH
+from .counters import CounterTable
+from .profile import UserProfile
+from .storage import StateStore
+from .utils import now_ts
+
+DAY = 86400
+
+
+def is_default_profile(u: UserProfile, settings: Dict[str, Any]) -> bool:
+    """Nothing worth keeping: bot defaults everywhere, no score, no unknown keys."""
+    return (
+        u.style in ("", settings.get("default_style", ""))
+        and u.model in ("", settings.get("default_model", ""))
+        and bool(u.enhance) == bool(settings.get("enhance_default", True))
+        and not u.tts_voice
+        and not u.game_score
+        and not u.extra
+    )
+
+
+class RetentionSweeper:
+    """
+    Background retention policy (owner settings, 0 = keep forever):
+      retention_days  -> drop profiles with default settings and no activity for N days
+      uname_ttl_days  -> expire username-cache rows whose ts is older than N days
+    Each tick handles at most `batch` candidates from the store's activity index,
+    so a sweep over a big user base is spread across many short ticks.
+    """
+
+    def __init__(self, store: StateStore, counters: Optional[CounterTable],
+                 settings: Callable[[], Dict[str, Any]],
+                 interval: float = RETENTION_SWEEP_SECONDS, batch: int = RETENTION_BATCH):
+        self.store = store
+        self.counters = counters
+        self.settings = settings
+        self.interval = max(1.0, float(interval))
+        self.batch = max(1, int(batch))
+        self.stats = {"users_dropped": 0, "unames_expired": 0, "last_ts": 0, "last_ms": 0.0}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="rao-retention", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                busy = self.tick()
+            except Exception as e:
+                print(f"⚠️ Retention sweep failed: {e}")
+                continue
+            # a full batch means there is a backlog: keep going, but yield in between
+            while busy and not self._stop.wait(1.0):
+                busy = self.tick()
+
+    def _last_active(self, uid: str, u: UserProfile) -> int:
+        last = u.last_active()
+        if self.counters is not None:
+            row = self.counters.read(int(uid))
+            if row is not None:
+                last = max(last, row[0])
+        return last
+
+    def sweep_users(self, days: int) -> tuple:
+        """(candidates looked at, profiles dropped) for one batch."""
+        cutoff = now_ts() - days * DAY
+        cands = self.store.stale_users(cutoff, self.batch)
+        S = self.settings()
+        dropped = 0
+        for uid in cands:
+            with self.store.user_lock(uid):
+                u = self.store.get_user(uid)
+                if u is None or self._last_active(uid, u) >= cutoff or not is_default_profile(u, S):
+                    continue
+                self.store.delete_user(uid)
+                if self.counters is not None and uid.lstrip("-").isdigit():
+                    self.counters.delete(int(uid))
+            dropped += 1
+        return len(cands), dropped
+
+    def tick(self) -> bool:
+        """One incremental step; True if either index still has a backlog."""
+        S = self.settings()
+        days = int(S.get("retention_days", 0) or 0)
+        ttl = int(S.get("uname_ttl_days", 0) or 0)
+        t = time.perf_counter()
+        busy = False
+        if days > 0:
+            seen, dropped = self.sweep_users(days)
+            self.stats["users_dropped"] += dropped
+            busy = seen >= self.batch
+        if ttl > 0:
+            n = self.store.expire_unames(now_ts() - ttl * DAY, self.batch)
+            self.stats["unames_expired"] += n
+            busy = busy or n >= self.batch
+        self.stats["last_ts"] = now_ts()
+        self.stats["last_ms"] = (time.perf_counter() - t) * 1000
+        return busy
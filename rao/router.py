@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# middleware: (ctx) -> True to go on, False to stop (it has replied itself)
+Middleware = Callable[[Any], bool]
+
+
+class RouteStats:
+    """In-process latency registry: call count + last `keep` timings per route."""
+
+    def __init__(self, keep: int = 1024):
+        self.keep = keep
+        self._rows: Dict[str, Tuple[List[int], Deque[float]]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            row = self._rows.get(name)
+            if row is None:
+                row = self._rows[name] = ([0], deque(maxlen=self.keep))
+            row[0][0] += 1
+            row[1].append(seconds)
+
+    @staticmethod
+    def _pct(sorted_ms: List[float], p: float) -> float:
+        if not sorted_ms:
+            return 0.0
+        return sorted_ms[min(len(sorted_ms) - 1, int(p * len(sorted_ms)))]
+
+    def snapshot(self) -> List[Tuple[str, int, float, float]]:
+        """(route, calls, p50 ms, p99 ms), slowest p99 first."""
+        with self._lock:
+            rows = [(k, n[0], sorted(x * 1000 for x in lat)) for k, (n, lat) in self._rows.items()]
+        out = [(k, n, self._pct(ms, 0.50), self._pct(ms, 0.99)) for k, n, ms in rows]
+        return sorted(out, key=lambda r: -r[3])
+
+
+class Route:
+    __slots__ = ("name", "fn", "guards")
+
+    def __init__(self, name: str, fn: Callable[[Any], Any], guards: Tuple[str, ...]):
+        self.name = name
+        self.fn = fn
+        self.guards = guards
+
+
+class Router:
+    """
+    O(1) dispatch table. Keys ending in ":" match by prefix ("setstyle:" serves
+    "setstyle:12"), anything else must match exactly. Each route names the
+    middleware (guards) it runs behind; middleware runs in use() order.
+    """
+
+    def __init__(self, stats: RouteStats, label: str = ""):
+        self.stats = stats
+        self.label = label
+        self.exact: Dict[str, Route] = {}
+        self.prefix: Dict[str, Route] = {}
+        self.middleware: List[Tuple[str, Middleware]] = []
+
+    def use(self, name: str, fn: Middleware) -> None:
+        self.middleware.append((name, fn))
+
+    def add(self, key: str, fn: Callable[[Any], Any], *guards: str) -> None:
+        route = Route(f"{self.label}{key}", fn, guards)
+        (self.prefix if key.endswith(":") else self.exact)[key] = route
+
+    def route(self, key: str, *guards: str) -> Callable:
+        def deco(fn: Callable[[Any], Any]) -> Callable[[Any], Any]:
+            self.add(key, fn, *guards)
+            return fn
+        return deco
+
+    def match(self, key: str) -> Optional[Route]:
+        r = self.exact.get(key)
+        if r is None and ":" in key:
+            r = self.prefix.get(key.split(":", 1)[0] + ":")
+        return r
+
+    def dispatch(self, key: str, ctx: Any) -> bool:
+        """Run the route for key; False if there is none."""
+        r = self.match(key)
+        if r is None:
+            return False
+        t = time.perf_counter()
+        try:
+            for name, mw in self.middleware:
+                if name in r.guards and not mw(ctx):
+                    return True
+            r.fn(ctx)
+        finally:
+            self.stats.record(r.name, time.perf_counter() - t)
+        return True
@@ -0,0 +1,371 @@
+"""
+SHARDS=N: one poller process long-polls Telegram and hands every update to
+worker process `user_id % N` over a local socket (multiprocessing.connection).
+Each worker is a full RaoBot on its own DATA_DIR/shard-<i>: its users, quota
+counters and write-behind persister live there and nowhere else, so JSON
+serialization and handler CPU are spread over N interpreters.
+
+Global state is replicated through the poller: a worker that changes settings
+or bans, learns a new @username (for /uid), or runs an owner-wide action such
+as broadcast publishes it, and the poller forwards it to every other worker. Updates for a crashed worker are
+buffered (up to DISPATCH_MAX_PENDING) while it is restarted; other shards keep
+running. A shard that falls that far behind pauses polling until it has room
+again (Telegram keeps the updates meanwhile): nothing is dropped. The poller's
+per-shard counters go to every worker for 📊 Stats.
+
+    python app.py                      # with SHARDS=4 in the environment
+    python -m rao.shards worker        # started by the poller, not by hand
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Any, Deque, Dict, List, Optional
+
+from telebot import apihelper, types
+
+from .config import BOT_TOKEN, DATA_DIR, DISPATCH_MAX_PENDING, SHARDS
+
+# replicated to every worker (and replayed to restarted ones); everything else is per shard
+REPLICATED = ("settings", "ban", "broadcast", "reset_all", "reset_user", "uname")
+LAYOUT_FILE = "shards.json"
+SEED_FILE = "shard-seed.ndjson"
+
+
+def shard_dir(root: str, index: int) -> str:
+    return os.path.join(root, f"shard-{index}")
+
+
+def update_owner(raw: dict) -> int:
+    """User id an update belongs to (sender, else chat); update_id when it has neither."""
+    for k, v in raw.items():
+        if isinstance(v, dict):
+            src = v.get("from") or v.get("user") or v.get("chat")
+            if isinstance(src, dict) and "id" in src:
+                return int(src["id"])
+    return int(raw.get("update_id", 0))
+
+
+def shard_of(uid: Any, shards: int) -> int:
+    return int(uid) % shards
+
+
+# ----------------- poller side -----------------
+class Shard:
+    __slots__ = ("index", "proc", "conn", "outbox", "sent", "stalls", "restarts", "started", "stats_queued")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.proc: Optional[subprocess.Popen] = None
+        self.conn: Optional[Connection] = None
+        self.outbox: Deque[tuple] = deque()
+        self.sent = 0
+        self.stalls = 0  # times polling paused because this shard's outbox was full
+        self.restarts = 0
+        self.started = 0.0
+        self.stats_queued = False
+
+
+class ShardPoller:
+    def __init__(self, shards: int = SHARDS, root: str = DATA_DIR, max_pending: int = DISPATCH_MAX_PENDING):
+        self.n = max(1, int(shards))
+        self.root = root
+        self.max_pending = max(1, int(max_pending))
+        self.key = os.urandom(16)
+        self.listener = Listener(("127.0.0.1", 0), authkey=self.key)
+        self.shards: List[Shard] = [Shard(i) for i in range(self.n)]
+        self.replay: Dict[Any, tuple] = {}  # latest settings + each uid's last ban, for restarted workers
+        self._cv = threading.Condition()
+        self._stop = threading.Event()
+        self._stats: List[Dict[str, Any]] = []  # last stats() pushed to the workers
+
+    # ---- layout / first start ----
+    def prepare(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        layout = os.path.join(self.root, LAYOUT_FILE)
+        if os.path.exists(layout):
+            with open(layout, "r", encoding="utf-8") as f:
+                n = int(json.load(f).get("shards", 0))
+            if n != self.n:
+                raise RuntimeError(f"DATA_DIR is split into {n} shards; start with SHARDS={n}")
+            return
+        # first sharded start: the single-process state becomes the seed every worker filters
+        from .backup import export_ndjson
+        from .counters import CounterTable
+        from .storage import open_store
+        store = open_store()
+        counters = CounterTable(store.paths.counters)
+        try:
+            with open(os.path.join(self.root, SEED_FILE), "w", encoding="utf-8") as f:
+                f.write(json.dumps({"t": "settings", "v": store.settings}, ensure_ascii=False) + "\n")
+                counts = export_ndjson(store, f, counters)
+        finally:
+            counters.close()
+            store.close()
+        with open(layout, "w", encoding="utf-8") as f:
+            json.dump({"shards": self.n}, f)
+        print(f"✅ Sharded DATA_DIR for {self.n} workers ({counts['user']} users)")
+
+    # ---- workers ----
+    def spawn(self, s: Shard) -> None:
+        if self._stop.is_set():
+            return
+        host, port = self.listener.address
+        env = dict(os.environ, DATA_DIR=shard_dir(self.root, s.index), SHARD_INDEX=str(s.index),
+                   SHARD_ROOT=self.root, SHARD_ADDR=f"{host}:{port}", SHARD_KEY=self.key.hex())
+        s.proc = subprocess.Popen([sys.executable, "-m", "rao.shards", "worker"], env=env)
+        s.started = time.monotonic()
+
+    def _accept_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                conn = self.listener.accept()
+                kind, index = conn.recv()
+            except Exception:
+                continue
+            if kind != "hello" or not 0 <= int(index) < self.n:
+                conn.close()
+                continue
+            s = self.shards[int(index)]
+            with self._cv:
+                s.outbox.extendleft(reversed(list(self.replay.values())))
+                s.conn = conn
+                self._cv.notify_all()
+            threading.Thread(target=self._read_loop, args=(s, conn), name=f"rao-shard-rx-{s.index}", daemon=True).start()
+            print(f"✅ Shard {s.index} connected (pid {s.proc.pid if s.proc else '?'})")
+
+    def _read_loop(self, s: Shard, conn: Connection) -> None:
+        # replicated messages from one worker go to all the others
+        while True:
+            try:
+                msg = conn.recv()
+            except (EOFError, OSError):
+                break
+            if not msg or msg[0] not in REPLICATED:
+                continue
+            with self._cv:
+                if msg[0] == "settings":
+                    self.replay["settings"] = msg
+                elif msg[0] == "ban":
+                    self.replay[("ban", str(msg[1]))] = msg
+                for other in self.shards:
+                    if other is not s:
+                        other.outbox.append(msg)
+                self._cv.notify_all()
+        self._detach(s, conn)
+
+    def _detach(self, s: Shard, conn: Connection) -> None:
+        with self._cv:
+            if s.conn is conn:
+                s.conn = None
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _send_loop(self, s: Shard) -> None:
+        while not self._stop.is_set():
+            with self._cv:
+                while not (s.outbox and s.conn is not None) and not self._stop.is_set():
+                    self._cv.wait(1)
+                if self._stop.is_set():
+                    return
+                conn, msg = s.conn, s.outbox[0]
+                if msg[0] == "shards":  # placeholder: the latest counters go out, not the ones when queued
+                    s.stats_queued = False
+                    out = ("shards", self._stats)
+                else:
+                    out = msg
+            try:
+                conn.send(out)
+            except (OSError, ValueError):
+                self._detach(s, conn)
+                continue
+            with self._cv:
+                if s.outbox and s.outbox[0] is msg:  # a reconnect may have put the replay in front
+                    s.outbox.popleft()
+                if out is msg:  # the stats placeholder is not counted, or every push would trigger the next
+                    s.sent += 1
+                self._cv.notify_all()
+
+    def _push_stats(self) -> None:
+        # for the workers' 📊 Stats: only when something changed, at most one waiting per shard
+        stats = self.stats()
+        with self._cv:
+            if stats == self._stats:
+                return
+            self._stats = stats
+            for s in self.shards:
+                if s.conn is not None and not s.stats_queued:
+                    s.stats_queued = True
+                    s.outbox.append(("shards",))
+            self._cv.notify_all()
+
+    def _watch_loop(self) -> None:
+        while not self._stop.wait(1):
+            self._push_stats()
+            for s in self.shards:
+                code = s.proc.poll() if s.proc else None
+                if code is None:
+                    continue
+                # crashed: restart with backoff; its updates wait in the outbox meanwhile
+                wait = min(30.0, 2.0 ** s.restarts) if time.monotonic() - s.started < 60 else 1.0
+                print(f"⚠️ Shard {s.index} exited ({code}); restarting in {wait:.0f}s")
+                s.proc = None
+                s.restarts += 1
+                t = threading.Timer(wait, self.spawn, args=(s,))
+                t.daemon = True
+                t.start()
+
+    # ---- polling ----
+    def pending(self) -> int:
+        # only live shards count: a dead shard must not stall the others
+        return sum(len(s.outbox) for s in self.shards if s.conn is not None)
+
+    def route(self, raw: dict) -> None:
+        s = self.shards[shard_of(update_owner(raw), self.n)]
+        with self._cv:
+            if len(s.outbox) >= self.max_pending and not self._stop.is_set():
+                # backpressure, not loss: stop polling until this shard has room (Telegram keeps the rest)
+                s.stalls += 1
+                print(f"⚠️ Shard {s.index} {'down' if s.conn is None else 'behind'} with "
+                      f"{len(s.outbox)} updates waiting; polling paused")
+                while len(s.outbox) >= self.max_pending and not self._stop.is_set():
+                    self._cv.wait(5)
+                print(f"✅ Shard {s.index} has room again; polling resumed")
+            s.outbox.append(("update", raw))
+            self._cv.notify_all()
+
+    def run(self, timeout: int = 60) -> None:
+        self.prepare()
+        threading.Thread(target=self._accept_loop, name="rao-shard-accept", daemon=True).start()
+        for s in self.shards:
+            threading.Thread(target=self._send_loop, args=(s,), name=f"rao-shard-tx-{s.index}", daemon=True).start()
+            self.spawn(s)
+        threading.Thread(target=self._watch_loop, name="rao-shard-watch", daemon=True).start()
+        print(f"✅ RaoBot shard poller started ({self.n} workers)")
+
+        offset = None
+        backoff = 1.0
+        try:
+            while not self._stop.is_set():
+                with self._cv:
+                    while self.pending() >= self.max_pending and not self._stop.is_set():
+                        self._cv.wait(5)
+                try:
+                    updates = apihelper.get_updates(BOT_TOKEN, offset, None, timeout, None, timeout)
+                    backoff = 1.0
+                except Exception as e:
+                    print(f"⚠️ getUpdates failed: {e} (retry in {backoff:.0f}s)")
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, 30.0)
+                    continue
+                for raw in updates:
+                    offset = int(raw["update_id"]) + 1
+                    self.route(raw)
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._cv:
+            self._cv.notify_all()
+        for s in self.shards:
+            if s.proc and s.proc.poll() is None:
+                s.proc.terminate()
+        for s in self.shards:
+            if s.proc:
+                try:
+                    s.proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    s.proc.kill()
+        self.listener.close()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        with self._cv:
+            return [{"shard": s.index, "up": s.conn is not None, "pending": len(s.outbox), "sent": s.sent,
+                     "stalls": s.stalls, "restarts": s.restarts} for s in self.shards]
+
+
+# ----------------- worker side -----------------
+class ShardLink:
+    """A worker's connection to the poller: receives its updates, publishes replicated changes."""
+
+    def __init__(self, index: int, address: str, key: bytes, shards: int = SHARDS):
+        host, port = address.rsplit(":", 1)
+        self.index = index
+        self.shards = max(1, int(shards))
+        self.conn = Client((host, int(port)), authkey=key)
+        self._send_lock = threading.Lock()
+        self.poller: List[Dict[str, Any]] = []  # ShardPoller.stats(), pushed when it changes
+        self.conn.send(("hello", index))
+
+    def publish(self, kind: str, *args: Any) -> None:
+        try:
+            with self._send_lock:
+                self.conn.send((kind,) + args)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Shard {self.index}: publish {kind} failed: {e}")
+
+    def serve(self, bot: Any, dispatcher: Any) -> None:
+        """Feed this shard's updates to the dispatcher until the poller goes away."""
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                print(f"⚠️ Shard {self.index}: poller gone, exiting")
+                return
+            if msg[0] == "update":
+                # backpressure: stop reading, the poller buffers and eventually pauses polling
+                dispatcher.queue.wait_below(dispatcher.max_pending, timeout=3600)
+                dispatcher.submit(types.Update.de_json(msg[1]))
+            elif msg[0] == "shards":
+                self.poller = msg[1]
+            else:
+                bot.apply_replicated(msg[0], *msg[1:])
+
+
+def seed_shard(store: Any, counters: Any, root: str, index: int, shards: int) -> None:
+    """First start of a worker: take its users and counters (and all settings / bans / usernames) from the seed."""
+    from .backup import import_ndjson
+    marker = os.path.join(shard_dir(root, index), ".seeded")
+    seed = os.path.join(root, SEED_FILE)
+    if os.path.exists(marker) or not os.path.exists(seed):
+        return
+
+    def mine(f):
+        for line in f:
+            rec = json.loads(line)
+            if rec.get("t") == "settings":
+                store.settings.clear()
+                store.settings.update(rec["v"])
+                store.mark_dirty("settings")
+            elif rec.get("t") not in ("user", "counter") or shard_of(rec["id"], shards) == index:
+                yield line
+
+    with open(seed, "r", encoding="utf-8") as f:
+        counts = import_ndjson(store, mine(f), counters)
+    with open(marker, "w", encoding="utf-8") as f:
+        f.write(str(counts["user"]))
+    print(f"✅ Shard {index} seeded: {counts['user']} users")
+
+
+def worker_main() -> None:
+    from .bot_app import RaoBot
+
+    index = int(os.environ["SHARD_INDEX"])
+    bot = RaoBot()
+    seed_shard(bot.store, bot.counters, os.environ.get("SHARD_ROOT", ""), index, SHARDS)
+    bot.cluster = ShardLink(index, os.environ["SHARD_ADDR"], bytes.fromhex(os.environ["SHARD_KEY"]))
+    bot.run()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["worker"]:
+        worker_main()
+    else:
+        print(__doc__)
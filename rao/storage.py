@@ -1,17 +1,65 @@
 import os
+import copy
 import json
-from typing import Any, Dict
-from .config import DATA_DIR
+import io
+import marshal
+import pickle
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from .config import (
+    DATA_DIR, SAVE_DELAY, SAVE_FSYNC, STORAGE_MODE, JOURNAL_COMPACT_BYTES,
+    STATE_BACKEND, SQLITE_USER_CACHE, SNAPSHOT_FORMAT,
+)
+from .utils import now_ts
+from .locks import StripedLock
+from .profile import UserProfile, HISTORY_KEEP
 
-def _p(name: str) -> str:
-    os.makedirs(DATA_DIR, exist_ok=True)
-    return os.path.join(DATA_DIR, name)
+class Paths:
+    """Files of one data directory (DATA_DIR, or a tenant's own one in rao/tenants.py)."""
 
-USERS_FILE = _p("users.json")
-SETTINGS_FILE = _p("settings.json")
-BANS_FILE = _p("bans.json")
-STYLES_CACHE_FILE = _p("styles_cache.json")
-USERNAME_CACHE_FILE = _p("username_cache.json")  # @username -> id mapping (only for users who've interacted)
+    def __init__(self, root: str = DATA_DIR):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.files = {
+            "settings": self._p("settings.json"),
+            "users": self._p("users.json"),
+            "bans": self._p("bans.json"),
+            "styles_cache": self._p("styles_cache.json"),
+            "uname_cache": self._p("username_cache.json"),  # @username -> id mapping (only for users who've interacted)
+        }
+        # same collections in the binary fast-start format ("<name>.snap")
+        self.snaps = {name: self._p(f"{name}.snap") for name in self.files}
+        self.journal = self._p("journal.ndjson")  # append-only deltas on top of the snapshots above
+        self.sqlite = self._p("state.db")
+        self.counters = self._p("counters.bin")  # mmap'ed cooldown / daily quota rows
+        self.image_cache = self._p("image_cache")  # rao/imagecache.py
+
+    def _p(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+PATHS = Paths()
+USERS_FILE = PATHS.files["users"]
+SETTINGS_FILE = PATHS.files["settings"]
+BANS_FILE = PATHS.files["bans"]
+STYLES_CACHE_FILE = PATHS.files["styles_cache"]
+USERNAME_CACHE_FILE = PATHS.files["uname_cache"]
+JOURNAL_FILE = PATHS.journal
+SQLITE_FILE = PATHS.sqlite
+COUNTERS_FILE = PATHS.counters
+
+FILES = PATHS.files
+SNAP_FILES = PATHS.snaps
+# v2: pickle at a fixed protocol (readable by any Python 3.8+); v1 was marshal, tied to one Python version
+SNAP_MAGIC = b"RAOSNAP2"
+SNAP_MAGIC_V1 = b"RAOSNAP1"
+SNAP_PROTOCOL = 4
+# collections whose entries are journaled one key at a time
+KEYED = ("users", "uname_cache")
+# big collections JsonStore loads on first use / during warm-up
+LAZY = ("users", "uname_cache")
 
 def load_json(path: str, default: Any) -> Any:
     try:
@@ -22,58 +70,1052 @@ def load_json(path: str, default: Any) -> Any:
     except Exception:
         return default
 
-def save_json(path: str, data: Any) -> None:
+def save_json(path: str, data: Any, fsync: bool = False) -> None:
+    # atomic: write temp file, then rename over the old one
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+DEFAULT_SETTINGS: Dict[str, Any] = {
+    "bot_enabled": True,
+    "cooldown_seconds": 8,
+    "cooldown_mode": "fixed",  # fixed | adaptive
+    "cooldown_min": 3,         # adaptive bounds (seconds)
+    "cooldown_max": 60,
+    "daily_limit": 40,  # 0=unlimited
+
+    "default_style": "Pointillism",
+    "default_model": "flux",
+    "models": ["flux", "sdxl"],
+    "image_cache_off": [],  # models whose images are always fetched fresh
+    "enhance_default": True,
+
+    # Join Gate (multi)
+    "join_gate_enabled": True,
+    "join_gate_strict": True,
+    "join_targets": [
+        {"chat": "@Rinneganzone", "invite": "https://t.me/Rinneganzone"}
+    ],
+
+    # UI
+    "ui_title": "Rao Image Generator",
+    "ui_subtitle": "Elite AI Image Lab • Ultra HD • Pro UI",
+    "footer": "Rao Lab • /gen /style /model • Root Protected",
+    "maintenance_text": "🚧 Bot is temporarily OFF. Please try later.",
+
+    # TTS
+    "tts_default_voice": "",
+
+    # Safety
+    "max_prompt_len": 380,
 
-def load_state() -> Dict[str, Any]:
-    settings = load_json(SETTINGS_FILE, {
-        "bot_enabled": True,
-        "cooldown_seconds": 8,
-        "daily_limit": 40,  # 0=unlimited
-
-        "default_style": "Pointillism",
-        "default_model": "flux",
-        "models": ["flux", "sdxl"],
-        "enhance_default": True,
-
-        # Join Gate (multi)
-        "join_gate_enabled": True,
-        "join_gate_strict": True,
-        "join_targets": [
-            {"chat": "@Rinneganzone", "invite": "https://t.me/Rinneganzone"}
-        ],
-
-        # UI
-        "ui_title": "Rao Image Generator",
-        "ui_subtitle": "Elite AI Image Lab • Ultra HD • Pro UI",
-        "footer": "Rao Lab • /gen /style /model • Root Protected",
-        "maintenance_text": "🚧 Bot is temporarily OFF. Please try later.",
-
-        # TTS
-        "tts_default_voice": "",
-
-        # Safety
-        "max_prompt_len": 380,
-    })
-
-    users = load_json(USERS_FILE, {})
-    bans = load_json(BANS_FILE, {"banned": []})
-    styles_cache = load_json(STYLES_CACHE_FILE, {"styles": [], "ts": 0})
-    uname_cache = load_json(USERNAME_CACHE_FILE, {})  # {"username": {"id":..., "name":..., "ts":...}}
+    # Retention (0 = keep forever)
+    "retention_days": 0,   # drop default-settings profiles inactive this long
+    "uname_ttl_days": 0,   # expire cached @username rows older than this
+}
 
+class SnapshotError(RuntimeError):
+    pass
+
+class _PlainUnpickler(pickle.Unpickler):
+    # snapshots only hold dicts / lists / str / numbers: never import anything
+    def find_class(self, module: str, name: str) -> Any:
+        raise pickle.UnpicklingError(f"unexpected {module}.{name} in snapshot")
+
+def save_snapshot(path: str, data: Any, fsync: bool = False) -> None:
+    # binary twin of save_json: magic + pickle (fixed protocol), written atomically
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(SNAP_MAGIC)
+        pickle.dump(data, f, protocol=SNAP_PROTOCOL)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def load_snapshot(path: str) -> Any:
+    """Raises SnapshotError when the file cannot be read back."""
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        if raw.startswith(SNAP_MAGIC):
+            return _PlainUnpickler(io.BytesIO(raw[len(SNAP_MAGIC):])).load()
+        if raw.startswith(SNAP_MAGIC_V1):
+            # written by an older release; only loads on the Python that wrote it
+            return marshal.loads(raw[len(SNAP_MAGIC_V1):])
+    except Exception as e:
+        raise SnapshotError(f"{path}: {e}") from e
+    raise SnapshotError(f"{path}: not a snapshot (bad header)")
+
+def default_collection(name: str) -> Any:
     return {
-        "settings": settings,
-        "users": users,
-        "bans": bans,
-        "styles_cache": styles_cache,
-        "uname_cache": uname_cache
-    }
-
-def persist_state(state: Dict[str, Any]) -> None:
-    save_json(SETTINGS_FILE, state["settings"])
-    save_json(USERS_FILE, state["users"])
-    save_json(BANS_FILE, state["bans"])
-    save_json(STYLES_CACHE_FILE, state["styles_cache"])
-    save_json(USERNAME_CACHE_FILE, state["uname_cache"])
+        "settings": lambda: copy.deepcopy(DEFAULT_SETTINGS),
+        "users": dict,
+        "bans": lambda: {"banned": []},
+        "styles_cache": lambda: {"styles": [], "ts": 0},
+        "uname_cache": dict,  # {"username": {"id":..., "name":..., "ts":...}}
+    }[name]()
+
+def load_collection(name: str, paths: Paths = PATHS) -> Any:
+    # whichever of <name>.snap / <name>.json was written last wins
+    jpath, spath = paths.files[name], paths.snaps[name]
+    if os.path.exists(spath) and (not os.path.exists(jpath) or os.path.getmtime(spath) >= os.path.getmtime(jpath)):
+        try:
+            return load_snapshot(spath)
+        except SnapshotError as e:
+            # the .json (if any) is older: loading it would silently roll the data back
+            print(f"❌ Snapshot unreadable, refusing to fall back to older {os.path.basename(jpath)}: {e}")
+            raise
+    return load_json(jpath, default_collection(name))
+
+def _fix_containers(state: Dict[str, Any]) -> None:
+    # ensure required containers exist
+    if "bans" in state:
+        if not isinstance(state["bans"], dict):
+            state["bans"] = {}
+        state["bans"].setdefault("banned", [])
+    for name in ("users", "uname_cache", "settings", "styles_cache"):
+        if name in state and not isinstance(state[name], dict):
+            state[name] = default_collection(name)
+
+def load_state(lazy: Iterable[str] = (), paths: Paths = PATHS) -> Dict[str, Any]:
+    """Load every collection except `lazy` ones, journal replayed on top."""
+    names = [n for n in FILES if n not in set(lazy)]
+    state = {n: load_collection(n, paths) for n in names}
+    _fix_containers(state)
+    replay_journal(state, only=names, paths=paths)
+    _fix_containers(state)
+    return state
+
+def persist_state(state: Dict[str, Any], fsync: bool = False, only: Optional[Iterable[str]] = None,
+                  fmt: str = SNAPSHOT_FORMAT, paths: Paths = PATHS) -> None:
+    names = list(FILES) if only is None else [n for n in FILES if n in set(only)]
+    for name in names:
+        if fmt == "binary":
+            save_snapshot(paths.snaps[name], state[name], fsync)
+        else:
+            save_json(paths.files[name], state[name], fsync)
+
+# ----------------- journal -----------------
+def journal_records(state: Dict[str, Any], dirty: Dict[str, Optional[Set[str]]]) -> list:
+    """
+    Delta records for the dirty parts of state:
+      {"c": "users", "k": "123", "v": {...}}   -> set one key
+      {"c": "users", "k": "123", "d": 1}       -> key deleted
+      {"c": "settings", "v": {...}}            -> whole collection
+    """
+    out = []
+    for coll, keys in dirty.items():
+        data = state.get(coll)
+        if keys is None or coll not in KEYED:
+            out.append({"c": coll, "v": data})
+            continue
+        for k in keys:
+            if k in data:
+                out.append({"c": coll, "k": k, "v": data[k]})
+            else:
+                out.append({"c": coll, "k": k, "d": 1})
+    return out
+
+def append_journal(records: list, fsync: bool = False, paths: Paths = PATHS) -> None:
+    if not records:
+        return
+    lines = "".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n" for r in records)
+    with open(paths.journal, "a", encoding="utf-8") as f:
+        f.write(lines)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+
+def journal_size(paths: Paths = PATHS) -> int:
+    try:
+        return os.path.getsize(paths.journal)
+    except OSError:
+        return 0
+
+def replay_journal(state: Dict[str, Any], only: Optional[Iterable[str]] = None, paths: Paths = PATHS) -> int:
+    if not os.path.exists(paths.journal):
+        return 0
+    names = set(FILES if only is None else only)
+    n = 0
+    with open(paths.journal, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                r = json.loads(line)
+            except Exception:
+                continue  # torn tail after a crash
+            coll = r.get("c")
+            if coll not in names:
+                continue
+            if "k" not in r:
+                state[coll] = r.get("v")
+            elif r.get("d"):
+                state[coll].pop(r["k"], None)
+            else:
+                state[coll][r["k"]] = r.get("v")
+            n += 1
+    return n
+
+def compact_state(state: Dict[str, Any], fsync: bool = False, paths: Paths = PATHS) -> None:
+    # fold the journal into fresh snapshots, then start an empty journal
+    persist_state(state, fsync, paths=paths)
+    try:
+        os.remove(paths.journal)
+    except FileNotFoundError:
+        pass
+
+
+Pending = Dict[str, Optional[Set[str]]]
+
+def copy_record(v: Any) -> Any:
+    # profiles / username rows are flat dicts whose only containers are lists
+    if isinstance(v, UserProfile):
+        return v.to_dict()
+    if isinstance(v, dict):
+        return {k: (list(x) if isinstance(x, list) else x) for k, x in v.items()}
+    return v
+
+def stable_copy(obj: Any) -> Any:
+    # small owner-edited blobs (settings, styles): retry if resized mid-copy
+    for _ in range(4):
+        try:
+            return copy.deepcopy(obj)
+        except RuntimeError:
+            continue
+    return copy.deepcopy(obj)
+
+class ActivityIndex:
+    """
+    Keys bucketed by day of last activity, oldest bucket first.
+    add() never removes a key from its older bucket: stale entries are
+    dropped when that bucket is popped, and callers re-check the real
+    activity of every key they get back.
+    """
+
+    def __init__(self, bucket_seconds: int = 86400):
+        self.bucket_seconds = max(1, int(bucket_seconds))
+        self._buckets: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, key: str, ts: int) -> None:
+        b = int(ts) // self.bucket_seconds
+        with self._lock:
+            self._buckets.setdefault(b, set()).add(key)
+
+    def pop_older(self, before_ts: int, limit: int) -> List[str]:
+        """Up to `limit` keys from buckets that end at or before before_ts."""
+        last = int(before_ts) // self.bucket_seconds
+        out: List[str] = []
+        with self._lock:
+            for b in sorted(self._buckets):
+                if b >= last or len(out) >= limit:
+                    break
+                keys = self._buckets[b]
+                while keys and len(out) < limit:
+                    out.append(keys.pop())
+                if not keys:
+                    del self._buckets[b]
+        return out
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(v) for v in self._buckets.values())
+
+
+class StatePersister:
+    """
+    Write-behind saver.
+    Callers only mark_dirty(coll, key); a background thread waits `delay`
+    seconds so every save in that window becomes one write(pending) call.
+    """
+
+    def __init__(self, write: Callable[[Pending], None], delay: float = SAVE_DELAY):
+        self.write = write
+        self.delay = max(0.0, float(delay))
+        self._pending: Pending = {}
+        self._lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stop = threading.Event()
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._loop, name="rao-persister", daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self, coll: Optional[str] = None, key: Optional[str] = None) -> None:
+        with self._lock:
+            if coll is None:
+                for name in FILES:
+                    self._pending[name] = None
+            elif key is None or coll not in KEYED:
+                self._pending[coll] = None
+            else:
+                keys = self._pending.setdefault(coll, set())
+                if keys is not None:
+                    keys.add(str(key))
+        self._dirty.set()
+
+    def _requeue(self, pending: Pending) -> None:
+        with self._lock:
+            for coll, keys in pending.items():
+                cur = self._pending.get(coll, set())
+                if keys is None or cur is None:
+                    self._pending[coll] = None
+                else:
+                    self._pending[coll] = cur | keys
+        self._dirty.set()
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            self._dirty.wait()
+            if self._stop.is_set():
+                break
+            # coalesce window: more saves may arrive meanwhile
+            self._stop.wait(self.delay)
+            self.flush()
+
+    def flush(self) -> None:
+        with self._write_lock:
+            with self._lock:
+                self._dirty.clear()
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            try:
+                self.write(pending)
+            except Exception as e:
+                self._requeue(pending)
+                print(f"⚠️ State save failed: {e}")
+
+    def close(self) -> None:
+        # stop the thread and write whatever is still pending
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._dirty.set()
+        self._thread.join(timeout=10)
+        self.flush()
+
+# ----------------- stores -----------------
+class StateStore(ABC):
+    """
+    Backend interface used by RaoBot.
+    settings / styles_cache are tiny and always in memory; users, bans and the
+    username cache are reached through point lookups only.
+    Profiles from get_user() are live: mutate them, then mark_dirty("users", uid).
+    A backend must implement every abstract method, or it cannot be constructed.
+    """
+    settings: Dict[str, Any]
+    styles_cache: Dict[str, Any]
+    persister: StatePersister
+    paths: Paths
+    # hold user_lock(uid) while mutating a profile (and marking it dirty)
+    user_lock: StripedLock
+
+    def mark_dirty(self, coll: Optional[str] = None, key: Optional[str] = None) -> None:
+        self.persister.mark_dirty(coll, key)
+
+    def flush(self) -> None:
+        self.persister.flush()
+
+    def close(self) -> None:
+        self.persister.close()
+
+    def warm(self) -> None:
+        """Load whatever open() deferred; called from the startup warm-up."""
+
+    # users
+    @abstractmethod
+    def get_user(self, uid: Any) -> Optional[UserProfile]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_user(self, uid: Any, data: dict) -> UserProfile:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_user(self, uid: Any) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear_users(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def user_count(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def user_ids(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_users(self) -> Iterator[Tuple[str, dict]]:
+        """(uid, JSON-shaped profile) for every user, streamed."""
+        raise NotImplementedError
+
+    # bans
+    @abstractmethod
+    def is_banned(self, uid: Any) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_banned(self, uid: Any, on: bool) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def ban_count(self) -> int:
+        raise NotImplementedError
+
+    @abstractmethod
+    def banned_ids(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    # username cache
+    @abstractmethod
+    def get_uname(self, uname: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def put_uname(self, uname: str, row: dict) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_unames(self) -> Iterator[Tuple[str, dict]]:
+        raise NotImplementedError
+
+    # retention
+    @abstractmethod
+    def stale_users(self, before_ts: int, limit: int) -> List[str]:
+        """
+        Next `limit` users whose last activity may be older than before_ts
+        (a cursor over the activity index; an empty list ends one pass).
+        Candidates only: re-check the profile under user_lock before deleting.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def expire_unames(self, before_ts: int, limit: int) -> int:
+        """Delete up to `limit` username rows with ts < before_ts; returns how many."""
+        raise NotImplementedError
+
+
+class JsonStore(StateStore):
+    """
+    The original JSON files (snapshot or journal mode), fully in memory.
+    Key add/remove happens under `_lock`; profile edits under user_lock(uid).
+    The persister serializes a snapshot copied under those locks, never the live dicts.
+    """
+
+    def __init__(self, mode: str = STORAGE_MODE, fsync: bool = SAVE_FSYNC,
+                 compact_bytes: int = JOURNAL_COMPACT_BYTES, paths: Paths = PATHS):
+        self.paths = paths
+        # users / uname_cache are loaded on first use (or by warm()), not here
+        self.state = load_state(lazy=LAZY, paths=paths)
+        self.mode = mode
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes
+        self.user_lock = StripedLock()
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._banned: Set[str] = set(map(str, self.state["bans"].get("banned", [])))
+        # last-activity indexes for the retention sweep, filled when users / unames load
+        self._active = ActivityIndex()
+        self._uname_ts = ActivityIndex()
+
+        if self.mode != "journal" and journal_size(paths):
+            # left over from journal mode: fold it in before snapshots get rewritten
+            compact_state(self.snapshot(), self.fsync, paths)
+
+        self.persister = StatePersister(self._write)
+
+    def _coll(self, name: str) -> Dict[str, Any]:
+        data = self.state.get(name)
+        if data is not None:
+            return data
+        with self._load_lock:
+            if name not in self.state:
+                part = {name: load_collection(name, self.paths)}
+                _fix_containers(part)
+                replay_journal(part, only=[name], paths=self.paths)
+                _fix_containers(part)
+                if name == "users":
+                    part[name] = {str(k): UserProfile.from_dict(v) for k, v in part[name].items()}
+                    for k, u in part[name].items():
+                        self._active.add(k, u.last_active())
+                else:
+                    for k, row in part[name].items():
+                        if isinstance(row, dict):
+                            self._uname_ts.add(k, int(row.get("ts", 0) or 0))
+                self.state[name] = part[name]
+            return self.state[name]
+
+    def warm(self) -> None:
+        for name in LAZY:
+            self._coll(name)
+
+    @property
+    def settings(self) -> Dict[str, Any]:
+        return self.state["settings"]
+
+    @property
+    def styles_cache(self) -> Dict[str, Any]:
+        return self.state["styles_cache"]
+
+    def snapshot(self, pending: Optional[Pending] = None) -> Dict[str, Any]:
+        """
+        Consistent copy of the dirty parts of state (everything if pending is None).
+        Keyed collections with a key set only carry those keys; a missing key means deleted.
+        """
+        colls = {name: None for name in FILES} if pending is None else pending
+        snap: Dict[str, Any] = {}
+        for coll, keys in colls.items():
+            if coll not in KEYED:
+                with self._lock:
+                    snap[coll] = stable_copy(self.state.get(coll))
+                continue
+            live = self._coll(coll)
+            with self._lock:
+                if keys is None:
+                    part = dict(live)
+                else:
+                    part = {k: live[k] for k in keys if k in live}
+            if coll == "users":
+                # profiles are edited in place: copy each under its stripe
+                for k, v in part.items():
+                    with self.user_lock(k):
+                        part[k] = copy_record(v)
+            # username rows are replaced, never edited: the shallow copy is enough
+            snap[coll] = part
+        return snap
+
+    def mark_dirty(self, coll: Optional[str] = None, key: Optional[str] = None) -> None:
+        if coll == "users" and key is not None:
+            # re-index on every change; the older bucket entry just goes stale
+            u = self.state.get("users", {}).get(str(key))
+            if u is not None:
+                self._active.add(str(key), u.last_active())
+        super().mark_dirty(coll, key)
+
+    def _write(self, pending: Pending) -> None:
+        if self.mode == "journal":
+            append_journal(journal_records(self.snapshot(pending), pending), self.fsync, self.paths)
+            if self.compact_bytes and journal_size(self.paths) >= self.compact_bytes:
+                compact_state(self.snapshot(), self.fsync, self.paths)
+        else:
+            # a file holds the whole collection: snapshot dirty collections in full
+            whole: Pending = {coll: None for coll in pending}
+            persist_state(self.snapshot(whole), self.fsync, only=pending, paths=self.paths)
+
+    def get_user(self, uid: Any) -> Optional[UserProfile]:
+        return self._coll("users").get(str(uid))
+
+    def put_user(self, uid: Any, data: dict) -> UserProfile:
+        p = UserProfile.from_dict(data)
+        users = self._coll("users")
+        with self._lock:
+            users[str(uid)] = p
+        self.mark_dirty("users", str(uid))
+        return p
+
+    def delete_user(self, uid: Any) -> None:
+        users = self._coll("users")
+        with self._lock:
+            users.pop(str(uid), None)
+        self.mark_dirty("users", str(uid))
+
+    def clear_users(self) -> None:
+        users = self._coll("users")
+        with self._lock:
+            users.clear()
+        self.mark_dirty("users")
+
+    def user_count(self) -> int:
+        return len(self._coll("users"))
+
+    def user_ids(self) -> Iterator[str]:
+        users = self._coll("users")
+        with self._lock:
+            return iter(list(users.keys()))
+
+    def iter_users(self) -> Iterator[Tuple[str, dict]]:
+        users = self._coll("users")
+        for k in self.user_ids():
+            u = users.get(k)
+            if u is None:
+                continue
+            with self.user_lock(k):
+                d = copy_record(u)
+            yield k, d
+
+    def is_banned(self, uid: Any) -> bool:
+        return str(uid) in self._banned
+
+    def set_banned(self, uid: Any, on: bool) -> None:
+        with self._lock:
+            if on:
+                self._banned.add(str(uid))
+            else:
+                self._banned.discard(str(uid))
+            self.state["bans"]["banned"] = list(self._banned)
+        self.mark_dirty("bans")
+
+    def ban_count(self) -> int:
+        return len(self._banned)
+
+    def banned_ids(self) -> Iterator[str]:
+        with self._lock:
+            return iter(list(self._banned))
+
+    def get_uname(self, uname: str) -> Optional[dict]:
+        return self._coll("uname_cache").get(uname)
+
+    def put_uname(self, uname: str, row: dict) -> None:
+        unames = self._coll("uname_cache")
+        with self._lock:
+            unames[uname] = row
+        self._uname_ts.add(uname, int(row.get("ts", 0) or 0))
+        self.mark_dirty("uname_cache", uname)
+
+    def iter_unames(self) -> Iterator[Tuple[str, dict]]:
+        unames = self._coll("uname_cache")
+        with self._lock:
+            return iter(list(unames.items()))
+
+    def stale_users(self, before_ts: int, limit: int) -> List[str]:
+        self._coll("users")
+        return self._active.pop_older(before_ts, limit)
+
+    def expire_unames(self, before_ts: int, limit: int) -> int:
+        unames = self._coll("uname_cache")
+        n = 0
+        for uname in self._uname_ts.pop_older(before_ts, limit):
+            with self._lock:
+                row = unames.get(uname)
+                if not isinstance(row, dict) or int(row.get("ts", 0) or 0) >= before_ts:
+                    continue  # refreshed since it was indexed
+                del unames[uname]
+            self.mark_dirty("uname_cache", uname)
+            n += 1
+        return n
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uid TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    created_ts INTEGER NOT NULL DEFAULT 0,
+    active_ts INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid TEXT NOT NULL,
+    prompt TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_uid ON history (uid, id);
+CREATE TABLE IF NOT EXISTS bans (
+    uid TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS uname_cache (
+    uname TEXT PRIMARY KEY,
+    id INTEGER NOT NULL,
+    name TEXT NOT NULL DEFAULT '',
+    ts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS uname_cache_ts ON uname_cache (ts);
+CREATE TABLE IF NOT EXISTS kv (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+class SqliteStore(StateStore):
+    """
+    sqlite3 (WAL) backend.
+    Only recently used profiles live in memory (LRU of `cache_size`);
+    dirty ones stay pinned until the persister has written them.
+    """
+
+    def __init__(self, path: str = "", cache_size: int = SQLITE_USER_CACHE, fsync: bool = SAVE_FSYNC,
+                 paths: Paths = PATHS):
+        self.paths = paths
+        path = path or paths.sqlite
+        self.cache_size = max(1, int(cache_size))
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db_lock = threading.RLock()
+        with self._db_lock:
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+            self.db.executescript(SQLITE_SCHEMA)
+            self._upgrade_schema()
+
+        self.user_lock = StripedLock()
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[str, UserProfile]" = OrderedDict()
+        self._dirty_users: Set[str] = set()
+        self._inflight: Set[str] = set()
+        self._deleted: Set[str] = set()  # deleted while _write held a copy: that copy must not be inserted
+        self._unames: Dict[str, dict] = {}
+        self._sweep_after: Optional[Tuple[int, str]] = None  # (active_ts, uid) cursor of stale_users()
+
+        self.migrate_from_json()
+        self.settings = self._kv_get("settings", copy.deepcopy(DEFAULT_SETTINGS))
+        self.styles_cache = self._kv_get("styles_cache", {"styles": [], "ts": 0})
+        self.persister = StatePersister(self._write)
+
+    def _upgrade_schema(self) -> None:
+        # databases created before the retention sweep have no active_ts yet
+        cols = [r[1] for r in self.db.execute("PRAGMA table_info(users)").fetchall()]
+        if "active_ts" not in cols:
+            self.db.execute("ALTER TABLE users ADD COLUMN active_ts INTEGER NOT NULL DEFAULT 0")
+            self.db.execute(
+                "UPDATE users SET active_ts = MAX(created_ts, "
+                "COALESCE(json_extract(data, '$.last_gen_ts'), 0), COALESCE(json_extract(data, '$.seen_ts'), 0))"
+            )
+        self.db.execute("CREATE INDEX IF NOT EXISTS users_active ON users (active_ts, uid)")
+
+    # ----- helpers -----
+    def _q(self, sql: str, args: tuple = ()) -> list:
+        with self._db_lock:
+            return self.db.execute(sql, args).fetchall()
+
+    def _kv_get(self, name: str, default: Any) -> Any:
+        rows = self._q("SELECT value FROM kv WHERE name=?", (name,))
+        if not rows:
+            return default
+        try:
+            return json.loads(rows[0][0])
+        except Exception:
+            return default
+
+    def _kv_put(self, name: str, value: Any) -> None:
+        self.db.execute(
+            "INSERT INTO kv (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value=excluded.value",
+            (name, json.dumps(value, ensure_ascii=False)),
+        )
+
+    def _put_user_row(self, uid: str, u: dict) -> None:
+        data = dict(u)
+        hist = data.pop("history", None) or []
+        active = max(int(data.get(k, 0) or 0) for k in ("created_ts", "last_gen_ts", "seen_ts"))
+        self.db.execute(
+            "INSERT INTO users (uid, data, created_ts, active_ts) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(uid) DO UPDATE SET data=excluded.data, active_ts=excluded.active_ts",
+            (uid, json.dumps(data, ensure_ascii=False), int(data.get("created_ts", 0) or 0), active),
+        )
+        self.db.execute("DELETE FROM history WHERE uid=?", (uid,))
+        self.db.executemany(
+            "INSERT INTO history (uid, prompt) VALUES (?, ?)",
+            [(uid, str(p)) for p in list(hist)[-HISTORY_KEEP:]],
+        )
+
+    def _put_uname_row(self, uname: str, row: dict) -> None:
+        self.db.execute(
+            "INSERT INTO uname_cache (uname, id, name, ts) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(uname) DO UPDATE SET id=excluded.id, name=excluded.name, ts=excluded.ts",
+            (uname, int(row.get("id", 0)), str(row.get("name", "")), int(row.get("ts", 0))),
+        )
+
+    def _evict(self, keep: Optional[str] = None) -> None:
+        # caller holds self._lock; oldest clean profiles go first,
+        # never `keep` (just handed out) or one a handler is editing (its stripe is held)
+        while len(self._users) > self.cache_size:
+            for k in self._users:
+                if k == keep or k in self._dirty_users or k in self._inflight:
+                    continue
+                lk = self.user_lock(k)
+                if not lk.acquire(blocking=False):
+                    continue
+                try:
+                    del self._users[k]
+                finally:
+                    lk.release()
+                break
+            else:
+                return
+
+    def migrate_from_json(self) -> None:
+        """One-shot import of the JSON files (and journal) into an empty database."""
+        if self._kv_get("migrated_ts", None) is not None:
+            return
+        if any(os.path.exists(f) for f in self.paths.files.values()) or journal_size(self.paths):
+            st = load_state(paths=self.paths)
+            with self._db_lock:
+                self.db.execute("BEGIN")
+                try:
+                    for uid, u in st["users"].items():
+                        if isinstance(u, dict):
+                            self._put_user_row(str(uid), u)
+                    self.db.executemany(
+                        "INSERT OR IGNORE INTO bans (uid) VALUES (?)",
+                        [(str(x),) for x in st["bans"].get("banned", [])],
+                    )
+                    for uname, row in st["uname_cache"].items():
+                        if isinstance(row, dict):
+                            self._put_uname_row(uname, row)
+                    self._kv_put("settings", st["settings"])
+                    self._kv_put("styles_cache", st["styles_cache"])
+                    self._kv_put("migrated_ts", now_ts())
+                    self.db.execute("COMMIT")
+                except Exception:
+                    self.db.execute("ROLLBACK")
+                    raise
+            print(f"✅ Migrated JSON state to SQLite: {len(st['users'])} users")
+        else:
+            with self._db_lock:
+                self._kv_put("migrated_ts", now_ts())
+
+    # ----- persister -----
+    def mark_dirty(self, coll: Optional[str] = None, key: Optional[str] = None) -> None:
+        if coll == "users" and key is not None:
+            with self._lock:
+                self._dirty_users.add(str(key))
+        super().mark_dirty(coll, key)
+
+    def _write(self, pending: Pending) -> None:
+        with self._lock:
+            if "users" in pending and pending["users"] is None:
+                self._dirty_users.update(self._users.keys())
+            keys, self._dirty_users = self._dirty_users, set()
+            self._inflight |= keys
+            live = [(k, self._users[k]) for k in keys if k in self._users]
+            unames, self._unames = self._unames, {}
+        users = []
+        for k, u in live:
+            with self.user_lock(k):
+                users.append((k, copy_record(u)))
+        settings = stable_copy(self.settings) if "settings" in pending else None
+        styles_cache = stable_copy(self.styles_cache) if "styles_cache" in pending else None
+        try:
+            with self._db_lock:
+                # delete_user takes _db_lock first, so no delete can slip in between this check and COMMIT
+                with self._lock:
+                    gone = self._deleted & keys
+                self.db.execute("BEGIN")
+                try:
+                    for k, u in users:
+                        if k not in gone:
+                            self._put_user_row(k, u)
+                    for uname, row in unames.items():
+                        self._put_uname_row(uname, row)
+                    if settings is not None:
+                        self._kv_put("settings", settings)
+                    if styles_cache is not None:
+                        self._kv_put("styles_cache", styles_cache)
+                    self.db.execute("COMMIT")
+                except Exception:
+                    self.db.execute("ROLLBACK")
+                    raise
+        except Exception:
+            with self._lock:
+                self._dirty_users |= keys
+                for uname, row in unames.items():
+                    self._unames.setdefault(uname, row)
+            raise
+        finally:
+            with self._lock:
+                self._inflight -= keys
+                self._deleted -= keys
+                self._evict()
+
+    def close(self) -> None:
+        super().close()
+        with self._db_lock:
+            self.db.close()
+
+    # ----- users -----
+    def get_user(self, uid: Any) -> Optional[UserProfile]:
+        k = str(uid)
+        with self._lock:
+            u = self._users.get(k)
+            if u is not None:
+                self._users.move_to_end(k)
+                return u
+        rows = self._q("SELECT data FROM users WHERE uid=?", (k,))
+        if not rows:
+            return None
+        data = json.loads(rows[0][0])
+        hist = self._q("SELECT prompt FROM history WHERE uid=? ORDER BY id DESC LIMIT ?", (k, HISTORY_KEEP))
+        data["history"] = [r[0] for r in reversed(hist)]
+        u = UserProfile.from_dict(data)
+        with self._lock:
+            u = self._users.setdefault(k, u)
+            self._users.move_to_end(k)
+            self._evict(keep=k)
+        return u
+
+    def put_user(self, uid: Any, data: dict) -> UserProfile:
+        k = str(uid)
+        p = UserProfile.from_dict(data)
+        with self._lock:
+            self._users[k] = p
+            self._users.move_to_end(k)
+        self.mark_dirty("users", k)
+        return p
+
+    def delete_user(self, uid: Any) -> None:
+        k = str(uid)
+        with self._db_lock:
+            with self._lock:
+                self._users.pop(k, None)
+                self._dirty_users.discard(k)
+                if k in self._inflight:
+                    self._deleted.add(k)
+            self.db.execute("DELETE FROM users WHERE uid=?", (k,))
+            self.db.execute("DELETE FROM history WHERE uid=?", (k,))
+
+    def clear_users(self) -> None:
+        with self._db_lock:
+            with self._lock:
+                self._users.clear()
+                self._dirty_users.clear()
+                self._deleted |= self._inflight
+            self.db.execute("DELETE FROM users")
+            self.db.execute("DELETE FROM history")
+
+    def _overlay(self) -> Set[str]:
+        # profiles changed in memory but not committed yet (dirty, or being written right now)
+        with self._lock:
+            return {k for k in self._dirty_users | self._inflight if k in self._users and k not in self._deleted}
+
+    def user_count(self) -> int:
+        # committed rows plus the overlay's new users; no flush on the handler thread
+        overlay = sorted(self._overlay())
+        with self._db_lock:
+            n = int(self.db.execute("SELECT COUNT(*) FROM users").fetchone()[0])
+            for i in range(0, len(overlay), 500):
+                part = overlay[i:i + 500]
+                marks = ",".join("?" * len(part))
+                n += len(part) - self.db.execute(f"SELECT COUNT(*) FROM users WHERE uid IN ({marks})",
+                                                 tuple(part)).fetchone()[0]
+        return n
+
+    def user_ids(self) -> Iterator[str]:
+        # paged by primary key so a broadcast never holds every id at once; overlay ids come last
+        overlay = self._overlay()
+        last = ""
+        while True:
+            rows = self._q("SELECT uid FROM users WHERE uid > ? ORDER BY uid LIMIT 1000", (last,))
+            if not rows:
+                break
+            for (uid,) in rows:
+                if uid not in overlay:
+                    yield uid
+            last = rows[-1][0]
+        for uid in sorted(overlay):
+            if self.get_user(uid) is not None:
+                yield uid
+
+    def iter_users(self) -> Iterator[Tuple[str, dict]]:
+        # committed rows, except that overlay users are read from memory (their row may be stale or missing)
+        overlay = self._overlay()
+        last = ""
+        while True:
+            rows = self._q("SELECT uid, data FROM users WHERE uid > ? ORDER BY uid LIMIT 500", (last,))
+            if not rows:
+                break
+            last = rows[-1][0]
+            rows = [r for r in rows if r[0] not in overlay]
+            if not rows:
+                continue
+            hist: Dict[str, List[str]] = {}
+            marks = ",".join("?" * len(rows))
+            for uid, prompt in self._q(f"SELECT uid, prompt FROM history WHERE uid IN ({marks}) ORDER BY id",
+                                       tuple(r[0] for r in rows)):
+                hist.setdefault(uid, []).append(prompt)
+            for uid, data in rows:
+                d = json.loads(data)
+                d["history"] = hist.get(uid, [])
+                yield uid, UserProfile.from_dict(d).to_dict()
+        for uid in sorted(overlay):
+            u = self.get_user(uid)
+            if u is None:
+                continue
+            with self.user_lock(uid):
+                d = copy_record(u)
+            yield uid, d
+
+    # ----- bans -----
+    def is_banned(self, uid: Any) -> bool:
+        return bool(self._q("SELECT 1 FROM bans WHERE uid=?", (str(uid),)))
+
+    def set_banned(self, uid: Any, on: bool) -> None:
+        with self._db_lock:
+            if on:
+                self.db.execute("INSERT OR IGNORE INTO bans (uid) VALUES (?)", (str(uid),))
+            else:
+                self.db.execute("DELETE FROM bans WHERE uid=?", (str(uid),))
+
+    def ban_count(self) -> int:
+        return int(self._q("SELECT COUNT(*) FROM bans")[0][0])
+
+    def banned_ids(self) -> Iterator[str]:
+        last = ""
+        while True:
+            rows = self._q("SELECT uid FROM bans WHERE uid > ? ORDER BY uid LIMIT 1000", (last,))
+            if not rows:
+                return
+            for (uid,) in rows:
+                yield uid
+            last = rows[-1][0]
+
+    # ----- username cache -----
+    def get_uname(self, uname: str) -> Optional[dict]:
+        with self._lock:
+            row = self._unames.get(uname)
+        if row is not None:
+            return row
+        rows = self._q("SELECT id, name, ts FROM uname_cache WHERE uname=?", (uname,))
+        if not rows:
+            return None
+        return {"id": rows[0][0], "name": rows[0][1], "ts": rows[0][2]}
+
+    def put_uname(self, uname: str, row: dict) -> None:
+        with self._lock:
+            self._unames[uname] = row
+        self.mark_dirty("uname_cache", uname)
+
+    def iter_unames(self) -> Iterator[Tuple[str, dict]]:
+        self.flush()
+        last = ""
+        while True:
+            rows = self._q("SELECT uname, id, name, ts FROM uname_cache WHERE uname > ? ORDER BY uname LIMIT 1000",
+                           (last,))
+            if not rows:
+                return
+            for uname, id_, name, ts in rows:
+                yield uname, {"id": id_, "name": name, "ts": ts}
+            last = rows[-1][0]
+
+    # ----- retention -----
+    def stale_users(self, before_ts: int, limit: int) -> List[str]:
+        # walks users_active from the oldest row; profiles kept by the caller are
+        # stepped over by the cursor, which restarts once a pass comes up short
+        after = self._sweep_after or (-1, "")
+        rows = self._q(
+            "SELECT active_ts, uid FROM users WHERE active_ts < ? AND (active_ts, uid) > (?, ?) "
+            "ORDER BY active_ts, uid LIMIT ?",
+            (int(before_ts), after[0], after[1], int(limit)),
+        )
+        self._sweep_after = (rows[-1][0], rows[-1][1]) if len(rows) >= limit else None
+        return [uid for _, uid in rows]
+
+    def expire_unames(self, before_ts: int, limit: int) -> int:
+        # rows still waiting in self._unames are fresh and get written after this
+        with self._db_lock:
+            cur = self.db.execute(
+                "DELETE FROM uname_cache WHERE uname IN "
+                "(SELECT uname FROM uname_cache WHERE ts < ? ORDER BY ts LIMIT ?)",
+                (int(before_ts), int(limit)),
+            )
+            return cur.rowcount
+
+
+def open_store(backend: str = STATE_BACKEND, data_dir: str = "") -> StateStore:
+    paths = Paths(data_dir) if data_dir else PATHS
+    if backend == "sqlite":
+        return SqliteStore(paths=paths)
+    return JsonStore(paths=paths)
@@ -0,0 +1,149 @@
+"""
+Several branded bots in one process (TENANTS_FILE=tenants.json):
+
+    [
+      {"bot_token": "123:AAA", "bot_name": "Rao Image Generator", "bot_username": "@RaoImagery_bot"},
+      {"bot_token": "456:BBB", "bot_name": "Other Brand", "bot_username": "@OtherBrand_bot",
+       "owner_id": 12345, "data_dir": ".data/other"}
+    ]
+
+Keys left out fall back to the env config (BOT_NAME, OWNER_ID, ...); data_dir
+defaults to DATA_DIR/<bot id>. Each tenant is a full RaoBot with its own
+state; the process shares telebot's HTTP sessions, the upstream clients and
+SharedCaches (styles list, TTS voices, the on-disk image cache in
+DATA_DIR/image_cache), so N brands cost one fetch, not N.
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from .config import (
+    BOT_TOKEN, BOT_NAME, BOT_USERNAME, OWNER_ID, OWNER_NAME, OWNER_USERNAME, OWNER_LINK, OWNER_BIO, DATA_DIR,
+)
+from .imagecache import ImageCache
+
+T = TypeVar("T")
+
+
+class Tenant:
+    """Identity + data directory of one bot; Tenant() is the single-bot env config."""
+
+    DEFAULTS: Dict[str, Any] = {
+        "bot_token": BOT_TOKEN,
+        "bot_name": BOT_NAME,
+        "bot_username": BOT_USERNAME,
+        "owner_id": OWNER_ID,
+        "owner_name": OWNER_NAME,
+        "owner_username": OWNER_USERNAME,
+        "owner_link": OWNER_LINK,
+        "owner_bio": OWNER_BIO,
+        "data_dir": DATA_DIR,
+    }
+    __slots__ = tuple(DEFAULTS)
+
+    def __init__(self, **kw: Any):
+        unknown = set(kw) - set(self.DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown tenant keys: {', '.join(sorted(unknown))}")
+        for k, default in self.DEFAULTS.items():
+            setattr(self, k, kw.get(k, default))
+        self.owner_id = int(self.owner_id)
+
+    @property
+    def label(self) -> str:
+        return self.bot_username or self.bot_token.split(":", 1)[0]
+
+
+class SharedCaches:
+    """
+    Upstream data that is the same for every tenant. `lock` only guards the
+    fields (never held across a fetch); once() makes concurrent misses one fetch.
+    The image cache lives under image_cache_root, or else the first tenant's dir.
+    """
+
+    def __init__(self, image_cache_root: str = ""):
+        self.lock = threading.Lock()
+        self.styles_cache: Dict[str, Any] = {"styles": [], "ts": 0}
+        self.voices: List[str] = []
+        self._flights: Dict[str, Future] = {}
+        self.image_cache_root = image_cache_root
+        self._image_cache: Optional[ImageCache] = None
+        self._image_cache_users = 0
+
+    def image_cache(self, root: str) -> ImageCache:
+        """The process-wide ImageCache; every caller releases it with release_image_cache()."""
+        with self.lock:
+            if self._image_cache is None:
+                self._image_cache = ImageCache(self.image_cache_root or root)
+            self._image_cache_users += 1
+            return self._image_cache
+
+    def release_image_cache(self) -> None:
+        # the last tenant to close writes the index
+        with self.lock:
+            self._image_cache_users -= 1
+            cache = self._image_cache if self._image_cache_users == 0 else None
+        if cache is not None:
+            cache.close()
+
+    def once(self, name: str, fetch: Callable[[], T]) -> T:
+        """Single-flight: the first caller runs fetch() unlocked, callers meanwhile wait for its result."""
+        with self.lock:
+            flight = self._flights.get(name)
+            leader = flight is None
+            if leader:
+                flight = self._flights[name] = Future()
+        if not leader:
+            return flight.result()
+        try:
+            flight.set_result(fetch())
+        except BaseException as e:
+            flight.set_exception(e)
+        finally:
+            with self.lock:
+                del self._flights[name]
+        return flight.result()
+
+
+def load_tenants(path: str) -> List[Tenant]:
+    with open(path, "r", encoding="utf-8") as f:
+        rows = json.load(f)
+    if not isinstance(rows, list) or not rows:
+        raise RuntimeError(f"{path}: expected a non-empty JSON list of tenants")
+    tenants = []
+    for i, row in enumerate(rows):
+        if not isinstance(row, dict) or not str(row.get("bot_token", "")).strip():
+            raise RuntimeError(f"{path}: tenant #{i + 1} has no bot_token")
+        row = dict(row)
+        row.setdefault("data_dir", os.path.join(DATA_DIR, str(row["bot_token"]).split(":", 1)[0]))
+        tenants.append(Tenant(**row))
+    dirs = [os.path.abspath(t.data_dir) for t in tenants]
+    if len(set(dirs)) != len(dirs):
+        raise RuntimeError(f"{path}: two tenants share a data_dir")
+    return tenants
+
+
+def run_tenants(path: str) -> None:
+    """Start every tenant's RaoBot (one polling thread each) and block until interrupted."""
+    from .bot_app import RaoBot
+    from .config import WEBHOOK_URL
+
+    if WEBHOOK_URL:
+        raise RuntimeError("TENANTS_FILE runs every bot with long polling; unset WEBHOOK_URL")
+    shared = SharedCaches(image_cache_root=os.path.join(DATA_DIR, "image_cache"))
+    bots = [RaoBot(t, shared) for t in load_tenants(path)]
+    threads = []
+    for b in bots:
+        t = threading.Thread(target=b.run, name=f"rao-tenant-{b.tenant.label}", daemon=True)
+        t.start()
+        threads.append(t)
+    print(f"✅ {len(bots)} tenants running: {', '.join(b.tenant.label for b in bots)}")
+    try:
+        while any(t.is_alive() for t in threads):
+            time.sleep(1)
+    finally:
+        for b in bots:
+            b.close()
@@ -26,6 +26,16 @@ def main_kb(is_owner: bool, enhance_on: bool) -> types.InlineKeyboardMarkup:
         kb.add(types.InlineKeyboardButton("🧬 Owner Control Room (Root)", callback_data="owner:panel"))
     return kb
 
+def image_cache_kb(models: list, off: list) -> types.InlineKeyboardMarkup:
+    kb = types.InlineKeyboardMarkup(row_width=2)
+    kb.add(*[
+        types.InlineKeyboardButton(f"🧠 {m}: {'❌ OFF' if m in off else '✅ ON'}", callback_data=f"imgcache:{m}")
+        for m in models
+    ])
+    kb.add(types.InlineKeyboardButton("🗑 Clear Cache", callback_data="owner:cache_clear"))
+    kb.add(types.InlineKeyboardButton("🔙 Back", callback_data="owner:panel"))
+    return kb
+
 def back_kb() -> types.InlineKeyboardMarkup:
     kb = types.InlineKeyboardMarkup()
     kb.add(types.InlineKeyboardButton("🔙 Back", callback_data="back:main"))
@@ -76,6 +86,18 @@ def owner_kb(settings: dict) -> types.InlineKeyboardMarkup:
         types.InlineKeyboardButton("📢 Broadcast", callback_data="owner:broadcast"),
         types.InlineKeyboardButton("🚫 Ban/Unban", callback_data="owner:ban_unban"),
     )
+    kb.add(
+        types.InlineKeyboardButton("💾 Backup", callback_data="owner:backup"),
+        types.InlineKeyboardButton("📥 Restore", callback_data="owner:restore"),
+    )
+    kb.add(
+        types.InlineKeyboardButton("🚦 Gen Limits", callback_data="owner:gen_limits"),
+        types.InlineKeyboardButton("🧹 Retention", callback_data="owner:retention"),
+    )
+    kb.add(
+        types.InlineKeyboardButton("📈 Routes", callback_data="owner:routes"),
+        types.InlineKeyboardButton("🗄 Image Cache", callback_data="owner:image_cache"),
+    )
     kb.add(
         types.InlineKeyboardButton("♻️ Reset User", callback_data="owner:reset_user"),
         types.InlineKeyboardButton("🧨 Reset ALL", callback_data="owner:reset_all"),
@@ -1,10 +1,10 @@
 from ..config import BOT_NAME
 
-def panel_text(settings: dict, user: dict) -> str:
+def panel_text(settings: dict, user: dict, bot_name: str = BOT_NAME) -> str:
     style = user.get("style", settings.get("default_style","Pointillism"))
     model = user.get("model", settings.get("default_model","flux"))
     enh = "ON ✅" if user.get("enhance", True) else "OFF ❌"
-    title = str(settings.get("ui_title", BOT_NAME))
+    title = str(settings.get("ui_title", bot_name))
     subtitle = str(settings.get("ui_subtitle", "Elite AI Image Lab • Ultra HD • Pro UI"))
     footer = str(settings.get("footer", "Rao Lab • /gen /style /model • Root Protected"))
 
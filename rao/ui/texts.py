@@ -1,13 +1,14 @@
 from ..config import OWNER_NAME, OWNER_USERNAME, OWNER_LINK, OWNER_BIO
 
-def help_text() -> str:
+def help_text(owner_name: str = OWNER_NAME, owner_username: str = OWNER_USERNAME,
+              owner_link: str = OWNER_LINK, owner_bio: str = OWNER_BIO) -> str:
     return (
         "ℹ️ <b>Help & Support</b>\n"
         "━━━━━━━━━━━━━━━━━━━━━━\n"
-        f"👑 <b>Owner:</b> {OWNER_NAME}\n"
-        f"🔗 <b>Username:</b> {OWNER_USERNAME}\n"
-        f"🌐 <b>Link:</b> <a href=\"{OWNER_LINK}\">{OWNER_LINK}</a>\n"
-        f"📝 <b>Bio:</b> {OWNER_BIO}\n"
+        f"👑 <b>Owner:</b> {owner_name}\n"
+        f"🔗 <b>Username:</b> {owner_username}\n"
+        f"🌐 <b>Link:</b> <a href=\"{owner_link}\">{owner_link}</a>\n"
+        f"📝 <b>Bio:</b> {owner_bio}\n"
         "━━━━━━━━━━━━━━━━━━━━━━\n"
         "✅ <b>Image:</b> /gen prompt\n"
         "🎙 <b>TTS:</b> /tts text\n"
@@ -0,0 +1,161 @@
+"""
+Webhook receiver (WEBHOOK_URL set): a stdlib ThreadingHTTPServer that checks
+Telegram's secret-token header, hands the update to the UpdateDispatcher and
+answers 200 at once; handlers run later on the dispatcher threads. While
+DISPATCH_MAX_PENDING updates are waiting it answers 503 instead, and Telegram
+delivers the update again later.
+
+Replay recorded updates against a local server (WEBHOOK_URL=http://...):
+
+    python -m rao.webhook updates.json [http://127.0.0.1:8080/webhook] [--secret S]
+
+(a JSON list, one update object, or one update per line; --secret, or else
+WEBHOOK_SECRET, is sent as the header). In local mode an empty WEBHOOK_SECRET
+turns the header check off, so replays work without one.
+"""
+import hmac
+import json
+import secrets
+import sys
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Deque, Dict, List, Set
+from urllib.parse import urlparse
+
+from telebot import TeleBot, types
+
+from .config import WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+MAX_BODY = 1024 * 1024  # Telegram updates are a few KB
+QUEUE_WAIT = 1.0  # seconds a request may wait for room before 503
+SEEN_IDS = 2048  # recent update_ids: redeliveries of an update we already took are dropped
+
+
+class WebhookServer:
+    def __init__(self, bot: TeleBot, dispatcher: Any, url: str = WEBHOOK_URL, listen: str = WEBHOOK_LISTEN,
+                 port: int = WEBHOOK_PORT, secret: str = WEBHOOK_SECRET):
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.url = url
+        self.path = urlparse(url).path or "/"
+        # local mode (http:// URL, nothing registered with Telegram): no secret configured = no check.
+        # Telegram allows A-Z a-z 0-9 _ - (1-256 chars); token_urlsafe only uses those
+        self.local = not url.startswith("https://")
+        self.secret = secret if secret or self.local else secrets.token_urlsafe(32)
+        self.stats: Dict[str, int] = {"accepted": 0, "busy": 0, "forbidden": 0, "bad": 0, "duplicate": 0}
+        self._seen: Set[int] = set()
+        self._seen_order: Deque[int] = deque()
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((listen, int(port)), self._handler())
+        self.httpd.daemon_threads = True
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, code: int):
+                self.send_response(code)
+                if code == 503:
+                    self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def do_GET(self):
+                self._reply(404 if self.path.split("?", 1)[0] != server.path else 405)
+
+            def do_POST(self):
+                self._reply(server.receive(self.path, self.headers, self.rfile))
+
+        return Handler
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def receive(self, path: str, headers: Any, body: Any) -> int:
+        """HTTP status for one POST; the update is queued before 200 is returned."""
+        if path.split("?", 1)[0] != self.path:
+            return 404
+        if self.secret and not hmac.compare_digest(headers.get(SECRET_HEADER, "").encode(), self.secret.encode()):
+            self.count("forbidden")
+            return 403
+        size = int(headers.get("Content-Length") or 0)
+        if size <= 0 or size > MAX_BODY:
+            self.count("bad")
+            return 413 if size > MAX_BODY else 400
+        try:
+            raw = json.loads(body.read(size))
+            update = types.Update.de_json(raw)
+        except Exception:
+            self.count("bad")
+            return 400
+        # backpressure: short wait for room, then let Telegram retry
+        if not self.dispatcher.queue.wait_below(self.dispatcher.max_pending, QUEUE_WAIT):
+            self.count("busy")
+            return 503
+        if not self._first_time(update.update_id):
+            self.count("duplicate")
+            return 200
+        self.dispatcher.submit(update)
+        self.count("accepted")
+        return 200
+
+    def _first_time(self, update_id: int) -> bool:
+        with self._lock:
+            if update_id in self._seen:
+                return False
+            self._seen.add(update_id)
+            self._seen_order.append(update_id)
+            if len(self._seen_order) > SEEN_IDS:
+                self._seen.discard(self._seen_order.popleft())
+            return True
+
+    def register(self) -> None:
+        if self.local:
+            check = "secret header checked" if self.secret else "no secret header check"
+            print(f"⚠️ {self.url} is not https: not registered with Telegram (local mode, {check})")
+            return
+        self.bot.set_webhook(url=self.url, secret_token=self.secret, max_connections=40)
+
+    def serve_forever(self) -> None:
+        self.register()
+        host, port = self.httpd.server_address[:2]
+        print(f"✅ Webhook listening on {host}:{port}{self.path}")
+        self.httpd.serve_forever()
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def replay(path: str, url: str, secret: str = WEBHOOK_SECRET) -> None:
+    import requests
+
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    try:
+        data = json.loads(text)
+        updates: List[dict] = data if isinstance(data, list) else [data]
+    except ValueError:
+        updates = [json.loads(line) for line in text.splitlines() if line.strip()]
+    for u in updates:
+        r = requests.post(url, json=u, headers={SECRET_HEADER: secret} if secret else {}, timeout=30)
+        print(f"update {u.get('update_id')}: {r.status_code}")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    secret = WEBHOOK_SECRET
+    if "--secret" in args:
+        i = args.index("--secret")
+        secret = args[i + 1] if i + 1 < len(args) else ""
+        del args[i:i + 2]
+    if not args:
+        print(__doc__)
+    else:
+        replay(args[0], args[1] if len(args) > 1 else (WEBHOOK_URL or f"http://127.0.0.1:{WEBHOOK_PORT}/"), secret)